@@ -3,14 +3,17 @@
 Loki Assistant — Speak-for-all fix
 Save as: Loki_assistant2_voice_for_all.py
 Run: python Loki_assistant2_voice_for_all.py
+Needs loki_core.py (capture, recognition and speech shared with loki_assistant2.py) alongside it.
 
-This version forces every assistant output to be spoken synchronously via speak_sync(),
-and also prints text to console. It still preserves fallback to PowerShell on Windows.
+This version speaks every assistant output through a single speech scheduler (one
+utterance at a time, errors and countdowns first) and also prints text to console. It falls back to a persistent synthesizer process (SAPI on Windows, espeak elsewhere).
 """
 
 import os
 import sys
 import threading
+import asyncio
+import concurrent.futures
 import time
 import queue
 import subprocess
@@ -18,44 +21,57 @@ import re
 import datetime
 import shutil
 import platform
+import argparse
+import tempfile
+import heapq
 
-# optional GUI libs
-try:
-    import tkinter as tk
-    from tkinter import ttk
-except Exception:
-    tk = None
+# module load is timed from here for --profile-startup
+LOAD_STARTED = time.perf_counter()
+
+# audio, speech and arithmetic pieces shared by both assistants
+from loki_core import (
+    IMPORT_TIMES, LazyModule, _importable,
+    RECOGNIZER_SAMPLE_RATE, RECOGNIZER_BACKEND,
+    PolyphaseResampler, MicrophoneStream, VoiceActivityDetector, UtteranceEndpointer,
+    GoogleRecognizerBackend, RECOGNIZER_BACKENDS, WakeWordGate,
+    PersistentSynthesizer, split_speech, SpeechCache, EchoGate, SpeechPlayer, AsyncStage, solve_arithmetic,
+)
+
+# ---------- Lazy imports ----------
+# optional GUI libs (loaded by the overlay thread)
+tk = LazyModule('tkinter', 'tk', globals())
+ttk = LazyModule('tkinter.ttk', 'ttk', globals())
 
 # optional PIL for GUI
-try:
-    from PIL import Image, ImageTk, ImageOps, ImageDraw
-except Exception:
-    Image = None
+Image = LazyModule('PIL.Image', 'Image', globals())
+ImageTk = LazyModule('PIL.ImageTk', 'ImageTk', globals())
+ImageOps = LazyModule('PIL.ImageOps', 'ImageOps', globals())
+ImageDraw = LazyModule('PIL.ImageDraw', 'ImageDraw', globals())
 
-# core voice & audio libs
-try:
-    import speech_recognition as sr
-except Exception:
+# core voice & audio libs, loaded on first use
+if not _importable('speech_recognition'):
     raise RuntimeError("Please install SpeechRecognition: pip install SpeechRecognition")
+sr = LazyModule('speech_recognition', 'sr', globals())
 
-try:
-    import pyttsx3
-except Exception:
-    pyttsx3 = None  # fallback will be PowerShell on Windows
+# without pyttsx3 the fallback will be the synthesizer process
+pyttsx3 = LazyModule('pyttsx3', 'pyttsx3', globals())
 
 # other helpful libs
+pyautogui = LazyModule('pyautogui', 'pyautogui', globals())
+sd = LazyModule('sounddevice', 'sd', globals())
+np = LazyModule('numpy', 'np', globals())
+psutil = LazyModule('psutil', 'psutil', globals())
 try:
     import webbrowser
-    import pyautogui
-    import sounddevice as sd
-    import numpy as np
     import wave
     from colorama import Fore, Style, init
-    import psutil
 except Exception:
     # proceed, but some features will be limited if missing
     pass
 
+# optional offline speech recognition
+vosk = LazyModule('vosk', 'vosk', globals())
+
 try:
     init(autoreset=True)
 except Exception:
@@ -66,7 +82,41 @@ NOTES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "loki_note
 USER_GIF = r"C:\Users\YOGESH\Downloads\tenor.gif"
 FALLBACK_GIF = r"/mnt/data/5df7237e-e9cd-4523-8b94-1b1552c8b555.gif"
 GIF_PATH = USER_GIF if os.path.exists(USER_GIF) else FALLBACK_GIF
-ENABLE_GUI = (tk is not None and Image is not None and os.path.exists(GIF_PATH))
+ENABLE_GUI = (os.path.exists(GIF_PATH) and _importable('tkinter') and _importable('PIL'))
+
+# fixed phrases loaded (or rendered into TTS_CACHE_DIR) at startup
+GREETING = "Voice initialized. Hello Yogesh. I will speak all responses."
+WARM_PHRASES = (
+    GREETING,
+    'Yes?',
+    '2',
+    '1',
+    "Sorry, I didn't catch that. Please say that again clearly.",
+    'Taking screenshot in 2 seconds.',
+    'Screenshot saved.',
+    'Opening Google Chrome.',
+    'Opening Visual Studio Code.',
+    'Goodbye. Exiting now.',
+)
+
+# Said while the assistant is talking: 'stop' silences it, 'next' skips to the next reply
+BARGE_IN_COMMANDS = {
+    'stop': 'stop', 'cancel': 'stop', 'quiet': 'stop', 'be quiet': 'stop', 'shut up': 'stop',
+    'enough': 'stop', 'stop talking': 'stop', 'next': 'next', 'skip': 'next', 'skip it': 'next',
+}
+
+# Speech priorities (lower speaks first): errors and countdowns, normal replies, chit-chat
+SPEECH_URGENT = 0
+SPEECH_NORMAL = 1
+SPEECH_CHAT = 2
+
+# The event loop hands blocking work to executors; recognition and actions that overrun
+# these timeouts (seconds) are abandoned so the assistant goes back to listening
+RECOGNIZE_TIMEOUT = 15.0
+ACTION_TIMEOUT = 20.0
+ACTION_WORKERS = 4
+# the overlay redraws every 200 ms; state changes are forwarded at most this often
+OVERLAY_INTERVAL = 0.1
 
 def safe_print(*args, **kwargs):
     try:
@@ -86,6 +136,167 @@ def find_process_by_name(name):
         pass
     return found
 
+# ---------- Speech scheduling ----------
+class SpeechHandle:
+    """One utterance handed to the SpeechScheduler.
+
+    `state` moves from 'queued' to 'speaking' and ends as 'done', 'cancelled' or
+    'failed'; wait() blocks until it ends and returns False on timeout.
+    """
+
+    def __init__(self, scheduler, text, priority, seq):
+        self.scheduler = scheduler
+        self.text = text
+        self.priority = priority
+        self.seq = seq
+        self.state = 'queued'
+        self.queued_at = time.perf_counter()
+        self.started_at = None
+        self.finished_at = None
+        self._cancel_requested = False
+        self._done = threading.Event()
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+    @property
+    def done(self):
+        return self._done.is_set()
+
+    def wait(self, timeout=None):
+        return self._done.wait(timeout)
+
+    def cancel(self):
+        self.scheduler.cancel(self)
+
+    def _finish(self, state):
+        self.state = state
+        self.finished_at = time.perf_counter()
+        self._done.set()
+
+class SpeechScheduler:
+    """Sole owner of speech output: one worker speaks queued utterances by priority.
+
+    Lower numbers go first and equal priorities keep their order. A request made with
+    `preempt=True` cuts off an in-flight utterance of lower priority, which ends as
+    cancelled rather than being resumed. `speak_fn(text)` blocks while it talks and
+    `interrupt_fn()` makes it return early (only rendered playback can be cut short).
+    """
+
+    def __init__(self, speak_fn, interrupt_fn=None):
+        self.speak_fn = speak_fn
+        self.interrupt_fn = interrupt_fn
+        self.current = None
+        self.spoken = 0
+        self.cancelled = 0
+        self.preempted = 0
+        self.failed = 0
+        self.started = 0
+        self.total_wait = 0.0
+        self._heap = []
+        self._seq = 0
+        self._closing = False
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="loki-speech", daemon=True)
+        self._thread.start()
+
+    def submit(self, text, priority=SPEECH_NORMAL, preempt=False):
+        with self._cond:
+            self._seq += 1
+            handle = SpeechHandle(self, text, priority, self._seq)
+            if self._closing:
+                handle._finish('cancelled')
+                return handle
+            heapq.heappush(self._heap, handle)
+            current = self.current
+            if preempt and current is not None and current.priority > priority:
+                self.preempted += 1
+                self._interrupt(current)
+            self._cond.notify()
+        return handle
+
+    def _interrupt(self, handle):
+        handle._cancel_requested = True
+        if self.interrupt_fn:
+            self.interrupt_fn()
+
+    def cancel(self, handle):
+        with self._cond:
+            if handle.state == 'queued':
+                # left in the heap; the worker skips it
+                self.cancelled += 1
+                handle._finish('cancelled')
+            elif handle is self.current:
+                self._interrupt(handle)
+
+    def cancel_all(self):
+        """Drop everything queued and cut off what is playing."""
+        with self._cond:
+            for handle in self._heap:
+                if handle.state == 'queued':
+                    self.cancelled += 1
+                    handle._finish('cancelled')
+            self._heap = []
+            if self.current is not None:
+                self._interrupt(self.current)
+
+    @property
+    def depth(self):
+        with self._cond:
+            return sum(1 for handle in self._heap if handle.state == 'queued')
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._heap and not self._closing:
+                    self._cond.wait()
+                if not self._heap:
+                    return
+                handle = heapq.heappop(self._heap)
+                if handle.state != 'queued':
+                    continue
+                handle.state = 'speaking'
+                handle.started_at = time.perf_counter()
+                self.current = handle
+            try:
+                self.speak_fn(handle.text)
+                state = 'cancelled' if handle._cancel_requested else 'done'
+            except Exception as e:
+                safe_print("Speech failed:", e)
+                state = 'failed'
+            with self._cond:
+                self.current = None
+                self.started += 1
+                self.total_wait += handle.started_at - handle.queued_at
+                if state == 'done':
+                    self.spoken += 1
+                elif state == 'cancelled':
+                    self.cancelled += 1
+                else:
+                    self.failed += 1
+                handle._finish(state)
+
+    def close(self, timeout=10.0):
+        """Finish what is queued (up to `timeout` seconds), then stop the worker."""
+        with self._cond:
+            self._closing = True
+            self._cond.notify()
+        self._thread.join(timeout)
+        if self._thread.is_alive():
+            self.cancel_all()
+            self._thread.join(1.0)
+
+    def stats(self):
+        with self._cond:
+            return {
+                'depth': sum(1 for handle in self._heap if handle.state == 'queued'),
+                'spoken': self.spoken,
+                'cancelled': self.cancelled,
+                'preempted': self.preempted,
+                'failed': self.failed,
+                'avg_wait_ms': 1000.0 * self.total_wait / (self.started or 1),
+            }
+
 # ---------- Optional overlay GUI ----------
 class OverlayGUI(threading.Thread):
     def __init__(self, gif_path, queue_in=None, size=120):
@@ -215,83 +426,146 @@ class OverlayGUI(threading.Thread):
 
 # ---------- LokiAssistant (synchronous TTS for every output) ----------
 class LokiAssistant:
-    def __init__(self, overlay_queue=None):
-        # engine + lock
-        self.engine = None
+    def __init__(self, overlay_queue=None, recognizer_backend=None):
+        # the voice engine starts on first use (or ahead of it, see run())
+        self._engine = None
+        self._engine_ready = False
+        self._engine_starting = False
+        self._engine_init_lock = threading.RLock()
+        self.engine_init_time = None
+        self.capture_init_time = None
         self.engine_lock = threading.Lock()
         self.available_voice_names = []
         self.current_voice_index = 0
 
-        # try to init pyttsx3 robustly
-        if pyttsx3 is not None:
-            drivers = []
-            sysname = platform.system().lower()
-            if sysname == 'windows':
-                drivers = ['sapi5', None]
-            elif sysname == 'darwin':
-                drivers = ['nsss', None]
-            else:
-                drivers = [None, 'espeak']
-            for d in drivers:
-                try:
-                    if d:
-                        self.engine = pyttsx3.init(driverName=d)
-                    else:
-                        self.engine = pyttsx3.init()
-                    if self.engine:
-                        break
-                except Exception:
-                    self.engine = None
-            if self.engine:
-                try:
-                    voices = self.engine.getProperty('voices')
-                    try:
-                        self.available_voice_names = [getattr(v,'name',v.id) for v in voices]
-                    except Exception:
-                        self.available_voice_names = [v.id for v in voices]
-                    self.current_voice_index = 0
-                    try:
-                        self.engine.setProperty('voice', voices[self.current_voice_index].id)
-                    except Exception:
-                        pass
-                    try:
-                        self.engine.setProperty('rate', 150)
-                    except Exception:
-                        pass
-                    try:
-                        self.engine.setProperty('volume', 1.0)
-                    except Exception:
-                        pass
-                    safe_print("TTS engine initialized:", type(self.engine))
-                except Exception as e:
-                    safe_print("TTS setup error:", e)
-                    self.engine = None
-            else:
-                safe_print("pyttsx3 init failed; will fallback to PowerShell on Windows.")
-        else:
-            safe_print("pyttsx3 not installed; will fallback to PowerShell on Windows.")
+        # speech is rendered and played here so the microphone can tell it apart from the user
+        self.echo_cancellation = True
+        self.echo_gate = None
+        self.player = SpeechPlayer(self._on_playback_start, self._on_playback_stop)
+        # one synthesizer process for the whole session, started on first use
+        self.synthesizer = PersistentSynthesizer()
+        self.speech_cache = SpeechCache()
 
-        # small queue retained (not required now but useful)
-        self.tts_queue = queue.Queue(maxsize=256)
-        self._tts_running = True
-        self.tts_thread = threading.Thread(target=self._tts_worker, daemon=True)
-        self.tts_thread.start()
+        # every utterance goes through one scheduler thread that owns the voice
+        self.speech = SpeechScheduler(self.speak_sync, self.player.stop)
 
         # speech recognizer
         self.recognizer = sr.Recognizer()
+        self.recognizer_backend = self._make_recognizer_backend(recognizer_backend)
+        self.wake_gate = WakeWordGate()
+        if self.wake_gate.enabled:
+            safe_print(f"Wake word gate on ({len(self.wake_gate.templates)} templates, "
+                       f"threshold {self.wake_gate.threshold:.3f})")
         self.listen_duration = 6
+        self.sample_rate = RECOGNIZER_SAMPLE_RATE
+        self.mic = None
+        self.endpointer = None
+        self.vad_hangover_ms = 300
+        self._capture_pos = None
         self._suppress_listen = False
         self._last_spoken_time = 0
         self.print_responses = True
+        self.pipeline_queue_size = 4
+        self.stages = []
+        # event loop core (see serve()): blocking libraries run in these executors
+        self.loop = None
+        self.executors = self._make_executors()
+        self._stopping = None
+        self._overlay_events = None
+        self._stop_event = threading.Event()
 
         self.overlay_queue = overlay_queue
 
-        self.operators = {'+':lambda x,y: x+y, '-':lambda x,y:x-y, '*':lambda x,y:x*y, '/':lambda x,y: x/y if y!=0 else None}
+    @property
+    def engine(self):
+        if self._engine_ready:
+            return self._engine
+        return self.init_engine()
+
+    @engine.setter
+    def engine(self, value):
+        self._engine = value
+        if not self._engine_starting:
+            self._engine_ready = True
 
-    # this always attempts to speak synchronously (so voice occurs now)
+    def init_engine(self):
+        """Start pyttsx3 and pick a voice, once; callers that need it meanwhile wait here."""
+        with self._engine_init_lock:
+            # setup below reads self.engine again on this thread
+            if self._engine_ready or self._engine_starting:
+                return self._engine
+            self._engine_starting = True
+            start = time.perf_counter()
+            # try to init pyttsx3 robustly
+            if pyttsx3:
+                drivers = []
+                sysname = platform.system().lower()
+                if sysname == 'windows':
+                    drivers = ['sapi5', None]
+                elif sysname == 'darwin':
+                    drivers = ['nsss', None]
+                else:
+                    drivers = [None, 'espeak']
+                for d in drivers:
+                    try:
+                        if d:
+                            self.engine = pyttsx3.init(driverName=d)
+                        else:
+                            self.engine = pyttsx3.init()
+                        if self.engine:
+                            break
+                    except Exception:
+                        self.engine = None
+                if self.engine:
+                    try:
+                        voices = self.engine.getProperty('voices')
+                        try:
+                            self.available_voice_names = [getattr(v,'name',v.id) for v in voices]
+                        except Exception:
+                            self.available_voice_names = [v.id for v in voices]
+                        self.current_voice_index = 0
+                        try:
+                            self.engine.setProperty('voice', voices[self.current_voice_index].id)
+                        except Exception:
+                            pass
+                        try:
+                            self.engine.setProperty('rate', 150)
+                        except Exception:
+                            pass
+                        try:
+                            self.engine.setProperty('volume', 1.0)
+                        except Exception:
+                            pass
+                        safe_print("TTS engine initialized:", type(self.engine))
+                    except Exception as e:
+                        safe_print("TTS setup error:", e)
+                        self.engine = None
+                else:
+                    safe_print("pyttsx3 init failed; will fall back to the synthesizer process.")
+            else:
+                safe_print("pyttsx3 not installed; will fall back to the synthesizer process.")
+            self.engine_init_time = time.perf_counter() - start
+            self._engine_starting = False
+            self._engine_ready = True
+            return self._engine
+
+    def _make_recognizer_backend(self, name=None):
+        name = name or RECOGNIZER_BACKEND
+        try:
+            if name == 'google':
+                return GoogleRecognizerBackend(self.recognizer)
+            return RECOGNIZER_BACKENDS[name]()
+        except Exception as e:
+            safe_print(f"Recognizer backend '{name}' unavailable ({e}); using Google")
+            return GoogleRecognizerBackend(self.recognizer)
+
+    # speaks on the calling thread; only the SpeechScheduler worker calls this
     def speak_sync(self, text):
         if not text:
             return
+        # rendered speech carries an echo reference, so listening carries on meanwhile
+        if self._speak_rendered(text):
+            return
         # suppress listening while speaking to avoid self-trigger
         try:
             self._suppress_listen = True
@@ -315,10 +589,10 @@ class LokiAssistant:
                 return
             except Exception as e:
                 safe_print("Engine speak failed:", e)
-        # PowerShell fallback on Windows
-        if platform.system().lower() == 'windows':
+        # persistent synthesizer process (SAPI host on Windows, espeak elsewhere)
+        if self.synthesizer.available:
             try:
-                self._powershell_speak(text)
+                self.synthesizer.speak(text, voice=self._synth_voice())
                 try:
                     self._last_spoken_time = time.time()
                 except Exception:
@@ -329,7 +603,7 @@ class LokiAssistant:
                     pass
                 return
             except Exception as e:
-                safe_print("PowerShell speak failed:", e)
+                safe_print("Synthesizer speak failed:", e)
         # final fallback: print only
         safe_print("TTS unavailable; would have spoken:", text)
         try:
@@ -337,141 +611,316 @@ class LokiAssistant:
         except Exception:
             pass
 
-    # public speak: print + immediate speak_sync (ensures voice)
-    def speak(self, text):
+    # public speak: print now, voice through the scheduler
+    def speak(self, text, wait=False, priority=SPEECH_NORMAL, preempt=False):
+        """Queue `text` to be spoken and return its SpeechHandle (after it has played if `wait`).
+
+        `preempt` cuts off a lower-priority utterance that is already playing.
+        """
         if not text:
-            return
-        # overlay update
-        try:
-            if self.overlay_queue:
-                self.overlay_queue.put(('assistant', text))
-        except Exception:
-            pass
+            return None
+        self._post_overlay('assistant', text)
         # print
         if self.print_responses:
             try:
                 print(f"Assistant: {text}")
             except Exception:
                 safe_print("Assistant:", text)
-        # attempt to enqueue for worker (kept) but will always call sync to guarantee voice
-        try:
-            self.tts_queue.put_nowait(text)
-        except Exception:
-            pass
-        # synchronous speak to ensure voice now
-        self.speak_sync(text)
+        handle = self.speech.submit(text, priority, preempt)
+        if wait:
+            handle.wait()
+        return handle
 
-    def _tts_worker(self):
-        # background worker: still consumes queue and tries to speak (if for some reason speak_sync failed earlier)
-        while getattr(self, '_tts_running', True):
-            try:
-                text = self.tts_queue.get(timeout=0.2)
-            except queue.Empty:
-                continue
-            if text is None:
-                break
-            # try speak_sync (will short-circuit to engine/powershell)
-            try:
-                self.speak_sync(text)
-            except Exception as e:
-                safe_print("Worker speak_sync failed:", e)
+    def _speech_key(self, text):
+        # whatever renders the text decides how it sounds
+        if self.engine:
+            with self.engine_lock:
+                voice = self.engine.getProperty('voice')
+                rate = self.engine.getProperty('rate')
+                volume = self.engine.getProperty('volume')
+            return (text, f"engine:{voice}", rate, volume)
+        return (text, f"host:{self._synth_voice()}", 0, 100)
+
+    def render_speech(self, text):
+        """Return `text` as (int16 PCM, sample rate), from the SpeechCache when it was rendered before."""
+        key = self._speech_key(text)
+        rendered = self.speech_cache.get(key)
+        if rendered is None:
+            rendered = self._render(text)
+            if rendered is not None:
+                self.speech_cache.put(key, *rendered)
+        return rendered
+
+    def warm_speech_cache(self, phrases=WARM_PHRASES):
+        """Load fixed phrases from the disk cache, rendering any that were never rendered."""
+        for chunk in (chunk for text in phrases for chunk in split_speech(text)):
+            if self._stop_event.is_set():
+                return
+            key = self._speech_key(chunk)
+            if self.speech_cache.get(key, count=False) is None:
+                rendered = self._render(chunk)
+                if rendered is not None:
+                    self.speech_cache.put(key, *rendered)
+
+    def _render(self, text):
+        """Synthesize `text` to (int16 PCM, sample rate) without playing it; None if unavailable."""
+        if not self.engine and not self.synthesizer.available:
+            return None
+        fd, path = tempfile.mkstemp(prefix='loki_tts_', suffix='.wav')
+        os.close(fd)
+        try:
+            if self.engine:
+                with self.engine_lock:
+                    self.engine.save_to_file(text, path)
+                    self.engine.runAndWait()
+            else:
+                self.synthesizer.speak(text, voice=self._synth_voice(), path=path)
+            with wave.open(path, 'rb') as wf:
+                if wf.getsampwidth() != 2:
+                    return None
+                channels = wf.getnchannels()
+                pcm = np.frombuffer(wf.readframes(wf.getnframes()), dtype=np.int16)
+                rate = wf.getframerate()
+            if channels > 1:
+                pcm = pcm[::channels]
+            return (pcm, rate) if pcm.size else None
+        except Exception as e:
+            safe_print("render_speech error:", e)
+            return None
+        finally:
             try:
-                self.tts_queue.task_done()
-            except Exception:
+                os.remove(path)
+            except OSError:
                 pass
-            time.sleep(0.01)
 
-    def _powershell_speak(self, text: str):
-        if not text:
-            return
-        if platform.system().lower() != 'windows':
-            raise RuntimeError("PowerShell TTS only on Windows")
+    def _speak_rendered(self, text):
+        """Stream `text` a sentence at a time through the SpeechPlayer; False if it couldn't be rendered."""
+        started = time.perf_counter()
+        chunks = split_speech(text)
+        if not chunks:
+            return False
+        if self.echo_cancellation:
+            render = self.render_speech
+        else:
+            # phrases rendered before still play straight to the device
+            cached = [self.speech_cache.get(self._speech_key(chunk)) for chunk in chunks]
+            if any(rendered is None for rendered in cached):
+                return False
+            render = dict(zip(chunks, cached)).get
+        first = render(chunks[0])
+        if first is None:
+            return False
+
+        def rendered():
+            # sentence N+1 is synthesized here while sentence N plays
+            yield first
+            for chunk in chunks[1:]:
+                pcm = render(chunk)
+                if pcm is None:
+                    safe_print("Could not render:", chunk)
+                    return
+                yield pcm
+
         try:
-            safe = str(text).replace("'", "''").replace('"', '""')
-            ps_script = (
-                "Add-Type -AssemblyName System.Speech; "
-                "$synth = New-Object System.Speech.Synthesis.SpeechSynthesizer; "
-                "$synth.Volume = 100; $synth.Rate = 0; $synth.Speak([string]'{SAFE}'); "
-                "$synth.Dispose();"
-            ).replace('{SAFE}', safe)
-            cmd = ['powershell', '-NoProfile', '-NonInteractive', '-Command', ps_script]
-            creationflags = 0
-            if hasattr(subprocess, "CREATE_NO_WINDOW"):
-                creationflags = subprocess.CREATE_NO_WINDOW
-            result = subprocess.run(cmd, shell=False, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, creationflags=creationflags)
-            if result.returncode != 0:
-                raise Exception(result.stderr.strip())
+            self.player.play_stream(rendered(), started)
         except Exception as e:
-            raise
+            safe_print("Playback failed:", e)
+            return False
+        return True
+
+    def _on_playback_start(self, pcm, rate, delay):
+        mic = self.mic
+        if mic is None or self.echo_gate is None:
+            return
+        ref = pcm if rate == mic.sample_rate else PolyphaseResampler(rate, mic.sample_rate).process(pcm)
+        self.echo_gate.add_reference(mic.ring.position + int(delay * mic.sample_rate), ref)
+
+    def _on_playback_stop(self):
+        if self.mic is not None and self.echo_gate is not None:
+            self.echo_gate.truncate(self.mic.ring.position)
+
+    @property
+    def is_speaking(self):
+        return self.player.is_playing
+
+    def stop_speaking(self, clear_queue=True):
+        """Cut the current utterance short and, with `clear_queue`, drop what was queued after it."""
+        if clear_queue:
+            self.speech.cancel_all()
+        elif self.speech.current is not None:
+            self.speech.cancel(self.speech.current)
+
+    def handle_barge_in(self, command, over_speech=None):
+        """Act on 'stop' / 'next' said over the assistant; True if `command` was one.
+
+        `over_speech` is whether the utterance was captured while the assistant could be
+        heard (see capture_utterance); without it, whether it is talking right now.
+        """
+        if not (self.is_speaking if over_speech is None else over_speech):
+            return False
+        phrase = re.sub(r"[^a-z ]", '', command.lower())
+        phrase = re.sub(r"\b(loki|hey|please|okay|ok)\b", '', phrase)
+        action = BARGE_IN_COMMANDS.get(' '.join(phrase.split()))
+        if action is None:
+            return False
+        self.stop_speaking(clear_queue=(action == 'stop'))
+        return True
+
+    def _synth_voice(self):
+        # SAPI picks voices by name; the espeak host keeps its default voice
+        if platform.system().lower() != 'windows':
+            return None
+        if self.available_voice_names and 0 <= self.current_voice_index < len(self.available_voice_names):
+            return str(self.available_voice_names[self.current_voice_index])
+        return None
 
     # audio recording helpers
-    def record_audio(self, duration=None, sample_rate=44100):
+    def _ensure_capture(self):
+        if self.mic is None:
+            self.mic = MicrophoneStream(sample_rate=self.sample_rate)
+        self.mic.start()
+        if self.endpointer is None:
+            vad = VoiceActivityDetector(self.mic.sample_rate)
+            self.echo_gate = EchoGate(self.mic.sample_rate, vad.frame_len)
+            self.endpointer = UtteranceEndpointer(vad, hangover_ms=self.vad_hangover_ms,
+                                                  echo_gate=self.echo_gate)
+        if self._capture_pos is None:
+            self._capture_pos = self.mic.ring.position
+        return self.mic
+
+    def _discard_captured(self):
+        """Skip everything captured so far (e.g. while the assistant was talking)."""
+        if self.mic is not None:
+            self._capture_pos = self.mic.ring.position
+
+    def record_audio(self, duration=None):
+        """Return the next `duration` seconds of microphone audio, continuing where the last window ended."""
         duration = duration or self.listen_duration
         try:
-            rec = sd.rec(int(duration * sample_rate), samplerate=sample_rate, channels=1)
-            sd.wait()
-            return rec.flatten()
+            mic = self._ensure_capture()
+            ring = mic.ring
+            start = max(self._capture_pos, ring.oldest)
+            end = start + int(duration * mic.sample_rate)
+            ring.wait_for(end, timeout=duration + 1.0)
+            rec = ring.read(start, end)
+            self._capture_pos = start + len(rec)
+            return rec
         except Exception as e:
             safe_print("record_audio error:", e)
             return np.zeros(1)
 
-    def save_audio(self, recording, filename="temp.wav", sample_rate=44100):
+    def capture_utterance(self, timeout=None):
+        """Wait for the next spoken utterance and return it as sr.AudioData, silence trimmed.
+
+        Returns as soon as the endpointer sees the hangover after speech ends, or None
+        if nothing was said within `timeout` seconds (default: listen_duration). The
+        PCM is copied out of the ring buffer once, straight into the AudioData.
+        """
+        timeout = timeout or self.listen_duration
+        mic = self._ensure_capture()
+        ring = mic.ring
+        ep = self.endpointer
+        frame_len = ep.frame_len
+        ep.reset()
+        pos = max(self._capture_pos, ring.oldest)
+        deadline = time.time() + timeout
+        while True:
+            if pos < ring.oldest:
+                # fell behind the ring buffer; restart from the oldest audio still held
+                pos = ring.oldest
+                ep.reset()
+            n_frames = (ring.position - pos) // frame_len
+            if n_frames == 0:
+                if not ep.in_speech and (time.time() >= deadline or self._stop_event.is_set()):
+                    self._capture_pos = pos
+                    return None
+                ring.wait_for(pos + frame_len, timeout=0.1)
+                continue
+            end = pos + n_frames * frame_len
+            block = ring.read(pos, end)
+            if len(block) != end - pos:
+                continue
+            bounds = ep.feed(block.reshape(n_frames, frame_len), pos)
+            pos = end
+            if bounds:
+                self._capture_pos = bounds[1]
+                audio = sr.AudioData(ring.read_bytes(*bounds), mic.sample_rate, 2)
+                # said over the assistant or not is fixed here, however long recognition takes
+                audio.over_speech = self.echo_gate.overlaps(*bounds)
+                return audio
+
+    def save_audio(self, audio, filename="temp.wav"):
+        """Write a captured utterance to a WAV file (for debugging; listen() never touches disk)."""
         try:
             with wave.open(filename, 'wb') as wf:
                 wf.setnchannels(1)
-                wf.setsampwidth(2)
-                wf.setframerate(sample_rate)
-                wf.writeframes((recording * 32767).astype(np.int16).tobytes())
+                wf.setsampwidth(audio.sample_width)
+                wf.setframerate(audio.sample_rate)
+                wf.writeframes(audio.frame_data)
         except Exception as e:
             safe_print("save_audio error:", e)
 
-    def listen(self):
-        try:
-            if self.overlay_queue:
-                self.overlay_queue.put(('listening', True))
-        except Exception:
-            pass
+    def listen_for_utterance(self):
+        """Capture the next utterance, skipping audio heard while an unrendered voice talks."""
+        self._post_overlay('listening', True)
         try:
             if getattr(self, '_suppress_listen', False):
-                return ""
-            last = getattr(self, '_last_spoken_time', 0)
-            if time.time() - last < 0.6:
-                return ""
-            recording = self.record_audio()
-            temp_file = "temp_recording.wav"
-            self.save_audio(recording, temp_file)
-            with sr.AudioFile(temp_file) as source:
-                audio = self.recognizer.record(source)
-                try:
-                    command = self.recognizer.recognize_google(audio).lower()
-                except sr.UnknownValueError:
-                    self.speak("Sorry, I didn't catch that. Please say that again clearly.")
-                    command = ""
-                except sr.RequestError as e:
-                    safe_print("recognize_google error:", e)
-                    self.speak("Sorry, speech service error.")
-                    command = ""
-                except Exception as e:
-                    safe_print("recognize error:", e)
-                    self.speak("Sorry, I couldn't reach the speech service.")
-                    command = ""
-            try:
-                os.remove(temp_file)
-            except Exception:
-                pass
-            if command:
-                safe_print("You said:", command)
-            return command
+                self._discard_captured()
+                return None
+            # let the fallback voice's tail die away: sleep out the rest of the window
+            # (or until stopped) instead of coming straight back to spin on it
+            remaining = getattr(self, '_last_spoken_time', 0) + 0.6 - time.time()
+            if remaining > 0:
+                self._stop_event.wait(remaining)
+                self._discard_captured()
+                return None
+            audio = self.capture_utterance()
+            # only audio after the wake word reaches the recognizer
+            if audio is not None and self.wake_gate.enabled:
+                gated = self.wake_gate.check(audio)
+                if self.wake_gate.woke:
+                    self.speak("Yes?", priority=SPEECH_URGENT, preempt=True)
+                if gated is not None:
+                    gated.over_speech = audio.over_speech
+                elif audio.over_speech and not self.wake_gate.woke:
+                    gated = audio  # 'stop' / 'next' over the assistant need no wake word
+                audio = gated
+            if audio is not None and audio.over_speech:
+                # whatever the echo gate let through, over the assistant's own voice only
+                # 'stop' / 'next' are acted on, so it can never answer itself
+                audio.barge_in_only = True
+            return audio
         except Exception as e:
             safe_print("listen error:", e)
-            self.speak("Microphone error. Please ensure microphone is connected.")
-            return ""
+            self.speak("Microphone error. Please ensure microphone is connected.", priority=SPEECH_URGENT)
+            return None
         finally:
-            try:
-                if self.overlay_queue:
-                    self.overlay_queue.put(('listening', False))
-            except Exception:
-                pass
+            self._post_overlay('listening', False)
+
+    def recognize(self, audio):
+        try:
+            command = self.recognizer_backend.recognize(audio).lower()
+        except sr.UnknownValueError:
+            if not getattr(audio, 'barge_in_only', False):
+                self.speak("Sorry, I didn't catch that. Please say that again clearly.", priority=SPEECH_URGENT)
+            command = ""
+        except sr.RequestError as e:
+            safe_print("recognize_google error:", e)
+            self.speak("Sorry, speech service error.", priority=SPEECH_URGENT)
+            command = ""
+        except Exception as e:
+            safe_print("recognize error:", e)
+            self.speak("Sorry, I couldn't reach the speech service.", priority=SPEECH_URGENT)
+            command = ""
+        if command:
+            safe_print("You said:", command)
+        return command
+
+    def listen(self):
+        audio = self.listen_for_utterance()
+        if audio is None:
+            return ""
+        return self._recognize_stage(audio) or ""
 
     # simple open_app example ensures speak() used
     def open_app(self, key, url=None):
@@ -519,11 +968,11 @@ class LokiAssistant:
                         subprocess.Popen([path], shell=False)
                         self.speak("Opening Visual Studio Code.")
                         return True
-                self.speak("Could not open VS Code.")
+                self.speak("Could not open VS Code.", priority=SPEECH_URGENT)
                 return False
         except Exception as e:
             safe_print("open_app error:", e)
-            self.speak("Error while opening the application.")
+            self.speak("Error while opening the application.", priority=SPEECH_URGENT)
             return False
 
     def close_app(self, app_name):
@@ -541,31 +990,11 @@ class LokiAssistant:
             return True
         except Exception as e:
             safe_print("close_app error:", e)
-            self.speak("I couldn't close the application.")
+            self.speak("I couldn't close the application.", priority=SPEECH_URGENT)
             return False
 
     def solve_math(self, text):
-        try:
-            expr = text.lower().replace('what is','').replace("what's","").replace('calculate','').strip()
-            expr = expr.replace('plus','+').replace('minus','-').replace('times','*').replace('x','*').replace('divided by','/')
-            nums = re.findall(r'-?\d+(?:\.\d+)?', expr)
-            if len(nums) < 2:
-                return None
-            op = re.search(r'[\+\-\*/]', expr)
-            if not op:
-                return None
-            a = float(nums[0]); b = float(nums[1])
-            operation = op.group()
-            if operation in self.operators:
-                res = self.operators[operation](a,b)
-                if res is None:
-                    return None
-                if float(res).is_integer():
-                    return int(res)
-                return round(res,6)
-            return None
-        except Exception:
-            return None
+        return solve_arithmetic(text)
 
     def process_command(self, command):
         if not command:
@@ -587,7 +1016,7 @@ class LokiAssistant:
             return True
 
         if "screenshot" in cmd or "capture" in cmd:
-            self.speak("Taking screenshot in 2 seconds.")
+            self.speak("Taking screenshot in 2 seconds.", priority=SPEECH_URGENT, preempt=True)
             self.take_screenshot()
             return True
 
@@ -596,23 +1025,26 @@ class LokiAssistant:
             self.speak(f"The current time is {t}")
             return True
 
-        if any(op in cmd for op in ['plus','minus','times','divided by','+','-','*','/']) and any(ch.isdigit() for ch in cmd):
+        is_search = cmd.startswith("search") or cmd.startswith("google") or "search for" in cmd
+        if not is_search and any(op in cmd for op in ['plus','minus','times','divided by','power of','squared','percent','+','-','*','/']):
+            # spoken numbers ("twelve hundred") parse too; only a sum with digits is worth an apology
             res = self.solve_math(cmd)
             if res is not None:
                 self.speak(f"The answer is {res}")
-            else:
-                self.speak("I couldn't solve that. Try simple arithmetic.")
-            return True
+                return True
+            if any(ch.isdigit() for ch in cmd):
+                self.speak("I couldn't solve that. Try simple arithmetic.", priority=SPEECH_URGENT)
+                return True
 
         if "who are you" in cmd:
-            self.speak("I am Loki, your assistant. I will speak all outputs.")
+            self.speak("I am Loki, your assistant. I will speak all outputs.", priority=SPEECH_CHAT)
             return True
 
         if "quit" in cmd or "exit" in cmd or "stop" in cmd:
             self.speak("Goodbye. Exiting now.")
             return False
 
-        if cmd.startswith("search") or cmd.startswith("google") or "search for" in cmd:
+        if is_search:
             q = re.sub(r'^(search|google)\s*', '', cmd).strip()
             if not q:
                 self.speak("What would you like me to search for?")
@@ -622,7 +1054,7 @@ class LokiAssistant:
             return True
 
         # default: always speak the response
-        self.speak("I heard: " + cmd)
+        self.speak("I heard: " + cmd, priority=SPEECH_CHAT)
         return True
 
     def take_screenshot(self):
@@ -632,7 +1064,8 @@ class LokiAssistant:
                 os.makedirs(screenshots_dir)
             self._suppress_listen = True
             for i in range(2,0,-1):
-                self.speak(str(i))
+                # the countdown has to be heard on time, so wait for each number
+                self.speak(str(i), wait=True, priority=SPEECH_URGENT, preempt=True)
                 time.sleep(1)
             img = pyautogui.screenshot()
             fn = f'screenshot_{datetime.datetime.now().strftime("%Y%m%d_%H%M%S")}.png'
@@ -650,31 +1083,220 @@ class LokiAssistant:
                 pass
         except Exception as e:
             safe_print("take_screenshot error:", e)
-            self.speak("Could not take screenshot.")
+            self.speak("Could not take screenshot.", priority=SPEECH_URGENT)
 
-    def run(self):
-        self.speak("Voice initialized. Hello Yogesh. I will speak all responses.")
-        running = True
-        while running:
-            cmd = self.listen()
-            if cmd:
-                running = self.process_command(cmd)
-            time.sleep(0.05)
+    # event loop core: capture -> recognize -> dispatch and the overlay bridge run as tasks
+    def _capture_stage(self):
+        audio = self.listen_for_utterance()
+        if audio is None and self._suppress_listen:
+            self._stop_event.wait(0.05)
+        return audio
 
-    def shutdown(self):
+    def _recognize_stage(self, audio):
+        # 'stop' / 'next' over the assistant's speech cut it short instead of being dispatched
+        command = self.recognize(audio)
+        if command and self.handle_barge_in(command, getattr(audio, 'over_speech', None)):
+            return None
+        if getattr(audio, 'barge_in_only', False):
+            return None  # heard over the assistant without the wake word
+        return command
+
+    def _dispatch_stage(self, cmd):
+        if not self.process_command(cmd):
+            self.stop()
+
+    def _on_action_timeout(self, cmd):
+        self.speak("That is taking a while, so I'll keep listening.", priority=SPEECH_URGENT)
+
+    def pipeline_stats(self):
+        return {stage.stage_name: stage.stats() for stage in self.stages}
+
+    def _make_executors(self):
+        pool = concurrent.futures.ThreadPoolExecutor
+        return {
+            'audio': pool(1, thread_name_prefix='loki-audio'),
+            # an abandoned recognition or action keeps its thread until it returns
+            'recognize': pool(2, thread_name_prefix='loki-recognize'),
+            'actions': pool(ACTION_WORKERS, thread_name_prefix='loki-actions'),
+            'background': pool(1, thread_name_prefix='loki-background'),
+        }
+
+    async def serve(self, warm_cache=False):
+        """Run the assistant on the current event loop until stop() (or cancellation).
+
+        Capture, recognition and dispatch are AsyncStage tasks joined by bounded queues and
+        the overlay bridge is a task of its own; speech keeps its SpeechScheduler thread.
+        The recognizer, pyautogui and psutil only ever run in executors.
+        """
+        loop = asyncio.get_running_loop()
+        self._stopping = asyncio.Event()
+        self._overlay_events = asyncio.Queue()
+        self.loop = loop
+        if self._stop_event.is_set():
+            self._stopping.set()
+        audio_queue = asyncio.Queue(maxsize=self.pipeline_queue_size)
+        command_queue = asyncio.Queue(maxsize=self.pipeline_queue_size)
+        self.stages = [
+            AsyncStage('capture', self._capture_stage, None, audio_queue, self.executors['audio']),
+            AsyncStage('recognize', self._recognize_stage, audio_queue, command_queue,
+                       self.executors['recognize'], RECOGNIZE_TIMEOUT),
+            AsyncStage('dispatch', self._dispatch_stage, command_queue, None,
+                       self.executors['actions'], ACTION_TIMEOUT, self._on_action_timeout),
+        ]
+        tasks = [asyncio.create_task(stage.run(), name=f"loki-{stage.stage_name}") for stage in self.stages]
+        if self.overlay_queue:
+            tasks.append(asyncio.create_task(self._overlay_bridge(), name="loki-overlay"))
+        if warm_cache:
+            tasks.append(loop.run_in_executor(self.executors['background'], self.warm_speech_cache))
         try:
-            self._tts_running = False
+            await self._stopping.wait()
+        finally:
+            self._stop_event.set()
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            events, self._overlay_events = self._overlay_events, None
+            while not events.empty():
+                self._post_overlay(*events.get_nowait())
+            self.loop = None
+
+    async def _overlay_bridge(self):
+        # listening flips on every capture; forward only the latest value per key
+        events = self._overlay_events
+        while True:
+            latest = dict([await events.get()])
+            while not events.empty():
+                key, value = events.get_nowait()
+                latest[key] = value
+            for item in latest.items():
+                self.overlay_queue.put(item)
+            await asyncio.sleep(OVERLAY_INTERVAL)
+
+    def _post_overlay(self, key, value):
+        """Send a state change to the overlay, through the bridge task while the loop runs."""
+        if not self.overlay_queue:
+            return
+        loop, events = self.loop, self._overlay_events
+        if loop is not None and events is not None:
             try:
-                self.tts_queue.put_nowait(None)
-            except Exception:
-                pass
-            if self.tts_thread.is_alive():
-                self.tts_thread.join(timeout=1)
+                loop.call_soon_threadsafe(events.put_nowait, (key, value))
+                return
+            except RuntimeError:
+                pass  # the loop has just closed
+        try:
+            self.overlay_queue.put((key, value))
         except Exception:
             pass
 
+    def stop(self):
+        """Ask serve() to wind down; safe to call from any thread."""
+        self._stop_event.set()
+        loop, stopping = self.loop, self._stopping
+        if loop is not None and stopping is not None:
+            try:
+                loop.call_soon_threadsafe(stopping.set)
+            except RuntimeError:
+                pass
+
+    def start(self):
+        """Start the voice engine in the background while the microphone opens, then queue the greeting.
+
+        Returns the greeting's SpeechHandle; the speech thread waits for the engine before speaking it.
+        """
+        self.executors['background'].submit(self.init_engine)
+        start = time.perf_counter()
+        try:
+            # open the microphone first so the greeting is registered as echo
+            self._ensure_capture()
+        except Exception as e:
+            safe_print("Recording error:", e)
+        self.capture_init_time = time.perf_counter() - start
+        return self.speak(GREETING, priority=SPEECH_CHAT)
+
+    def run(self):
+        self.start()
+        self._stop_event.clear()
+        try:
+            asyncio.run(self.serve(warm_cache=True))
+        finally:
+            for name, st in self.pipeline_stats().items():
+                safe_print(f"[{name}] processed={st['processed']} depth={st['depth']} "
+                           f"avg={st['avg_ms']:.1f}ms max={st['max_ms']:.1f}ms wait={st['avg_wait_ms']:.1f}ms "
+                           f"timeouts={st['timeouts']}")
+            st = self.recognizer_backend.stats()
+            safe_print(f"[recognizer:{st['backend']}] calls={st['calls']} failures={st['failures']} "
+                       f"avg={st['avg_ms']:.1f}ms max={st['max_ms']:.1f}ms")
+            if self.wake_gate.enabled:
+                st = self.wake_gate.stats()
+                safe_print(f"[wake gate] checked={st['checked']} passed={st['passed']} rejected={st['rejected']} "
+                           f"cpu={st['cpu_ms_per_audio_s']:.2f}ms per audio second")
+            if self.echo_gate is not None:
+                safe_print(f"[echo gate] coupling={self.echo_gate.coupling or 0.0:.3f} "
+                           f"echo_frames={self.echo_gate.echo_frames} barge_ins={self.player.interrupted}")
+            if self.synthesizer.starts:
+                st = self.synthesizer.stats()
+                safe_print(f"[synthesizer] starts={st['starts']} requests={st['requests']} "
+                           f"failures={st['failures']} avg={st['avg_ms']:.1f}ms")
+            st = self.speech_cache.stats()
+            safe_print(f"[tts cache] hits={st['hits']} (disk {st['disk_hits']}) misses={st['misses']} "
+                       f"hit_rate={st['hit_rate']:.0%} entries={st['entries']} evictions={st['evictions']}")
+            st = self.player.stats()
+            if st['plays']:
+                safe_print(f"[tts] plays={st['plays']} first_audio avg={st['avg_first_audio_ms']:.1f}ms "
+                           f"max={st['max_first_audio_ms']:.1f}ms underruns={st['underruns']}")
+            st = self.speech.stats()
+            safe_print(f"[speech] spoken={st['spoken']} cancelled={st['cancelled']} preempted={st['preempted']} "
+                       f"failed={st['failed']} depth={st['depth']} wait={st['avg_wait_ms']:.1f}ms")
+
+    def shutdown(self):
+        # let queued speech (e.g. the goodbye) finish before the voice goes away
+        self.speech.close()
+        for executor in self.executors.values():
+            executor.shutdown(wait=False, cancel_futures=True)
+        self.player.stop()
+        self.synthesizer.close()
+        if self.mic is not None:
+            self.mic.stop()
+
+# ---------- startup profile ----------
+def profile_startup(timeout=15.0):
+    """Start the assistant as run() does and report where the time to the greeting goes."""
+    launched = time.perf_counter()
+    assistant = LokiAssistant()
+    constructed = time.perf_counter()
+    assistant.print_responses = False
+    try:
+        greeting = assistant.start()
+        deadline = time.perf_counter() + timeout
+        while assistant.player.first_audio_at is None and not greeting.done and time.perf_counter() < deadline:
+            time.sleep(0.005)
+    finally:
+        assistant.stop_speaking()
+        assistant.shutdown()
+
+    def line(label, seconds, note=""):
+        value = "-" if seconds is None else f"{1000.0 * seconds:8.1f}ms"
+        safe_print(f"{label:<32}{value:>12}{note}")
+
+    line("[startup] module load", launched - LOAD_STARTED, "  (eager imports and definitions)")
+    line("[startup] LokiAssistant()", constructed - launched)
+    line("[startup] capture open", assistant.capture_init_time, "  (alongside the tts engine)")
+    line("[startup] tts engine", assistant.engine_init_time)
+    first_audio = assistant.player.first_audio_at
+    line("[startup] greeting first audio", None if first_audio is None else first_audio - LOAD_STARTED,
+         "  after module load began")
+    for name, seconds in sorted(IMPORT_TIMES.items(), key=lambda item: -item[1]):
+        line(f"[import] {name}", seconds)
+
 # ---------- main ----------
 def main():
+    parser = argparse.ArgumentParser(description="Loki voice assistant (speaks every response)")
+    parser.add_argument('--profile-startup', action='store_true',
+                        help="time imports, engine init and capture setup up to the greeting and exit")
+    args = parser.parse_args()
+    if args.profile_startup:
+        profile_startup()
+        return
     overlay_queue = queue.Queue() if ENABLE_GUI else None
     overlay = None
     if ENABLE_GUI:
@@ -1,7 +1,7 @@
 # -*- coding: utf-8 -*-
 """
 Loki Assistant — Single-file advanced version with YouTube ad-skip and next-track.
-Save as: loki_assistant2.py
+Save as: loki_assistant2.py (next to loki_core.py, which it imports)
 Run: python loki_assistant2.py
 
 Requirements:
@@ -18,6 +18,8 @@ Important:
 import os
 import sys
 import threading
+import asyncio
+import concurrent.futures
 import time
 import queue
 import subprocess
@@ -26,45 +28,58 @@ import datetime
 import shutil
 import platform
 import math
-
-# UI imports (optional)
-try:
-    import tkinter as tk
-    from tkinter import ttk
-except Exception:
-    tk = None
+import argparse
+import json
+import functools
+import tempfile
+import collections
+import contextlib
+
+# module load is timed from here for --profile-startup
+LOAD_STARTED = time.perf_counter()
+
+# audio, speech and arithmetic pieces shared by both assistants
+import loki_core
+from loki_core import (
+    IMPORT_TIMES, LazyModule, _importable,
+    RECOGNIZER_SAMPLE_RATE, RECOGNIZER_BACKEND, FIXTURE_DIR, WAKE_WORD_DIR,
+    AudioRingBuffer, PolyphaseResampler, MicrophoneStream, VoiceActivityDetector, UtteranceEndpointer,
+    RecognizerBackend, GoogleRecognizerBackend, FixtureRecognizerBackend, RECOGNIZER_BACKENDS,
+    log_mel_features, WakeWordGate, PersistentSynthesizer, synth_host_command, split_speech,
+    SpeechCache, EchoGate, SpeechPlayer, AsyncStage, NUMBER_WORDS, SCALE_WORDS, _spoken_number,
+    parse_arithmetic, evaluate_arithmetic, solve_arithmetic,
+)
+
+# ---------- Lazy imports ----------
+# UI imports (optional; loaded by the overlay thread)
+tk = LazyModule('tkinter', 'tk', globals())
+ttk = LazyModule('tkinter.ttk', 'ttk', globals())
 
 # Image handling
-try:
-    from PIL import Image, ImageTk, ImageOps, ImageDraw
-except Exception:
-    Image = None
-
-# Assistant imports
-try:
-    import speech_recognition as sr
-except Exception:
-    sr = None
-import pyttsx3
+Image = LazyModule('PIL.Image', 'Image', globals())
+ImageTk = LazyModule('PIL.ImageTk', 'ImageTk', globals())
+ImageOps = LazyModule('PIL.ImageOps', 'ImageOps', globals())
+ImageDraw = LazyModule('PIL.ImageDraw', 'ImageDraw', globals())
+
+# Assistant imports: feature modules load on first use
+sr = LazyModule('speech_recognition', 'sr', globals())
+pyttsx3 = LazyModule('pyttsx3', 'pyttsx3', globals())
 import webbrowser
-import pyautogui
-import sounddevice as sd
-import numpy as np
+pyautogui = LazyModule('pyautogui', 'pyautogui', globals())
+sd = LazyModule('sounddevice', 'sd', globals())
+np = LazyModule('numpy', 'np', globals())
 import wave
 from colorama import Fore, Style, init
-import psutil
+psutil = LazyModule('psutil', 'psutil', globals())
 
 # optional window focus helper
-try:
-    import pygetwindow as gw
-except Exception:
-    gw = None
+gw = LazyModule('pygetwindow', 'gw', globals())
 
 # optional OpenCV for better image matching (confidence)
-try:
-    import cv2
-except Exception:
-    cv2 = None
+cv2 = LazyModule('cv2', 'cv2', globals())
+
+# optional offline speech recognition
+vosk = LazyModule('vosk', 'vosk', globals())
 
 init(autoreset=True)
 
@@ -76,8 +91,65 @@ GIF_PATH = USER_GIF if os.path.exists(USER_GIF) else FALLBACK_GIF
 # Optional image names to detect skip button
 SKIP_IMAGE_NAMES = ["skip_ad.png", "skip_ad_button.png", "skipad.png", "skip-ads.png"]
 
+# fixed phrases loaded (or rendered into TTS_CACHE_DIR) at startup
+GREETING = "Hello! Yogesh. I'm Loki, your personal assistant. How can I help you?"
+WARM_PHRASES = (
+    GREETING,
+    'Yes?',
+    '2',
+    '1',
+    "Sorry, I didn't catch that. Please say that again clearly.",
+    'Captured and saved in the Yogesh folder.',
+    'Playing the next track.',
+    'Playing the music.',
+    'Paused.',
+    'Skipped the ad.',
+    'Trying to skip the ad.',
+    'Goodbye! Have a great day!',
+)
+
+# Replies waiting to be spoken: at most SPEECH_QUEUE_SIZE, with bursts folded by these
+# policies (coalesce, replace, then drop-oldest or drop-newest once the queue is full)
+SPEECH_QUEUE_SIZE = int(os.environ.get("LOKI_SPEECH_QUEUE", "8"))
+SPEECH_QUEUE_POLICY = os.environ.get("LOKI_SPEECH_POLICY", "coalesce,replace,drop-oldest")
+
+# The event loop hands blocking work to executors; recognition and actions that overrun
+# these timeouts (seconds) are abandoned so the assistant goes back to listening
+RECOGNIZE_TIMEOUT = 15.0
+ACTION_TIMEOUT = 20.0
+ACTION_WORKERS = 4
+# command handlers run on the action pool: at most ACTION_QUEUE_SIZE waiting or running,
+# and at most this many at once on each thing they drive
+ACTION_QUEUE_SIZE = 8
+RESOURCE_LIMITS = {'screen': 1, 'browser': 1, 'processes': 2}
+# on the way out, queued replies (the goodbye) get this long to finish
+SPEECH_DRAIN_TIMEOUT = 10.0
+# the overlay redraws every 200 ms; state changes are forwarded at most this often
+OVERLAY_INTERVAL = 0.1
+
+# Routes of the most recent distinct commands are kept, so repeats skip classification
+INTENT_CACHE_SIZE = int(os.environ.get("LOKI_INTENT_CACHE", "256"))
+
+# --batch takes its lines to be spoken this many seconds apart, so the duplicate check
+# judges a corpus the same way on every run however fast it goes through
+DRY_RUN_LINE_SECONDS = 2.0
+
+# A command that routes nowhere (or only to the generic answer) is routed again with misheard
+# words corrected to the nearest trigger word or app name; shorter tokens are left alone, as
+# are inflections of trigger words and words of the word list ("timer", "closet", "world").
+# The spelling benchmark reads transcripts from TRANSCRIPT_CORPUS.
+SPELLING_MIN_LENGTH = 5
+SPELLING_WORD_LIST = os.environ.get("LOKI_WORD_LIST", "/usr/share/dict/words")
+TRANSCRIPT_CORPUS = os.path.join(FIXTURE_DIR, "transcripts.txt")
+
+# Said while the assistant is talking: 'stop' silences it, 'next' skips to the next reply
+BARGE_IN_COMMANDS = {
+    'stop': 'stop', 'cancel': 'stop', 'quiet': 'stop', 'be quiet': 'stop', 'shut up': 'stop',
+    'enough': 'stop', 'stop talking': 'stop', 'next': 'next', 'skip': 'next', 'skip it': 'next',
+}
+
 # GUI availability check
-ENABLE_GUI = (tk is not None and Image is not None and os.path.exists(GIF_PATH))
+ENABLE_GUI = (os.path.exists(GIF_PATH) and _importable('tkinter') and _importable('PIL'))
 
 # pyautogui settings
 pyautogui.PAUSE = 0.05
@@ -106,6 +178,276 @@ def make_circular_image(pil_img, size):
     except Exception:
         return pil_img
 
+# ---------- Speech queue ----------
+class SpeechQueue:
+    """Bounded queue of replies waiting for the TTS worker.
+
+    Bursts are folded rather than piled up: with 'coalesce' a reply that is already
+    waiting isn't queued twice, with 'replace' a new reply takes the place of a
+    waiting one of the same category (the next countdown digit, the latest ad-skip
+    status), and once the queue is full 'drop-oldest' discards the reply that has
+    waited longest while 'drop-newest' turns the new one away. get() blocks until
+    something arrives, so the worker neither polls nor lags behind a put.
+    """
+
+    OVERFLOW = ('drop-oldest', 'drop-newest')
+
+    def __init__(self, maxsize=SPEECH_QUEUE_SIZE, policy=SPEECH_QUEUE_POLICY):
+        if isinstance(policy, str):
+            policy = [p.strip() for p in policy.split(',') if p.strip()]
+        unknown = [p for p in policy if p not in ('coalesce', 'replace') + self.OVERFLOW]
+        if unknown:
+            raise ValueError(f"Unknown speech queue policy: {', '.join(unknown)}")
+        self.coalesce = 'coalesce' in policy
+        self.replace = 'replace' in policy
+        overflow = [p for p in policy if p in self.OVERFLOW]
+        self.overflow = overflow[-1] if overflow else 'drop-oldest'
+        self.maxsize = max(1, int(maxsize))
+        self._items = collections.deque()   # [text, category, queued_at]
+        self._cond = threading.Condition()
+        self._active = 0
+        self._closed = False
+        self.queued = 0
+        self.coalesced = 0
+        self.replaced = 0
+        self.dropped = 0
+        self.cleared = 0
+        self.max_depth = 0
+        self.taken = 0
+        self.total_wait = 0.0
+
+    def put(self, text, category=None):
+        """Queue `text`; False if it was turned away (queue closed, or full under drop-newest)."""
+        with self._cond:
+            if self._closed:
+                return False
+            if self.coalesce and any(item[0] == text for item in self._items):
+                self.coalesced += 1
+                return True
+            if self.replace and category is not None:
+                for item in self._items:
+                    if item[1] == category:
+                        item[0], item[2] = text, time.perf_counter()
+                        self.replaced += 1
+                        return True
+            if len(self._items) >= self.maxsize:
+                self.dropped += 1
+                if self.overflow == 'drop-newest':
+                    return False
+                self._items.popleft()
+            self._items.append([text, category, time.perf_counter()])
+            self.queued += 1
+            self.max_depth = max(self.max_depth, len(self._items))
+            self._cond.notify()
+            return True
+
+    def get(self, timeout=None):
+        """Next reply to speak, waiting for one; None once closed and drained (or on timeout)."""
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._items or self._closed, timeout):
+                return None
+            if not self._items:
+                return None
+            text, _, queued_at = self._items.popleft()
+            self._active += 1
+            self.taken += 1
+            self.total_wait += time.perf_counter() - queued_at
+            return text
+
+    def task_done(self):
+        with self._cond:
+            self._active = max(0, self._active - 1)
+            self._cond.notify_all()
+
+    def clear(self):
+        """Drop everything still waiting; returns how many replies were dropped."""
+        with self._cond:
+            n = len(self._items)
+            self._items.clear()
+            self.cleared += n
+            self._cond.notify_all()
+            return n
+
+    def close(self):
+        """Refuse new replies; the worker finishes what is queued, then get() returns None."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    @property
+    def closed(self):
+        return self._closed
+
+    @property
+    def depth(self):
+        with self._cond:
+            return len(self._items)
+
+    @property
+    def unfinished_tasks(self):
+        with self._cond:
+            return len(self._items) + self._active
+
+    def stats(self):
+        with self._cond:
+            return {
+                'depth': len(self._items),
+                'max_depth': self.max_depth,
+                'queued': self.queued,
+                'coalesced': self.coalesced,
+                'replaced': self.replaced,
+                'dropped': self.dropped,
+                'cleared': self.cleared,
+                'avg_wait_ms': 1000.0 * self.total_wait / (self.taken or 1),
+            }
+
+# ---------- Pipeline ----------
+class ActionExecutor:
+    """Runs command handlers on a bounded worker pool, off the dispatch path.
+
+    At most `max_pending` actions wait or run at once; more are turned away. An action
+    that names a resource ('screen', 'browser', 'processes') runs only while fewer than
+    `limits[resource]` others hold it, otherwise it waits its turn in order. One that
+    overruns its timeout is reported to `on_timeout(name)` and left to finish in the
+    background, still holding its resource. `on_done(name, result, error)` is called
+    from the worker as each action finishes.
+    """
+
+    def __init__(self, executor, limits=None, max_pending=None, timeout=None, on_done=None, on_timeout=None):
+        self.executor = executor
+        self.limits = dict(RESOURCE_LIMITS if limits is None else limits)
+        self.max_pending = ACTION_QUEUE_SIZE if max_pending is None else max_pending
+        self.timeout = ACTION_TIMEOUT if timeout is None else timeout
+        self.on_done = on_done
+        self.on_timeout = on_timeout
+        self.pending = 0
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.timeouts = 0
+        self.rejected = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self.total_wait = 0.0
+        self._running = collections.Counter()
+        self._waiting = collections.defaultdict(collections.deque)
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+
+    def submit(self, name, work, resource=None, timeout=None):
+        """Queue `work()` as action `name`; False if too many actions are pending already."""
+        action = (name, work, resource, timeout or self.timeout, time.perf_counter())
+        with self._lock:
+            if self.pending >= self.max_pending:
+                self.rejected += 1
+                return False
+            self.pending += 1
+            self.submitted += 1
+            if resource is not None:
+                if self._running[resource] >= self.limits.get(resource, 1):
+                    self._waiting[resource].append(action)
+                    return True
+                self._running[resource] += 1
+        self._start(action)
+        return True
+
+    def _start(self, action):
+        try:
+            self.executor.submit(self._run, action)
+        except RuntimeError:
+            # the pool is shutting down: nothing ran, so drop this action and its queue
+            self._abandon(action[2])
+
+    def _run(self, action):
+        name, work, resource, timeout, queued_at = action
+        started = time.perf_counter()
+        timer = threading.Timer(timeout, self._timed_out, (name, timeout))
+        timer.daemon = True
+        result = error = None
+        try:
+            timer.start()
+            result = work()
+        except Exception as e:
+            error = e
+        finally:
+            timer.cancel()
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                if error is None:
+                    self.completed += 1
+                else:
+                    self.failed += 1
+                self.total_latency += elapsed
+                self.max_latency = max(self.max_latency, elapsed)
+                self.total_wait += started - queued_at
+            next_action = self._release(resource)
+        if next_action is not None:
+            self._start(next_action)
+        if self.on_done:
+            self.on_done(name, result, error)
+
+    def _release(self, resource):
+        """Free one slot of `resource`, or hand it straight to the next action waiting for it."""
+        with self._lock:
+            self.pending -= 1
+            if self.pending == 0:
+                self._idle.notify_all()
+            if resource is None:
+                return None
+            waiting = self._waiting.get(resource)
+            if waiting:
+                return waiting.popleft()
+            self._running[resource] -= 1
+            return None
+
+    def _abandon(self, resource):
+        """Undo the slot taken for an action that never started, dropping what waits behind it."""
+        with self._lock:
+            dropped = 1
+            if resource is not None:
+                dropped += len(self._waiting.pop(resource, ()))
+                self._running[resource] -= 1
+            self.pending -= dropped
+            if self.pending == 0:
+                self._idle.notify_all()
+
+    def _timed_out(self, name, timeout):
+        with self._lock:
+            self.timeouts += 1
+        print(f"{Fore.YELLOW}{name} action timed out after {timeout:g}s{Style.RESET_ALL}")
+        if self.on_timeout:
+            self.on_timeout(name)
+
+    def cancel_waiting(self):
+        """Drop actions still waiting for a resource; returns how many were dropped."""
+        with self._lock:
+            dropped = sum(len(waiting) for waiting in self._waiting.values())
+            self._waiting.clear()
+            self.pending -= dropped
+            if self.pending == 0:
+                self._idle.notify_all()
+            return dropped
+
+    def wait_idle(self, timeout=None):
+        """Block until no action is waiting or running; False on timeout."""
+        with self._lock:
+            return self._idle.wait_for(lambda: self.pending == 0, timeout)
+
+    def stats(self):
+        with self._lock:
+            n = (self.completed + self.failed) or 1
+            return {
+                'pending': self.pending,
+                'submitted': self.submitted,
+                'completed': self.completed,
+                'failed': self.failed,
+                'timeouts': self.timeouts,
+                'rejected': self.rejected,
+                'avg_ms': 1000.0 * self.total_latency / n,
+                'max_ms': 1000.0 * self.max_latency,
+                'avg_wait_ms': 1000.0 * self.total_wait / n,
+            }
+
 # ---------- Overlay GUI ----------
 class OverlayGUI(threading.Thread):
     def __init__(self, gif_path, queue_in=None, size=140):
@@ -240,51 +582,730 @@ class OverlayGUI(threading.Thread):
         except Exception:
             pass
 
-# ---------- Loki Assistant ----------
-class LokiAssistant:
-    def __init__(self, overlay_queue=None):
-        # TTS engine
+# ---------- Unit conversion ----------
+# (unit, plural, other names, amount, of unit, offset): one unit is `amount` of the other
+# unit plus `offset`; a unit with no other unit is the base of a dimension of its own
+UNIT_DEFINITIONS = (
+    ('meter', 'meters', ('metre', 'metres', 'm'), None, None, 0.0),
+    ('kilometer', 'kilometers', ('kilometre', 'kilometres', 'km'), 1000.0, 'meter', 0.0),
+    ('centimeter', 'centimeters', ('centimetre', 'centimetres', 'cm'), 0.01, 'meter', 0.0),
+    ('millimeter', 'millimeters', ('millimetre', 'millimetres', 'mm'), 0.1, 'centimeter', 0.0),
+    ('inch', 'inches', ('in',), 2.54, 'centimeter', 0.0),
+    ('foot', 'feet', ('ft',), 12.0, 'inch', 0.0),
+    ('yard', 'yards', ('yd',), 3.0, 'foot', 0.0),
+    ('mile', 'miles', ('mi',), 5280.0, 'foot', 0.0),
+    ('nautical mile', 'nautical miles', (), 1852.0, 'meter', 0.0),
+    ('gram', 'grams', ('g',), None, None, 0.0),
+    ('kilogram', 'kilograms', ('kilo', 'kilos', 'kg'), 1000.0, 'gram', 0.0),
+    ('milligram', 'milligrams', ('mg',), 0.001, 'gram', 0.0),
+    ('tonne', 'tonnes', ('metric ton', 'metric tons'), 1000.0, 'kilogram', 0.0),
+    ('pound', 'pounds', ('lb', 'lbs'), 453.59237, 'gram', 0.0),
+    ('ounce', 'ounces', ('oz',), 1 / 16, 'pound', 0.0),
+    ('stone', 'stone', ('stones',), 14.0, 'pound', 0.0),
+    ('liter', 'liters', ('litre', 'litres', 'l'), None, None, 0.0),
+    ('milliliter', 'milliliters', ('millilitre', 'millilitres', 'ml'), 0.001, 'liter', 0.0),
+    ('gallon', 'gallons', ('gal',), 3.785411784, 'liter', 0.0),
+    ('quart', 'quarts', ('qt',), 0.25, 'gallon', 0.0),
+    ('pint', 'pints', ('pt',), 0.5, 'quart', 0.0),
+    ('cup', 'cups', (), 0.5, 'pint', 0.0),
+    ('fluid ounce', 'fluid ounces', ('fl oz',), 0.125, 'cup', 0.0),
+    ('tablespoon', 'tablespoons', ('tbsp',), 0.5, 'fluid ounce', 0.0),
+    ('teaspoon', 'teaspoons', ('tsp',), 1 / 3, 'tablespoon', 0.0),
+    ('second', 'seconds', ('sec', 'secs', 's'), None, None, 0.0),
+    ('millisecond', 'milliseconds', ('ms',), 0.001, 'second', 0.0),
+    ('minute', 'minutes', ('min', 'mins'), 60.0, 'second', 0.0),
+    ('hour', 'hours', ('hr', 'hrs'), 60.0, 'minute', 0.0),
+    ('day', 'days', (), 24.0, 'hour', 0.0),
+    ('week', 'weeks', (), 7.0, 'day', 0.0),
+    ('meter per second', 'meters per second', ('metres per second',), None, None, 0.0),
+    ('kilometer per hour', 'kilometers per hour', ('kilometres per hour', 'kph', 'km/h'), 1 / 3.6,
+     'meter per second', 0.0),
+    ('mile per hour', 'miles per hour', ('mph',), 0.44704, 'meter per second', 0.0),
+    ('knot', 'knots', (), 1852 / 3600, 'meter per second', 0.0),
+    ('square meter', 'square meters', ('square metre', 'square metres'), None, None, 0.0),
+    ('square kilometer', 'square kilometers', ('square kilometre', 'square kilometres'), 1e6, 'square meter', 0.0),
+    ('square foot', 'square feet', (), 0.09290304, 'square meter', 0.0),
+    ('acre', 'acres', (), 43560.0, 'square foot', 0.0),
+    ('hectare', 'hectares', (), 10000.0, 'square meter', 0.0),
+    ('byte', 'bytes', (), None, None, 0.0),
+    ('bit', 'bits', (), 0.125, 'byte', 0.0),
+    ('kilobyte', 'kilobytes', ('kb',), 1e3, 'byte', 0.0),
+    ('megabyte', 'megabytes', ('mb',), 1e3, 'kilobyte', 0.0),
+    ('gigabyte', 'gigabytes', ('gb',), 1e3, 'megabyte', 0.0),
+    ('terabyte', 'terabytes', ('tb',), 1e3, 'gigabyte', 0.0),
+    ('kelvin', 'kelvin', ('kelvins',), None, None, 0.0),
+    ('celsius', 'degrees celsius', ('centigrade', 'degree celsius', 'degrees centigrade', 'c'), 1.0, 'kelvin', 273.15),
+    ('fahrenheit', 'degrees fahrenheit', ('degree fahrenheit', 'f'), 5 / 9, 'celsius', -160 / 9),
+)
+# numbers in a conversion query: digits, number words and a leading "minus"
+QUANTITY_WORDS = set(NUMBER_WORDS) | set(SCALE_WORDS) | {'hundred', 'point', 'a', 'an', 'and', 'minus', 'negative'}
+
+class UnitGraph:
+    """Units joined by their definitions into one graph per dimension.
+
+    Loading walks each dimension once from its base unit and keeps, for every unit, the
+    affine map (scale, offset) taking its values to the base, so a conversion is two
+    multiply-adds however long the path between the units is. Pair maps and parsed
+    questions are memoized per graph, so the caches go when the graph does.
+    Temperatures are affine (offset != 0); everything else is a plain scale.
+    """
+
+    def __init__(self, definitions=UNIT_DEFINITIONS):
+        self.plurals = {}
+        self.names = {}
+        edges = collections.defaultdict(list)
+        for name, plural, aliases, amount, other, offset in definitions:
+            self.plurals[name] = plural
+            for alias in (name, plural) + tuple(aliases):
+                self.names[tuple(alias.split())] = name
+            if other is not None:
+                # value in `other` = value in `name` * amount + offset, and back
+                edges[name].append((other, amount, offset))
+                edges[other].append((name, 1 / amount, -offset / amount))
+        self.dimension = {}
+        self._to_base = {}
+        for name, _, _, amount, other, _ in definitions:
+            if other is not None:
+                continue
+            self.dimension[name] = name
+            self._to_base[name] = (1.0, 0.0)
+            order = collections.deque([name])
+            while order:
+                unit = order.popleft()
+                scale, offset = self._to_base[unit]
+                for neighbour, a, b in edges[unit]:
+                    if neighbour in self._to_base:
+                        continue
+                    # neighbour -> unit is the inverse of unit -> neighbour (a, b)
+                    self._to_base[neighbour] = (scale / a, offset - scale * b / a)
+                    self.dimension[neighbour] = name
+                    order.append(neighbour)
+        self._longest_name = max(len(words) for words in self.names)
+        self.transform = functools.lru_cache(maxsize=1024)(self._transform)
+        self.parse = functools.lru_cache(maxsize=256)(self._parse)
+
+    def _transform(self, source, target):
+        """(scale, offset) taking values in `source` to `target`; ValueError across dimensions."""
+        if self.dimension[source] != self.dimension[target]:
+            raise ValueError(f"can't convert {self.plurals[source]} to {self.plurals[target]}")
+        a, b = self._to_base[source]
+        c, d = self._to_base[target]
+        return a / c, (b - d) / c
+
+    def convert(self, value, source, target):
+        scale, offset = self.transform(source, target)
+        return value * scale + offset
+
+    def find_units(self, words):
+        """[(start, end, unit)] for each unit named in `words`, longest name first.
+
+        Abbreviations ("m", "in", "c") only count right after a number or after to/in/into/many.
+        """
+        found = []
+        i = 0
+        while i < len(words):
+            for length in range(min(self._longest_name, len(words) - i), 0, -1):
+                unit = self.names.get(tuple(words[i:i + length]))
+                if unit is None:
+                    continue
+                if length == 1 and len(words[i]) <= 2 and words[i] not in self.plurals:
+                    before = words[i - 1] if i else ''
+                    if not (before[:1].isdigit() or before in QUANTITY_WORDS or before in ('to', 'in', 'into', 'many')):
+                        continue
+                found.append((i, i + length, unit))
+                i += length - 1
+                break
+            i += 1
+        return found
+
+    def _parse(self, text):
+        """(value, source unit, target unit) asked for in `text`, or None.
+
+        Understands "how many feet in 3.5 kilometers", "convert 100 fahrenheit to celsius",
+        "3.5 km in miles": two units, one with a number said right before it.
+        """
+        words = text.lower().replace('°', ' ').replace('?', ' ').split()
+        units = self.find_units(words)
+        if len(units) != 2:
+            return None
+        quantities = []
+        for start, end, unit in units:
+            first = start
+            while first > 0 and (words[first - 1][:1].isdigit() or words[first - 1] in QUANTITY_WORDS):
+                first -= 1
+            quantity = [w for w in words[first:start] if w != 'and']
+            if quantity:
+                quantities.append((quantity, unit))
+        if len(quantities) != 1:
+            return None
+        quantity, source = quantities[0]
+        target = units[0][2] if units[1][2] == source else units[1][2]
+        negative = quantity[0] in ('minus', 'negative')
+        if negative:
+            quantity = quantity[1:]
         try:
-            self.engine = pyttsx3.init()
-            self.setup_voice()
-        except Exception:
-            self.engine = None
-            print(f"{Fore.YELLOW}Warning: pyttsx3 init failed, PowerShell fallback may be used{Style.RESET_ALL}")
+            value = _spoken_number(['a' if w == 'an' else w for w in quantity])
+        except ValueError:
+            return None
+        return (-value if negative else value), source, target
 
-        # TTS queue & thread
-        self.tts_queue = queue.Queue()
-        self._tts_running = True
-        self.tts_thread = threading.Thread(target=self._tts_worker, daemon=True)
-        self.tts_thread.start()
+    def answer(self, value, source, target):
+        """Spoken answer to converting `value` `source` to `target`."""
+        try:
+            result = self.convert(value, source, target)
+        except ValueError as e:
+            return f"Sorry, I {e}."
+        return f"{_format_quantity(value)} {self._unit_name(source, value)} is " \
+               f"{_format_quantity(result)} {self._unit_name(target, result)}."
+
+    def _unit_name(self, unit, value):
+        return unit if value == 1 and unit not in ('celsius', 'fahrenheit') else self.plurals[unit]
+
+def _format_quantity(value):
+    """3.0 -> '3', 11482.939632 -> '11,482.94', 0.0833333 -> '0.08333'."""
+    if value == int(value) and abs(value) < 1e15:
+        return f"{int(value):,}"
+    if abs(value) >= 1:
+        return f"{value:,.2f}".rstrip('0').rstrip('.')
+    return f"{value:.4g}"
+
+UNITS = UnitGraph()
+
+# ---------- Intent routing ----------
+WAKE_WORDS = ('loki', 'lokesh', 'low key', 'hey')
+QUESTION_WORDS = (
+    "what", "who", "when", "where", "why", "how", "which",
+    "could you", "can you", "would you", "will you",
+    "tell me", "show me", "let me know",
+    # every other ^-anchored question pattern starts with one of the words above
+    "do you",
+)
+ACTION_KEYWORDS = (
+    'open', 'close', 'search', 'calculate', 'set', 'change', 'play', 'take', 'screenshot',
+    'stop', 'quit', 'exit', 'launch', 'find', 'calculator', 'convert',
+)
+SPEECH_RATE_TRIGGERS = ("speech rate", "speak faster", "speak slower", "change speech")
+MATH_OPERATORS = ('plus', 'minus', 'times', 'multiplied by', 'divided by', 'power of', 'squared', 'cubed',
+                  'percent', '+', '-', '*', '/', 'x', '^', '%')
+# spoken brackets belong to arithmetic: "close bracket" isn't a request to close an app
+BRACKET_PHRASES = ('open bracket', 'close bracket', 'open brackets', 'close brackets',
+                   'open parenthesis', 'close parenthesis')
+MATH_QUESTION_RE = re.compile(r"^(?:calculate|solve)\s+\d+[\s+\+\-\*/x]\s*\d+")
+HELP_QUESTION_RE = re.compile(r'how\s+(do|can)\s+you\s+(help|assist)')
+RATE_RE = re.compile(r"(\d{2,3})")
+SECONDS_RE = re.compile(r"(\d+)")
+# close <app>: first trigger found wins; process names are tried in order
+CLOSE_TARGETS = (
+    ('chrome', ('chrome.exe',)),
+    ('camera', ('WindowsCamera.exe',)),
+    ('calculator', ('Calculator.exe', 'ApplicationFrameHost.exe')),
+    ('calc', ('Calculator.exe', 'ApplicationFrameHost.exe')),
+    ('vs code', ('Code.exe',)),
+    ('visual studio code', ('Code.exe',)),
+    ('spotify', ('spotify.exe',)),
+)
+
+Route = collections.namedtuple('Route', 'intent slots command')
+IntentSpec = collections.namedtuple('IntentSpec',
+                                    'name triggers requires priority slots question resource timeout dedup')
+
+def intent(name, triggers=(), requires=(), priority=0, slots=None, question=False, resource=None, timeout=None,
+           dedup=None):
+    """Declare the decorated method as the handler for intent `name`.
+
+    `triggers` are phrases, any one of which selects the intent; a tuple of phrases
+    selects it only when all of them occur. `requires` adds phrases one of which must
+    also occur. Phrases match whole words, so "time" doesn't fire on "sometimes".
+    `slots(command, found)` pulls the handler's arguments out of the command and may
+    return None to pass on it. Among matching intents the highest `priority` wins,
+    then the one declared first. An intent with no triggers matches any question
+    (`question=True`) or any command at all. `resource` names what the handler drives
+    ('screen', 'browser', 'processes'; see RESOURCE_LIMITS) and `timeout` replaces
+    ACTION_TIMEOUT for it. The same command heard again within `dedup` seconds is dropped;
+    intents with a `resource` default to the assistant's duplicate_action_window and the
+    rest to 0, which turns it off.
+    """
+    triggers = tuple(t if isinstance(t, tuple) else (t,) for t in triggers)
+
+    def decorate(handler):
+        handler.intent_spec = IntentSpec(name, triggers, frozenset(requires), priority, slots, question,
+                                         resource, timeout, dedup)
+        return handler
+    return decorate
+
+def _is_word_char(ch):
+    return ch.isalnum() or ch == '_'
+
+class PhraseMatcher:
+    """Aho-Corasick automaton over a fixed set of phrases.
+
+    scan() walks the text once and reports every phrase occurring in it, the way a chain
+    of `phrase in text` checks would, plus which of them stand as whole words and which
+    open the text.
+    """
+
+    def __init__(self, phrases):
+        self.phrases = sorted(set(phrases))
+        goto = [{}]
+        outputs = [()]
+        for index, phrase in enumerate(self.phrases):
+            node = 0
+            for ch in phrase:
+                if ch not in goto[node]:
+                    goto[node][ch] = len(goto)
+                    goto.append({})
+                    outputs.append(())
+                node = goto[node][ch]
+            outputs[node] += (index,)
+        # breadth-first: fill in failure links and fold the transitions into a DFA,
+        # so scanning is one dict lookup per character
+        fail = [0] * len(goto)
+        delta = [dict(goto[0])] + [None] * (len(goto) - 1)
+        order = collections.deque(goto[0].values())
+        while order:
+            node = order.popleft()
+            delta[node] = dict(delta[fail[node]])
+            delta[node].update(goto[node])
+            outputs[node] += outputs[fail[node]]
+            for ch, child in goto[node].items():
+                fail[child] = delta[fail[node]].get(ch, 0)
+                order.append(child)
+        self._delta = delta
+        self._outputs = outputs
+        self._lengths = [len(phrase) for phrase in self.phrases]
+        # a phrase edge that isn't a letter or digit ("+", "?") needs no word boundary
+        self._bounded = [(_is_word_char(phrase[0]), _is_word_char(phrase[-1])) for phrase in self.phrases]
+
+    def scan(self, text):
+        """(found, words, starts): phrases in `text`, those bounded as whole words, those at index 0."""
+        delta, outputs, lengths, phrases = self._delta, self._outputs, self._lengths, self.phrases
+        bounded = self._bounded
+        found = set()
+        words = set()
+        starts = set()
+        last = len(text) - 1
+        node = 0
+        for end, ch in enumerate(text):
+            node = delta[node].get(ch, 0)
+            for index in outputs[node]:
+                phrase = phrases[index]
+                found.add(phrase)
+                start = end - lengths[index] + 1
+                if not start:
+                    starts.add(phrase)
+                left, right = bounded[index]
+                if ((not left or not start or not _is_word_char(text[start - 1]))
+                        and (not right or end == last or not _is_word_char(text[end + 1]))):
+                    words.add(phrase)
+        return found, words, starts
+
+def _edit_distance(a, b, limit):
+    """Optimal-string-alignment distance between `a` and `b`, or limit + 1 once it exceeds `limit`."""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous2 = None
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i] + [0] * len(b)
+        for j, cb in enumerate(b, 1):
+            cost = ca != cb
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and ca == b[j - 2] and a[i - 2] == cb:
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        if min(current) > limit:
+            return limit + 1
+        previous2, previous = previous, current
+    return previous[-1]
+
+@functools.lru_cache(maxsize=4)
+def load_word_list(path):
+    """Lowercase words of a one-word-per-line list such as /usr/share/dict/words; empty if missing."""
+    try:
+        with open(path, encoding='utf-8', errors='ignore') as f:
+            return frozenset(line.strip().lower() for line in f if line.strip().isalpha())
+    except OSError:
+        return frozenset()
+
+def _deletes(word, distance):
+    """`word` and every string made by deleting up to `distance` characters from it."""
+    variants = {word}
+    frontier = {word}
+    for _ in range(distance):
+        frontier = {w[:i] + w[i + 1:] for w in frontier for i in range(len(w))}
+        variants |= frontier
+    return variants
+
+class SpellingIndex:
+    """SymSpell-style correction of transcript words to the command vocabulary.
+
+    Every vocabulary word is indexed under the strings made by deleting up to two of its
+    characters, so a misheard token finds its neighbours by looking up its own deletions
+    instead of being compared with every word. Tokens of SPELLING_MIN_LENGTH letters or
+    more may be one edit off (two from nine letters); shorter ones only get two swapped
+    letters put back ("opne"), since one edit turns "come" into "code". Equally close
+    words go to the one of the token's length, and if that is still a tie the token is
+    left as heard. Real words are never corrected: inflections of the vocabulary
+    ("cameras", "timer") and anything in `dictionary`.
+    """
+
+    MAX_DISTANCE = 2
+    SUFFIXES = ('s', 'es', 'd', 'ed', 'ing', 'r', 'er', 'rs', 'ers')
+
+    def __init__(self, vocabulary, dictionary=frozenset()):
+        self.vocabulary = frozenset(vocabulary)
+        self.dictionary = dictionary
+        self._index = collections.defaultdict(set)
+        for word in self.vocabulary:
+            for variant in _deletes(word, self.MAX_DISTANCE):
+                self._index[variant].add(word)
+        self._index = dict(self._index)
+        self.lookup = functools.lru_cache(maxsize=4096)(self._lookup)
+
+    def _lookup(self, token):
+        if token in self.vocabulary or not token.isalpha() or token in self.dictionary or self._inflects(token):
+            return token
+        if len(token) < SPELLING_MIN_LENGTH:
+            swaps = {token[:i] + token[i + 1] + token[i] + token[i + 2:] for i in range(len(token) - 1)}
+            found = swaps & self.vocabulary
+            return found.pop() if len(found) == 1 else token
+        limit = 1 if len(token) < 9 else self.MAX_DISTANCE
+        candidates = set()
+        for variant in _deletes(token, limit):
+            candidates.update(self._index.get(variant, ()))
+        best, best_rank = None, (limit + 1, 0)
+        for word in candidates:
+            rank = (_edit_distance(token, word, limit), abs(len(word) - len(token)))
+            if rank < best_rank:
+                best, best_rank = word, rank
+            elif rank == best_rank:
+                best = None
+        return best or token
+
+    def _inflects(self, token):
+        for suffix in self.SUFFIXES:
+            if token.endswith(suffix):
+                stem = token[:-len(suffix)]
+                if stem in self.vocabulary or stem + 'e' in self.vocabulary:
+                    return True
+        return False
+
+    def correct(self, text):
+        """`text` with misheard words replaced by their vocabulary word."""
+        tokens = text.split(' ')
+        corrected = [self.lookup(token) for token in tokens]
+        return text if corrected == tokens else ' '.join(corrected)
+
+class IntentRegistry:
+    """Declared intents, indexed by trigger phrase, with per-intent counts and handler latency.
+
+    load() collects the @intent handlers of an object once. route() normalizes the
+    transcript (case, whitespace, leading wake words), finds every trigger phrase in one
+    PhraseMatcher scan, looks up just the intents those phrases index and picks the best
+    match; dispatch() runs its handler and times it. register() and unregister() change
+    the command set at run time; the matcher is rebuilt on the next route().
+
+    A command that matches nothing, or only an intent without triggers (the generic
+    answer), is scanned again with misheard words corrected against the vocabulary of
+    every trigger and app name by a SpellingIndex (if `correct_spelling`). Slots are
+    always taken from the words as heard.
+
+    Routes (including "not for me") are kept in an LRU keyed by the normalized command,
+    so a repeated command skips the scan and ranking entirely. Changing the command set
+    empties it.
+    """
+
+    def __init__(self, question_words=QUESTION_WORDS, action_keywords=ACTION_KEYWORDS,
+                 wake_words=WAKE_WORDS, cache_size=INTENT_CACHE_SIZE, correct_spelling=True):
+        self.question_words = frozenset(question_words)
+        self.action_keywords = frozenset(action_keywords)
+        wake = '|'.join(re.escape(w) for w in sorted(wake_words, key=len, reverse=True))
+        self._wake_re = re.compile(rf'^(?:(?:{wake})\s*)+')
+        self._specs = {}
+        self._handlers = {}
+        self._order = {}
+        self._index = {}
+        self._untriggered = ()
+        self._matcher = None
+        self.correct_spelling = correct_spelling
+        self._speller = None
+        self.corrections = 0
+        self.version = 0
+        self._lock = threading.Lock()
+        self.cache_size = cache_size
+        self._cache = collections.OrderedDict()
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.cache_evictions = 0
+        self.invalidations = 0
+        self._calls = collections.Counter()
+        self._latency = collections.defaultdict(float)
+        self._max_latency = collections.defaultdict(float)
+
+    def load(self, owner):
+        """Register every @intent method of `owner` (an instance, or a class for routing only)."""
+        seen = set()
+        owner_class = owner if isinstance(owner, type) else type(owner)
+        for cls in owner_class.__mro__:
+            for attr, value in vars(cls).items():
+                spec = getattr(value, 'intent_spec', None)
+                if spec is not None and attr not in seen:
+                    seen.add(attr)
+                    self.register(spec, getattr(owner, attr))
+        return self
+
+    def register(self, spec, handler):
+        with self._lock:
+            if spec.name not in self._order:
+                self._order[spec.name] = len(self._order)
+            self._specs[spec.name] = spec
+            self._handlers[spec.name] = handler
+            self._reindex()
+
+    def unregister(self, name):
+        with self._lock:
+            if self._specs.pop(name, None) is not None:
+                del self._handlers[name]
+                self._reindex()
+
+    @property
+    def intents(self):
+        return tuple(self._specs)
+
+    def spec(self, name):
+        return self._specs[name]
+
+    def _reindex(self):
+        index = collections.defaultdict(set)
+        untriggered = []
+        for name, spec in self._specs.items():
+            for trigger in spec.triggers:
+                for phrase in trigger:
+                    index[phrase].add(name)
+            if not spec.triggers:
+                untriggered.append(name)
+        self._index = dict(index)
+        self._untriggered = tuple(untriggered)
+        self._matcher = None
+        self.version += 1
+        if self._cache:
+            self._cache.clear()
+            self.invalidations += 1
+
+    def _compile(self):
+        phrases = set(self.question_words) | set(self.action_keywords) | {'calculate', 'solve'}
+        phrases.update(self._index)
+        for spec in self._specs.values():
+            phrases.update(spec.requires)
+        phrases.update(trigger for trigger, _ in CLOSE_TARGETS)
+        phrases.update(MATH_OPERATORS)
+        self._speller = SpellingIndex((word for phrase in phrases for word in phrase.split() if word.isalpha()),
+                                      load_word_list(SPELLING_WORD_LIST))
+        self._matcher = PhraseMatcher(phrases)
+        return self._matcher
+
+    def normalize(self, text):
+        """Lowercase, collapse whitespace and drop any leading wake words."""
+        return self._wake_re.sub('', ' '.join(text.lower().split()))
+
+    def route(self, text):
+        """Route for `text`, or None when it is neither a question nor an action or nothing matches."""
+        if not text:
+            return None
+        command = self.normalize(text)
+        with self._lock:
+            if command in self._cache:
+                self._cache.move_to_end(command)
+                self.cache_hits += 1
+                return self._cache[command]
+            self.cache_misses += 1
+            version = self.version
+        route = self._classify(command)
+        with self._lock:
+            # a register()/unregister() while classifying makes this route stale
+            if self.cache_size and version == self.version:
+                self._cache[command] = route
+                if len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+                    self.cache_evictions += 1
+        return route
+
+    def _classify(self, command):
+        matcher = self._matcher or self._compile()
+        route = self._match(matcher, command, command)
+        if self.correct_spelling and (route is None or route.intent in self._untriggered):
+            corrected = self._speller.correct(command)
+            if corrected != command:
+                retry = self._match(matcher, corrected, command)
+                if retry is not None and (route is None or retry.intent not in self._untriggered):
+                    with self._lock:
+                        self.corrections += 1
+                    return retry
+        return route
+
+    def _match(self, matcher, command, heard):
+        """Best route for `command`, with slots from `heard` (the command before correction)."""
+        _, words, starts = matcher.scan(command)
+        is_question = (not self.question_words.isdisjoint(starts) or '?' in command
+                       or (('calculate' in starts or 'solve' in starts)
+                           and MATH_QUESTION_RE.match(command) is not None))
+        if not (is_question or not self.action_keywords.isdisjoint(words)):
+            return None
+        index, specs, order = self._index, self._specs, self._order
+        candidates = set(self._untriggered)
+        for phrase in words:
+            candidates.update(index.get(phrase, ()))
+        ranked = sorted(candidates, key=lambda name: (-specs[name].priority, order[name]))
+        for name in ranked:
+            spec = specs[name]
+            if spec.triggers and not any(all(p in words for p in t) for t in spec.triggers):
+                continue
+            if spec.requires and spec.requires.isdisjoint(words):
+                continue
+            if spec.question and not is_question:
+                continue
+            slots = spec.slots(heard, words) if spec.slots else {}
+            if slots is None:
+                continue
+            return Route(name, slots, command)
+        return None
+
+    def dispatch(self, route):
+        """Run the handler for `route` and return its result, recording its latency."""
+        handler = self._handlers[route.intent]
+        start = time.perf_counter()
+        try:
+            return handler(route.command, route.slots)
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self._calls[route.intent] += 1
+                self._latency[route.intent] += elapsed
+                self._max_latency[route.intent] = max(self._max_latency[route.intent], elapsed)
+
+    def stats(self):
+        """Invocations and handler latency per intent, busiest first."""
+        with self._lock:
+            return {
+                name: {
+                    'calls': calls,
+                    'avg_ms': 1000.0 * self._latency[name] / calls,
+                    'max_ms': 1000.0 * self._max_latency[name],
+                }
+                for name, calls in self._calls.most_common()
+            }
+
+    def cache_stats(self):
+        with self._lock:
+            lookups = self.cache_hits + self.cache_misses
+            return {
+                'entries': len(self._cache),
+                'hits': self.cache_hits,
+                'misses': self.cache_misses,
+                'evictions': self.cache_evictions,
+                'invalidations': self.invalidations,
+                'corrections': self.corrections,
+                'hit_rate': self.cache_hits / lookups if lookups else 0.0,
+            }
+
+def _listen_slots(command, found):
+    m = SECONDS_RE.search(command)
+    return {'seconds': int(m.group(1)) if m else None}
+
+def _rate_slots(command, found):
+    m = RATE_RE.search(command)
+    if m:
+        return {'rate': int(m.group(1))}
+    if 'faster' in command:
+        return {'step': 20}
+    if 'slower' in command:
+        return {'step': -20}
+    return None
+
+def _close_slots(command, found):
+    if not found.isdisjoint(BRACKET_PHRASES):
+        return None
+    for trigger, processes in CLOSE_TARGETS:
+        if trigger in found:
+            return {'processes': processes}
+    return {'processes': ()}
+
+def _search_slots(command, found):
+    return {'query': command.replace("search", "").strip()}
+
+def _math_slots(command, found):
+    if found.isdisjoint(MATH_OPERATORS) and not any(token.isdigit() for token in command.split()):
+        return None
+    return {'expression': command}
+
+def _convert_slots(command, found):
+    query = UNITS.parse(command)
+    if query is None:
+        return None
+    value, source, target = query
+    return {'value': value, 'source': source, 'target': target}
+
+def _question_slots(command, found):
+    return {'help': HELP_QUESTION_RE.search(command) is not None}
+
+# ---------- Loki Assistant ----------
+class LokiAssistant:
+    def __init__(self, overlay_queue=None, recognizer_backend=None):
+        # TTS engine: started on first use, or ahead of it on the TTS thread (see run())
+        self._engine = None
+        self._engine_ready = False
+        self._engine_starting = False
+        self._engine_init_lock = threading.RLock()
+        self.engine_init_time = None
+        self.capture_init_time = None
+        self.engine_lock = threading.Lock()
+
+        # speech is rendered and played here so the microphone can tell it apart from the user
+        self.echo_cancellation = True
+        self.echo_gate = None
+        self.player = SpeechPlayer(self._on_playback_start, self._on_playback_stop)
+        # one synthesizer process for the whole session, started on first use
+        self.synthesizer = PersistentSynthesizer()
+        self.speech_cache = SpeechCache()
+
+        # TTS queue, spoken by a task on the event loop while serve() runs
+        self.tts_queue = SpeechQueue()
 
         # recognizer
         self.recognizer = sr.Recognizer() if sr else None
+        self.recognizer_backend = self._make_recognizer_backend(recognizer_backend) if sr else None
+        self.wake_gate = WakeWordGate()
+        if self.wake_gate.enabled:
+            print(f"{Fore.GREEN}Wake word gate on ({len(self.wake_gate.templates)} templates, "
+                  f"threshold {self.wake_gate.threshold:.3f}){Style.RESET_ALL}")
         self.listen_duration = 7
+        self.sample_rate = RECOGNIZER_SAMPLE_RATE
+        self.mic = None
+        self.endpointer = None
+        self.vad_hangover_ms = 300
+        self._capture_pos = None
         self._suppress_listen = False
         self._last_spoken_time = 0
         self.print_responses = True
+        self.pipeline_queue_size = 4
+        self.stages = []
+        # event loop core (see serve()): blocking libraries run in these executors
+        self.loop = None
+        self.executors = self._make_executors()
+        self._stopping = None
+        self._overlay_events = None
+        self._loop_thread = None
+        self._stop_event = threading.Event()
+        # a command routed to the same intent and slots as the last one, within the window,
+        # is a repeat of it (heard twice, or said again while it ran) and isn't run again
         self._last_command = None
         self._last_command_time = 0
         self.duplicate_action_window = 5
+        self.duplicates_suppressed = collections.Counter()
 
-        # math ops
-        self.operators = {
-            '+': lambda x, y: x + y,
-            '-': lambda x, y: x - y,
-            'x': lambda x, y: x * y,
-            '*': lambda x, y: x * y,
-            '/': lambda x, y: x / y if y != 0 else None
-        }
-
-        self.question_words = [
-            "what", "who", "when", "where", "why", "how", "which",
-            "could you", "can you", "would you", "will you",
-            "tell me", "show me", "let me know"
-        ]
-        self.action_keywords = [
-            'open', 'close', 'search', 'calculate', 'set', 'change', 'play', 'take', 'screenshot',
-            'stop', 'quit', 'exit', 'launch', 'find', 'calculator'
-        ]
+        # the @intent handlers below, indexed once; process_command routes with one scan
+        self.intents = IntentRegistry().load(self)
+        self.actions = ActionExecutor(self.executors['actions'], on_done=self._on_action_done,
+                                      on_timeout=self._on_action_timeout)
 
         # voice choices
         self.current_voice_index = 0
@@ -297,6 +1318,50 @@ class LokiAssistant:
         # preferred browser tokens
         self.PREFERRED_BROWSER_TITLES = ['chrome', 'youtube', 'edge', 'firefox', 'brave']
 
+    def _make_recognizer_backend(self, name=None):
+        if isinstance(name, RecognizerBackend):
+            return name
+        name = name or RECOGNIZER_BACKEND
+        try:
+            if name == 'google':
+                return GoogleRecognizerBackend(self.recognizer)
+            return RECOGNIZER_BACKENDS[name]()
+        except Exception as e:
+            print(f"{Fore.YELLOW}Recognizer backend '{name}' unavailable ({e}); using Google{Style.RESET_ALL}")
+            return GoogleRecognizerBackend(self.recognizer)
+
+    @property
+    def engine(self):
+        if self._engine_ready:
+            return self._engine
+        return self.init_engine()
+
+    @engine.setter
+    def engine(self, value):
+        self._engine = value
+        if not self._engine_starting:
+            self._engine_ready = True
+
+    def init_engine(self):
+        """Start pyttsx3 and pick a voice, once; callers that need it meanwhile wait here."""
+        with self._engine_init_lock:
+            # setup_voice() reads self.engine again on this thread
+            if self._engine_ready or self._engine_starting:
+                return self._engine
+            self._engine_starting = True
+            start = time.perf_counter()
+            try:
+                self.engine = pyttsx3.init()
+                self.setup_voice()
+            except Exception:
+                self.engine = None
+                print(f"{Fore.YELLOW}Warning: pyttsx3 init failed, the synthesizer process will be used"
+                      f"{Style.RESET_ALL}")
+            self.engine_init_time = time.perf_counter() - start
+            self._engine_starting = False
+            self._engine_ready = True
+            return self._engine
+
     def setup_voice(self):
         if self.engine:
             try:
@@ -312,14 +1377,10 @@ class LokiAssistant:
             except Exception:
                 self.engine = None
 
-    def speak(self, text):
+    def speak(self, text, category=None):
         if not text:
             return
-        try:
-            if self.overlay_queue:
-                self.overlay_queue.put(('assistant', text))
-        except Exception:
-            pass
+        self._post_overlay('assistant', text)
 
         if self.print_responses:
             try:
@@ -327,199 +1388,351 @@ class LokiAssistant:
             except Exception:
                 print("Assistant:", text)
 
+        # a reply the queue folded or dropped was dropped by policy; only speak
+        # here when the worker has already gone away
+        if self.tts_queue.put(text, category) or not self.tts_queue.closed:
+            return
+
+        self._speak_fallback(text)
+
+    def _speak_next(self):
+        """Speak the next queued reply (blocks); False once the queue is closed and empty."""
+        text = self.tts_queue.get()
+        if text is None:
+            return False
         try:
-            self._last_spoken_time = time.time()
+            if not self._speak_rendered(text):
+                self._speak_fallback(text)
         except Exception:
             pass
+        finally:
+            self.tts_queue.task_done()
+        return True
 
+    def _speech_key(self, text):
+        # whatever renders the text decides how it sounds
+        if self.engine:
+            with self.engine_lock:
+                voice = self.engine.getProperty('voice')
+                rate = self.engine.getProperty('rate')
+                volume = self.engine.getProperty('volume')
+            return (text, f"engine:{voice}", rate, volume)
+        return (text, f"host:{self._synth_voice()}", 0, 100)
+
+    def render_speech(self, text):
+        """Return `text` as (int16 PCM, sample rate), from the SpeechCache when it was rendered before."""
+        key = self._speech_key(text)
+        rendered = self.speech_cache.get(key)
+        if rendered is None:
+            rendered = self._render(text)
+            if rendered is not None:
+                self.speech_cache.put(key, *rendered)
+        return rendered
+
+    def warm_speech_cache(self, phrases=WARM_PHRASES):
+        """Load fixed phrases from the disk cache, rendering any that were never rendered."""
+        for chunk in (chunk for text in phrases for chunk in split_speech(text)):
+            if self._stop_event.is_set():
+                return
+            key = self._speech_key(chunk)
+            if self.speech_cache.get(key, count=False) is None:
+                rendered = self._render(chunk)
+                if rendered is not None:
+                    self.speech_cache.put(key, *rendered)
+
+    def _render(self, text):
+        """Synthesize `text` to (int16 PCM, sample rate) without playing it; None if unavailable."""
+        if not self.engine and not self.synthesizer.available:
+            return None
+        fd, path = tempfile.mkstemp(prefix='loki_tts_', suffix='.wav')
+        os.close(fd)
         try:
-            self.tts_queue.put_nowait(text)
-            return
-        except queue.Full:
-            try:
-                while not self.tts_queue.empty():
-                    self.tts_queue.get_nowait()
-            except Exception:
-                pass
+            if self.engine:
+                with self.engine_lock:
+                    self.engine.save_to_file(text, path)
+                    self.engine.runAndWait()
+            else:
+                self.synthesizer.speak(text, voice=self._synth_voice(), path=path)
+            with wave.open(path, 'rb') as wf:
+                if wf.getsampwidth() != 2:
+                    return None
+                channels = wf.getnchannels()
+                pcm = np.frombuffer(wf.readframes(wf.getnframes()), dtype=np.int16)
+                rate = wf.getframerate()
+            if channels > 1:
+                pcm = pcm[::channels]
+            return (pcm, rate) if pcm.size else None
+        except Exception:
+            return None
+        finally:
             try:
-                self.tts_queue.put_nowait(text)
-                return
-            except Exception:
+                os.remove(path)
+            except OSError:
                 pass
 
+    def _speak_rendered(self, text):
+        """Stream `text` a sentence at a time through the SpeechPlayer; False if it couldn't be rendered."""
+        started = time.perf_counter()
+        chunks = split_speech(text)
+        if not chunks:
+            return False
+        if self.echo_cancellation:
+            render = self.render_speech
+        else:
+            # phrases rendered before still play straight to the device
+            cached = [self.speech_cache.get(self._speech_key(chunk)) for chunk in chunks]
+            if any(rendered is None for rendered in cached):
+                return False
+            render = dict(zip(chunks, cached)).get
+        first = render(chunks[0])
+        if first is None:
+            return False
+
+        def rendered():
+            # sentence N+1 is synthesized here while sentence N plays
+            yield first
+            for chunk in chunks[1:]:
+                pcm = render(chunk)
+                if pcm is None:
+                    print(f"{Fore.YELLOW}Could not render: {chunk}{Style.RESET_ALL}")
+                    return
+                yield pcm
+
         try:
-            self._powershell_speak(text)
-        except Exception:
-            if self.engine:
-                try:
-                    self.engine.say(text)
-                    self.engine.runAndWait()
-                except Exception:
-                    print(f"{Fore.RED}TTS failed{Style.RESET_ALL}")
+            self.player.play_stream(rendered(), started)
+        except Exception as e:
+            print(f"{Fore.YELLOW}Playback failed: {e}{Style.RESET_ALL}")
+            return False
+        return True
 
-    def _tts_worker(self):
-        while getattr(self, '_tts_running', True):
-            try:
-                text = self.tts_queue.get(timeout=0.2)
-            except queue.Empty:
-                continue
-            if text is None:
-                break
+    def _speak_fallback(self, text):
+        # no reference signal: stop listening while talking and briefly after
+        self._suppress_listen = True
+        try:
             try:
-                try:
-                    self._powershell_speak(text)
-                except Exception:
-                    if self.engine:
-                        try:
+                self.synthesizer.speak(text, voice=self._synth_voice())
+            except Exception as e:
+                print(f"{Fore.YELLOW}Synthesizer error: {e}{Style.RESET_ALL}")
+                if self.engine:
+                    try:
+                        with self.engine_lock:
                             self.engine.say(text)
                             self.engine.runAndWait()
-                        except Exception:
-                            pass
-            except Exception:
-                pass
-            finally:
-                try:
-                    self.tts_queue.task_done()
-                except Exception:
-                    pass
-            time.sleep(0.01)
+                    except Exception:
+                        print(f"{Fore.RED}TTS failed{Style.RESET_ALL}")
+        finally:
+            self._suppress_listen = False
+            self._last_spoken_time = time.time()
 
-    def _powershell_speak(self, text: str):
-        if not text:
+    def _on_playback_start(self, pcm, rate, delay):
+        mic = self.mic
+        if mic is None or self.echo_gate is None:
             return
+        ref = pcm if rate == mic.sample_rate else PolyphaseResampler(rate, mic.sample_rate).process(pcm)
+        self.echo_gate.add_reference(mic.ring.position + int(delay * mic.sample_rate), ref)
+
+    def _on_playback_stop(self):
+        if self.mic is not None and self.echo_gate is not None:
+            self.echo_gate.truncate(self.mic.ring.position)
+
+    @property
+    def is_speaking(self):
+        return self.player.is_playing
+
+    def stop_speaking(self, clear_queue=True):
+        """Cut the current utterance short and, with `clear_queue`, drop what was queued after it."""
+        if clear_queue:
+            self.tts_queue.clear()
+        self.player.stop()
+
+    def handle_barge_in(self, command, over_speech=None):
+        """Act on 'stop' / 'next' said over the assistant; True if `command` was one.
+
+        `over_speech` is whether the utterance was captured while the assistant could be
+        heard (see capture_utterance); without it, whether it is talking right now.
+        """
+        if not (self.is_speaking if over_speech is None else over_speech):
+            return False
+        phrase = re.sub(r"[^a-z ]", '', command.lower())
+        phrase = re.sub(r"\b(loki|hey|please|okay|ok)\b", '', phrase)
+        action = BARGE_IN_COMMANDS.get(' '.join(phrase.split()))
+        if action is None:
+            return False
+        self.stop_speaking(clear_queue=(action == 'stop'))
+        return True
+
+    def _synth_voice(self):
+        # SAPI picks voices by name; the espeak host keeps its default voice
         if platform.system().lower() != "windows":
-            raise RuntimeError("PowerShell TTS only available on Windows")
-        try:
-            safe = str(text).replace("'", "''").replace('"', '""')
-            select_voice_cmd = ''
-            try:
-                if self.available_voice_names and 0 <= self.current_voice_index < len(self.available_voice_names):
-                    ps_name = str(self.available_voice_names[self.current_voice_index]).replace("'", "''")
-                    select_voice_cmd = f"$synth.SelectVoice('{ps_name}');"
-            except Exception:
-                select_voice_cmd = ''
-            ps_script = (
-                "try {{\n"
-                "    Add-Type -AssemblyName System.Speech;\n"
-                "    $synth = New-Object System.Speech.Synthesis.SpeechSynthesizer;\n"
-                "    {SELECT_VOICE_CMD}\n"
-                "    $synth.Rate = 0;\n"
-                "    $synth.Volume = 100;\n"
-                "    [Console]::OutputEncoding = [System.Text.Encoding]::UTF8;\n"
-                "    $synth.Speak([string]'{SAFE}');\n"
-                "    $synth.Dispose();\n"
-                "}} catch {{\n"
-                "    [Console]::Error.WriteLine($_.Exception.Message);\n"
-                "    exit 1;\n"
-                "}}"
-            )
-            try:
-                ps_filled = ps_script.format(SELECT_VOICE_CMD=select_voice_cmd, SAFE=safe)
-            except Exception:
-                ps_filled = ps_script.replace('{SELECT_VOICE_CMD}', select_voice_cmd).replace('{SAFE}', safe)
-            cmd = ['powershell', '-NoProfile', '-NonInteractive', '-Command', ps_filled]
-            creationflags = 0
-            if hasattr(subprocess, "CREATE_NO_WINDOW"):
-                creationflags = subprocess.CREATE_NO_WINDOW
-            result = subprocess.run(cmd, shell=False, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
-                                    text=True, creationflags=creationflags)
-            if result.returncode != 0:
-                raise Exception(f"PowerShell TTS failed: {result.stderr}")
-        except Exception as e:
-            print(f"{Fore.YELLOW}PowerShell TTS error: {e}{Style.RESET_ALL}")
-            raise
+            return None
+        if self.available_voice_names and 0 <= self.current_voice_index < len(self.available_voice_names):
+            return str(self.available_voice_names[self.current_voice_index])
+        return None
 
     # audio recording and saving
-    def record_audio(self, duration=None, sample_rate=44100):
+    def _ensure_capture(self):
+        if self.mic is None:
+            self.mic = MicrophoneStream(sample_rate=self.sample_rate)
+        self.mic.start()
+        if self.endpointer is None:
+            vad = VoiceActivityDetector(self.mic.sample_rate)
+            self.echo_gate = EchoGate(self.mic.sample_rate, vad.frame_len)
+            self.endpointer = UtteranceEndpointer(vad, hangover_ms=self.vad_hangover_ms,
+                                                  echo_gate=self.echo_gate)
+        if self._capture_pos is None:
+            self._capture_pos = self.mic.ring.position
+        return self.mic
+
+    def _discard_captured(self):
+        """Skip everything captured so far (e.g. while the assistant was talking)."""
+        if self.mic is not None:
+            self._capture_pos = self.mic.ring.position
+
+    def record_audio(self, duration=None):
+        """Return the next `duration` seconds of microphone audio.
+
+        Windows are taken back to back from the ring buffer, so audio captured while
+        the previous command was being handled counts towards this one and only the
+        part not yet captured is waited for.
+        """
         duration = duration or self.listen_duration
-        recording = sd.rec(int(duration * sample_rate), samplerate=sample_rate, channels=1)
-        sd.wait()
-        return recording.flatten()
-
-    def save_audio(self, recording, filename="temp.wav", sample_rate=44100):
+        mic = self._ensure_capture()
+        ring = mic.ring
+        start = max(self._capture_pos, ring.oldest)
+        end = start + int(duration * mic.sample_rate)
+        ring.wait_for(end, timeout=duration + 1.0)
+        recording = ring.read(start, end)
+        self._capture_pos = start + len(recording)
+        return recording
+
+    def capture_utterance(self, timeout=None):
+        """Wait for the next spoken utterance and return it as sr.AudioData, silence trimmed.
+
+        Returns as soon as the endpointer sees the hangover after speech ends, or None
+        if nothing was said within `timeout` seconds (default: listen_duration). The
+        PCM is copied out of the ring buffer once, straight into the AudioData.
+        """
+        timeout = timeout or self.listen_duration
+        mic = self._ensure_capture()
+        ring = mic.ring
+        ep = self.endpointer
+        frame_len = ep.frame_len
+        ep.reset()
+        pos = max(self._capture_pos, ring.oldest)
+        deadline = time.time() + timeout
+        while True:
+            if pos < ring.oldest:
+                # fell behind the ring buffer; restart from the oldest audio still held
+                pos = ring.oldest
+                ep.reset()
+            n_frames = (ring.position - pos) // frame_len
+            if n_frames == 0:
+                if not ep.in_speech and (time.time() >= deadline or self._stop_event.is_set()):
+                    self._capture_pos = pos
+                    return None
+                ring.wait_for(pos + frame_len, timeout=0.1)
+                continue
+            end = pos + n_frames * frame_len
+            block = ring.read(pos, end)
+            if len(block) != end - pos:
+                continue
+            bounds = ep.feed(block.reshape(n_frames, frame_len), pos)
+            pos = end
+            if bounds:
+                self._capture_pos = bounds[1]
+                audio = sr.AudioData(ring.read_bytes(*bounds), mic.sample_rate, 2)
+                # said over the assistant or not is fixed here, however long recognition takes
+                audio.over_speech = self.echo_gate.overlaps(*bounds)
+                return audio
+
+    def save_audio(self, audio, filename="temp.wav"):
+        """Write a captured utterance to a WAV file (for debugging; listen() never touches disk)."""
         with wave.open(filename, 'wb') as wf:
             wf.setnchannels(1)
-            wf.setsampwidth(2)
-            wf.setframerate(sample_rate)
-            wf.writeframes((recording * 32767).astype(np.int16).tobytes())
+            wf.setsampwidth(audio.sample_width)
+            wf.setframerate(audio.sample_rate)
+            wf.writeframes(audio.frame_data)
 
-    # --------- FIXED listen() (no 'with sd.rec(...) as ...') ----------
-    def listen(self):
-        """Record and transcribe, with safeguards against hearing assistant."""
-        try:
-            if self.overlay_queue:
-                self.overlay_queue.put(('listening', True))
-        except Exception:
-            pass
+    # --------- listen(): capture one utterance, then transcribe it ----------
+    def listen_for_utterance(self):
+        """Capture the next utterance, with safeguards against hearing the assistant."""
+        self._post_overlay('listening', True)
 
         try:
+            # rendered speech is gated by the echo reference; these only cover the fallback voices
             if getattr(self, '_suppress_listen', False):
-                return ""
-            last = getattr(self, '_last_spoken_time', 0)
-            if time.time() - last < 0.6:
-                return ""
+                self._discard_captured()
+                return None
+            # let the fallback voice's tail die away: sleep out the rest of the window
+            # (or until stopped) instead of coming straight back to spin on it
+            remaining = getattr(self, '_last_spoken_time', 0) + 0.6 - time.time()
+            if remaining > 0:
+                self._stop_event.wait(remaining)
+                self._discard_captured()
+                return None
 
-            if not self.recognizer:
-                return ""
+            if not self.recognizer_backend:
+                return None
 
-            # RECORD properly
+            # RECORD until the end of the next utterance
             try:
-                recording = self.record_audio()
+                audio = self.capture_utterance()
             except Exception as e:
                 print(f"{Fore.RED}Recording error: {e}{Style.RESET_ALL}")
                 self.speak("Microphone error. Please ensure your microphone is connected.")
-                return ""
+                return None
 
-            temp_file = "temp_recording.wav"
-            try:
-                self.save_audio(recording, temp_file)
-            except Exception as e:
-                print(f"{Fore.RED}Save audio error: {e}{Style.RESET_ALL}")
-                self.speak("Microphone error while saving audio.")
-                return ""
+            # only audio after the wake word reaches the recognizer
+            if audio is not None and self.wake_gate.enabled:
+                gated = self.wake_gate.check(audio)
+                if self.wake_gate.woke:
+                    self.speak("Yes?")
+                if gated is not None:
+                    gated.over_speech = audio.over_speech
+                elif audio.over_speech and not self.wake_gate.woke:
+                    gated = audio  # 'stop' / 'next' over the assistant need no wake word
+                audio = gated
+            if audio is not None and audio.over_speech:
+                # whatever the echo gate let through, over the assistant's own voice only
+                # 'stop' / 'next' are acted on, so it can never answer itself
+                audio.barge_in_only = True
+            return audio
+        finally:
+            self._post_overlay('listening', False)
 
-            # TRANSCRIBE
-            try:
-                with sr.AudioFile(temp_file) as source:
-                    audio = self.recognizer.record(source)
-                    try:
-                        command = self.recognizer.recognize_google(audio).lower()
-                    except sr.UnknownValueError:
-                        self.speak("Sorry, I didn't catch that. Please say that again clearly.")
-                        command = ""
-                    except sr.RequestError as e:
-                        print(f"{Fore.RED}Recognition request error: {e}{Style.RESET_ALL}")
-                        self.speak("Sorry, there was an error with the speech recognition service.")
-                        command = ""
-                    except Exception as e:
-                        print(f"{Fore.RED}Recognition error: {e}{Style.RESET_ALL}")
-                        self.speak("Sorry, I couldn't reach the speech service.")
-                        command = ""
-            finally:
-                try:
-                    os.remove(temp_file)
-                except Exception:
-                    pass
+    def recognize(self, audio):
+        """Transcribe captured audio straight from memory; returns "" when nothing was understood."""
+        try:
+            command = self.recognizer_backend.recognize(audio).lower()
+        except sr.UnknownValueError:
+            if not getattr(audio, 'barge_in_only', False):
+                self.speak("Sorry, I didn't catch that. Please say that again clearly.")
+            command = ""
+        except sr.RequestError as e:
+            print(f"{Fore.RED}Recognition request error: {e}{Style.RESET_ALL}")
+            self.speak("Sorry, there was an error with the speech recognition service.")
+            command = ""
+        except Exception as e:
+            print(f"{Fore.RED}Recognition error: {e}{Style.RESET_ALL}")
+            self.speak("Sorry, I couldn't reach the speech service.")
+            command = ""
 
-            if self.print_responses and command:
-                print(f"{Fore.YELLOW}🗣️ You said: {command}{Style.RESET_ALL}")
-            try:
-                if self.overlay_queue:
-                    self.overlay_queue.put(('user', command))
-            except Exception:
-                pass
-            return command
+        if self.print_responses and command:
+            print(f"{Fore.YELLOW}🗣️ You said: {command}{Style.RESET_ALL}")
+        self._post_overlay('user', command)
+        return command
 
+    def listen(self):
+        """Record and transcribe one command (blocking; run() pipelines the two steps)."""
+        try:
+            audio = self.listen_for_utterance()
+            if audio is None:
+                return ""
+            return self._recognize_stage(audio) or ""
         except Exception as e:
             print(f"{Fore.RED}Microphone error: {e}{Style.RESET_ALL}")
             self.speak("Microphone error. Please ensure your microphone is connected.")
             return ""
-        finally:
-            try:
-                if self.overlay_queue:
-                    self.overlay_queue.put(('listening', False))
-            except Exception:
-                pass
 
     # screenshot
     def take_screenshot(self):
@@ -529,7 +1742,7 @@ class LokiAssistant:
                 os.makedirs(screenshots_dir)
             self._suppress_listen = True
             for i in range(2, 0, -1):
-                self.speak(str(i))
+                self.speak(str(i), category='countdown')
                 time.sleep(1)
             screenshot = pyautogui.screenshot()
             filename = f'screenshot_{datetime.datetime.now().strftime("%Y%m%d_%H%M%S")}.png'
@@ -615,31 +1828,7 @@ class LokiAssistant:
             return False
 
     def solve_math(self, expression):
-        try:
-            expr = expression.lower()
-            expr = expr.replace('what is', '').replace('calculate', '').replace('solve', '')
-            expr = expr.replace("what's", '').replace('whats', '').replace('equals', '')
-            expr = expr.replace('equal to', '').replace('answer', '').strip()
-            expr = expr.replace('plus', '+').replace('minus', '-').replace('x', '*')
-            expr = expr.replace('times', '*').replace('multiplied by', '*').replace('divided by', '/')
-            number_pattern = r'-?\d+(?:\.\d+)?'
-            numbers = list(map(float, re.findall(number_pattern, expr)))
-            if len(numbers) != 2:
-                return None
-            op_match = re.search(r'[\+\-\*/x]', expr)
-            if not op_match:
-                return None
-            op = op_match.group()
-            num1, num2 = numbers
-            if op in self.operators:
-                result = self.operators[op](num1, num2)
-                if result is not None:
-                    if float(result).is_integer():
-                        return int(result)
-                    return result
-            return None
-        except Exception:
-            return None
+        return solve_arithmetic(expression)
 
     # --------------- YouTube/Music controls ---------------
     def _focus_browser_window(self):
@@ -712,7 +1901,7 @@ class LokiAssistant:
 
     def skip_youtube_ad(self):
         try:
-            self.speak("Trying to skip the ad.")
+            self.speak("Trying to skip the ad.", category='ad')
             self._focus_browser_window()
             attempts = 6
             for attempt in range(attempts):
@@ -732,7 +1921,7 @@ class LokiAssistant:
 
                 clicked = self._try_click_skip_images()
                 if clicked:
-                    self.speak("Skipped the ad.")
+                    self.speak("Skipped the ad.", category='ad')
                     return True
 
                 try:
@@ -743,16 +1932,17 @@ class LokiAssistant:
                 time.sleep(0.5)
             try:
                 pyautogui.press('nexttrack')
-                self.speak("Attempted next track as fallback.")
+                self.speak("Attempted next track as fallback.", category='ad')
                 return True
             except Exception:
                 pass
 
-            self.speak("I tried multiple methods but couldn't detect the skip button. Make sure the video is visible.")
+            self.speak("I tried multiple methods but couldn't detect the skip button. Make sure the video is visible.",
+                       category='ad')
             return False
         except Exception as e:
             print(f"{Fore.RED}skip_youtube_ad error: {e}{Style.RESET_ALL}")
-            self.speak("Sorry, I couldn't skip the ad automatically.")
+            self.speak("Sorry, I couldn't skip the ad automatically.", category='ad')
             return False
 
     def play_next_track(self):
@@ -784,339 +1974,1606 @@ class LokiAssistant:
 
     # Command processor
     def process_command(self, command):
-        if not command:
+        """Route `command` and hand its handler to the action pool; returns without waiting for it."""
+        route = self.intents.route(command)
+        if route is None:
             return True
-        original = command
-        command = command.lower().strip()
-        for w in ['loki', 'lokesh', 'low key', 'hey']:
-            if command.startswith(w):
-                command = command.replace(w, '', 1).strip()
-        command = re.sub(r'\s+', ' ', command)
-        words = set(command.split())
-
-        is_question = False
-        if any(command.strip().startswith(q) for q in self.question_words):
-            is_question = True
-        if '?' in original:
-            is_question = True
-
-        math_patterns = [
-            r"^what\s+is\s+\d+[\s+\+\-\*/x]\s*\d+",
-            r"^calculate\s+\d+[\s+\+\-\*/x]\s*\d+",
-            r"^solve\s+\d+[\s+\+\-\*/x]\s*\d+",
-            r"^how\s+much\s+is\s+\d+[\s+\+\-\*/x]\s*\d+"
-        ]
-        if any(re.search(pattern, command) for pattern in math_patterns):
-            is_question = True
-
-        question_patterns = [
-            r"^can you",
-            r"^could you",
-            r"^tell me",
-            r"^do you",
-            r"^how (do|can|would|could|should|is|are|to)",
-            r"^what (is|are|should|can|do|does)",
-            r"^when (is|are|should|will)",
-            r"^where (is|are|can)",
-            r"^why (is|are|do|does)",
-            r"^which (is|are|one)",
-            r"^would you",
-            r"^will you",
-            r"^show me",
-            r"^let me know"
-        ]
-        if any(re.search(pattern, command) for pattern in question_patterns):
-            is_question = True
-
-        is_action = any(re.search(r'\b' + re.escape(k) + r'\b', command) for k in self.action_keywords)
-        if not (is_question or is_action):
+        spec = self.intents.spec(route.intent)
+        if self._is_duplicate(route, spec):
             return True
+        if not self.actions.submit(route.intent, functools.partial(self.intents.dispatch, route),
+                                   spec.resource, spec.timeout):
+            self.speak("I'm still busy with the last few things. Please ask again in a moment.")
+            self._last_command = None
+        return True
 
-        # listening duration change
-        if ("listening" in command or "listen" in command) and any(w in words for w in ["set", "change", "make"]):
-            m = re.search(r"(\d+)", command)
-            if m:
-                secs = int(m.group(1))
-                self.listen_duration = max(1, min(60, secs))
-                self.speak(f"Okay, I will listen for {self.listen_duration} seconds.")
-                return True
-            else:
-                self.speak("Please tell me how many seconds to listen.")
-                return True
-
-        # speech rate
-        if any(w in command for w in ["speech rate", "speak faster", "speak slower", "change speech"]):
-            m = re.search(r"(\d{2,3})", command)
-            if m:
-                rate = int(m.group(1))
-                if self.engine:
-                    try:
-                        self.engine.setProperty('rate', rate)
-                        self.speak(f"Speech rate set to {rate}.")
-                        return True
-                    except Exception:
-                        pass
-                self.speak(f"Okay, noted speech rate {rate}.")
-                return True
-            if 'faster' in command:
-                if self.engine:
-                    try:
-                        current = self.engine.getProperty('rate')
-                        new = min(300, current + 20)
-                        self.engine.setProperty('rate', new)
-                        self.speak('Okay, speaking a bit faster now.')
-                    except Exception:
-                        self.speak('Unable to change rate right now.')
-                else:
-                    self.speak('TTS engine not available.')
-                return True
-            if 'slower' in command:
-                if self.engine:
-                    try:
-                        current = self.engine.getProperty('rate')
-                        new = max(80, current - 20)
-                        self.engine.setProperty('rate', new)
-                        self.speak('Okay, speaking a bit slower now.')
-                    except Exception:
-                        self.speak('Unable to change rate right now.')
-                else:
-                    self.speak('TTS engine not available.')
-                return True
-
-        # again remove wake words
-        for w in ['loki', 'lokesh', 'low key']:
-            if command.startswith(w):
-                command = command.replace(w, '', 1).strip()
-        command = re.sub(r'\s+', ' ', command)
-        if not command:
-            return True
+    def _is_duplicate(self, route, spec, now=None):
+        """True (and counted) if `route` repeats the last command within its intent's window; else remember it.
 
-        # Basic commands
-        if any(word in command for word in ["hello", "hi", "hey"]):
-            self.speak("Hello! Yogesh, I'm Loki — your personal assistant. How can I help you today?")
-            return True
-        if "who are you" in command:
-            self.speak("I am Loki, your personal AI assistant. I can open apps , and more.")
-            return True
-        if any(t in command for t in ["time", "clock"]):
-            current_time = datetime.datetime.now().strftime("%I:%M %p")
-            self.speak(f"The current time is {current_time}")
-            return True
-        if any(w in command for w in ["weather", "temperature", "forecast"]):
-            self.get_weather()
-            return True
-
-        if "screenshot" in command or "capture" in command or "screen shot" in command:
-            self.take_screenshot()
+        `now` is a time.monotonic() reading, taken when not given.
+        """
+        key = (route.intent, route.command, tuple(sorted(route.slots.items())) if route.slots else ())
+        if spec.dedup is not None:
+            window = spec.dedup
+        else:
+            window = self.duplicate_action_window if spec.resource else 0
+        if now is None:
+            now = time.monotonic()
+        if window and key == self._last_command and now - self._last_command_time < window:
+            self.duplicates_suppressed[route.intent] += 1
             return True
+        self._last_command = key
+        self._last_command_time = now
+        return False
 
-        # NEW controls: skip ad / next track / play / pause
-        if "skip ad" in command or "skip ads" in command or "skip the ad" in command:
-            self.skip_youtube_ad()
+    @intent('listen_duration', triggers=('listen', 'listening'), requires=('set', 'change', 'make'),
+            priority=100, slots=_listen_slots)
+    def _intent_listen_duration(self, command, slots):
+        if slots['seconds'] is None:
+            self.speak("Please tell me how many seconds to listen.")
             return True
+        self.listen_duration = max(1, min(60, slots['seconds']))
+        self.speak(f"Okay, I will listen for {self.listen_duration} seconds.")
+        return True
 
-        if "play next song" in command or "play next songs" in command or "next song" in command or "play next" in command or "next track" in command:
-            self.play_next_track()
+    @intent('speech_rate', triggers=SPEECH_RATE_TRIGGERS, priority=100, slots=_rate_slots, dedup=0)
+    def _intent_speech_rate(self, command, slots):
+        rate = slots.get('rate')
+        if rate is not None:
+            if self.engine:
+                try:
+                    # the TTS executor renders with this engine; pyttsx3 isn't thread-safe
+                    with self.engine_lock:
+                        self.engine.setProperty('rate', rate)
+                    self.speak(f"Speech rate set to {rate}.")
+                    return True
+                except Exception:
+                    pass
+            self.speak(f"Okay, noted speech rate {rate}.")
             return True
+        if self.engine:
+            try:
+                with self.engine_lock:
+                    current = self.engine.getProperty('rate')
+                    self.engine.setProperty('rate', max(80, min(300, current + slots['step'])))
+                self.speak(f"Okay, speaking a bit {'faster' if slots['step'] > 0 else 'slower'} now.")
+            except Exception:
+                self.speak('Unable to change rate right now.')
+        else:
+            self.speak('TTS engine not available.')
+        return True
 
-        if "play music" in command or ("play" in command and "music" in command):
-            played = self.play_pause_player()
-            if played:
-                self.speak("Playing the music.")
-            else:
-                self.speak("Tried to play the music.")
-            return True
+    @intent('hello', triggers=('hello', 'hi', 'hey'), priority=30, dedup=0)
+    def _intent_hello(self, command, slots):
+        self.speak("Hello! Yogesh, I'm Loki — your personal assistant. How can I help you today?")
+        return True
 
-        if "pause" in command or ("stop" in command and "music" in command):
-            paused = self.play_pause_player()
-            if paused:
-                self.speak("Paused.")
-            else:
-                self.speak("Tried to pause.")
-            return True
+    @intent('who_are_you', triggers=('who are you',), priority=95, dedup=0)
+    def _intent_who_are_you(self, command, slots):
+        self.speak("I am Loki, your personal AI assistant. I can open apps , and more.")
+        return True
 
-        # closing, opening, etc (kept original)
-        if "close" in command:
-            if "chrome" in command:
-                self.close_app("chrome.exe")
-            elif "camera" in command:
-                self.close_app("WindowsCamera.exe")
-            elif "calculator" in command or "calc" in command:
-                if not self.close_app("Calculator.exe"):
-                    self.close_app("ApplicationFrameHost.exe")
-            elif "vs code" in command or "visual studio code" in command:
-                self.close_app("Code.exe")
-            elif "spotify" in command:
-                self.close_app("spotify.exe")
-            else:
-                self.speak("Sorry, I don't know how to close that application.")
-            return True
+    @intent('time', triggers=('time', 'clock'), priority=90, dedup=0)
+    def _intent_time(self, command, slots):
+        current_time = datetime.datetime.now().strftime("%I:%M %p")
+        self.speak(f"The current time is {current_time}")
+        return True
 
-        if any(browser in command for browser in ["chrome", "browser", "chorme", "crome"]):
-            if "close" in command:
-                self.close_app("chrome.exe")
-            else:
-                self.speak("Opening Google Chrome")
-                self.open_app('chrome', url='http://google.com')
-            return True
+    @intent('weather', triggers=('weather', 'temperature', 'forecast'), priority=90, dedup=0)
+    def _intent_weather(self, command, slots):
+        self.get_weather()
+        return True
 
-        if "camera" in command:
-            if "close" in command:
-                self.close_app("WindowsCamera.exe")
-            else:
-                self.speak("Opening camera")
-                try:
-                    os.system("start microsoft.windows.camera:")
-                except Exception:
-                    pass
-            return True
+    @intent('screenshot', triggers=('screenshot', 'capture', 'screen shot'), priority=90,
+            resource='screen', timeout=10)
+    def _intent_screenshot(self, command, slots):
+        self.take_screenshot()
+        return True
 
-        if "whatsapp" in command:
-            if "close" in command:
-                self.close_app("WhatsApp.exe")
-            else:
-                self.speak("Opening WhatsApp Web")
-                webbrowser.open('https://web.whatsapp.com')
-            return True
+    @intent('skip_ad', triggers=('skip ad', 'skip ads', 'skip the ad'), priority=90, resource='screen', timeout=15)
+    def _intent_skip_ad(self, command, slots):
+        self.skip_youtube_ad()
+        return True
 
-        if any(music in command for music in ["music", "songs", "song"]):
-            if "close" in command:
-                self.close_app("Music.UI.exe")
-            else:
-                self.speak("Opening YouTube Music")
-                webbrowser.open('https://music.youtube.com')
-            return True
+    @intent('next_track', triggers=('next song', 'play next', 'next track'), priority=85, resource='screen',
+            dedup=0)
+    def _intent_next_track(self, command, slots):
+        self.play_next_track()
+        return True
 
-        if "youtube" in command:
-            if "close" in command:
-                self.close_app("chrome.exe")
-            else:
-                self.speak("Opening YouTube")
-                webbrowser.open('https://youtube.com')
-            return True
+    @intent('play_music', triggers=(('play', 'music'),), priority=80, resource='screen')
+    def _intent_play_music(self, command, slots):
+        if self.play_pause_player():
+            self.speak("Playing the music.")
+        else:
+            self.speak("Tried to play the music.")
+        return True
 
-        if "edge" in command or "microsoft edge" in command:
-            if "close" in command:
-                self.close_app("msedge.exe")
-            else:
-                self.speak("Opening Microsoft Edge")
-                edge = shutil.which('msedge') or shutil.which('msedge.exe')
-                if edge:
-                    try:
-                        subprocess.Popen([edge], shell=False)
-                    except Exception:
-                        try:
-                            os.system('start microsoft-edge:')
-                        except Exception:
-                            pass
-                else:
-                    try:
-                        os.system('start microsoft-edge:')
-                    except Exception:
-                        pass
-            return True
+    @intent('pause', triggers=('pause', ('stop', 'music')), priority=80, resource='screen')
+    def _intent_pause(self, command, slots):
+        if self.play_pause_player():
+            self.speak("Paused.")
+        else:
+            self.speak("Tried to pause.")
+        return True
 
-        if "spotify" in command:
-            self.speak("Opening Spotify Web")
-            webbrowser.open('https://open.spotify.com')
-            return True
+    @intent('close_app', triggers=('close',), priority=75, slots=_close_slots, resource='processes')
+    def _intent_close_app(self, command, slots):
+        if not slots['processes']:
+            self.speak("Sorry, I don't know how to close that application.")
+        for name in slots['processes']:
+            if self.close_app(name):
+                break
+        return True
 
-        if "google" in command and ("open" in command or "search" in command):
-            self.speak("Opening Google")
-            webbrowser.open('http://google.com')
-            return True
+    @intent('open_chrome', triggers=('chrome', 'browser'), priority=70, resource='browser')
+    def _intent_open_chrome(self, command, slots):
+        self.speak("Opening Google Chrome")
+        self.open_app('chrome', url='http://google.com')
+        return True
 
-        if any(k in command for k in ["code", "vs code", "visual studio code"]):
-            self.speak("Opening Visual Studio Code")
-            self.open_app('vscode')
-            return True
+    @intent('open_camera', triggers=('camera',), priority=70, resource='processes')
+    def _intent_open_camera(self, command, slots):
+        self.speak("Opening camera")
+        try:
+            os.system("start microsoft.windows.camera:")
+        except Exception:
+            pass
+        return True
 
-        if "thank you" in command:
-            self.speak("You're welcome! Is there anything else I can help you with?")
-            return True
+    @intent('open_whatsapp', triggers=('whatsapp',), priority=70, resource='browser')
+    def _intent_open_whatsapp(self, command, slots):
+        self.speak("Opening WhatsApp Web")
+        webbrowser.open('https://web.whatsapp.com')
+        return True
 
-        if any(word in command for word in ["goodbye", "bye", "quit", "exit"]):
-            self.speak("Goodbye! Have a great day!")
-            return False
+    @intent('open_music', triggers=('music', 'song', 'songs'), priority=70, resource='browser')
+    def _intent_open_music(self, command, slots):
+        self.speak("Opening YouTube Music")
+        webbrowser.open('https://music.youtube.com')
+        return True
 
-        if "joke" in command:
-            self.speak("Why don't scientists trust atoms? Because they make up everything!")
-            return True
+    @intent('open_youtube', triggers=('youtube',), priority=70, resource='browser')
+    def _intent_open_youtube(self, command, slots):
+        self.speak("Opening YouTube")
+        webbrowser.open('https://youtube.com')
+        return True
 
-        if "calculator" in command:
-            self.speak("Opening calculator")
+    @intent('open_edge', triggers=('edge',), priority=70, resource='browser')
+    def _intent_open_edge(self, command, slots):
+        self.speak("Opening Microsoft Edge")
+        edge = shutil.which('msedge') or shutil.which('msedge.exe')
+        if edge:
             try:
-                subprocess.Popen('calc.exe')
+                subprocess.Popen([edge], shell=False)
+                return True
             except Exception:
-                self.speak("Sorry, I couldn't open the calculator")
-            return True
+                pass
+        try:
+            os.system('start microsoft-edge:')
+        except Exception:
+            pass
+        return True
 
-        if "search" in command:
-            search_query = command.replace("search", "").strip()
-            if search_query:
-                self.speak(f"Searching for {search_query}")
-                webbrowser.open(f'https://www.google.com/search?q={search_query}')
-            else:
-                self.speak("What would you like me to search for?")
-            return True
+    @intent('open_spotify', triggers=('spotify',), priority=70, resource='browser')
+    def _intent_open_spotify(self, command, slots):
+        self.speak("Opening Spotify Web")
+        webbrowser.open('https://open.spotify.com')
+        return True
 
-        # math handling
-        if any(op in command for op in ['plus', 'minus', 'times', 'multiplied by', 'divided by', '+', '-', '*', '/', 'x']) or \
-           (any(w in command for w in ['what', 'calculate', 'solve']) and any(n.isdigit() for n in command.split())):
-            expr = command.lower()
-            expr = expr.replace('what is', '').replace('calculate', '').replace('equals', '').replace('equal to', '')
-            expr = expr.replace("what's", '').replace('whats', '').replace('solve', '')
-            expr = expr.strip()
-            result = self.solve_math(expr)
-            if result is not None:
-                self.speak(f"The answer is {result}")
-            else:
-                self.speak("Sorry, I couldn't solve that math problem. Try simple arithmetic like 2 plus 2.")
-            return True
+    @intent('open_google', triggers=('google',), requires=('open', 'search'), priority=70,
+            resource='browser')
+    def _intent_open_google(self, command, slots):
+        self.speak("Opening Google")
+        webbrowser.open('http://google.com')
+        return True
 
-        # fallback for questions
-        if is_question:
-            if re.search(r'how\s+(do|can)\s+you\s+(help|assist)', command):
-                self.speak("I can help open apps, perform calculations, tell the time, search the web, and more.")
-                return True
-            self.speak("I can help with many tasks — please try rephrasing or ask me to open an app or operations.")
-            return True
+    @intent('open_vscode', triggers=('code',), priority=70, resource='processes')
+    def _intent_open_vscode(self, command, slots):
+        self.speak("Opening Visual Studio Code")
+        self.open_app('vscode')
+        return True
 
+    @intent('thank_you', triggers=('thank you',), priority=60, dedup=0)
+    def _intent_thank_you(self, command, slots):
+        self.speak("You're welcome! Is there anything else I can help you with?")
         return True
 
-    def run(self):
-        self.speak("Hello! Yogesh. I'm Loki, your personal assistant. How can I help you?")
-        running = True
-        while running:
-            command = ""
+    @intent('goodbye', triggers=('goodbye', 'bye', 'quit', 'exit'), priority=60)
+    def _intent_goodbye(self, command, slots):
+        self.speak("Goodbye! Have a great day!")
+        return False
+
+    @intent('joke', triggers=('joke', 'jokes'), priority=60, dedup=0)
+    def _intent_joke(self, command, slots):
+        self.speak("Why don't scientists trust atoms? Because they make up everything!")
+        return True
+
+    @intent('open_calculator', triggers=('calculator',), priority=60, resource='processes')
+    def _intent_open_calculator(self, command, slots):
+        self.speak("Opening calculator")
+        try:
+            subprocess.Popen('calc.exe')
+        except Exception:
+            self.speak("Sorry, I couldn't open the calculator")
+        return True
+
+    @intent('search', triggers=('search',), priority=50, slots=_search_slots, resource='browser')
+    def _intent_search(self, command, slots):
+        if slots['query']:
+            self.speak(f"Searching for {slots['query']}")
+            webbrowser.open(f"https://www.google.com/search?q={slots['query']}")
+        else:
+            self.speak("What would you like me to search for?")
+        return True
+
+    @intent('convert', triggers=('convert', 'how many') + tuple(UNITS.plurals) + tuple(UNITS.plurals.values()),
+            priority=88, slots=_convert_slots, dedup=0)
+    def _intent_convert(self, command, slots):
+        self.speak(UNITS.answer(slots['value'], slots['source'], slots['target']))
+        return True
+
+    @intent('math', triggers=MATH_OPERATORS + BRACKET_PHRASES + ('what', 'calculate', 'solve'), priority=40,
+            slots=_math_slots, dedup=0)
+    def _intent_math(self, command, slots):
+        result = self.solve_math(slots['expression'])
+        if result is not None:
+            self.speak(f"The answer is {result}")
+        else:
+            self.speak("Sorry, I couldn't solve that math problem. Try simple arithmetic like 2 plus 2.")
+        return True
+
+    @intent('question', priority=0, slots=_question_slots, question=True, dedup=0)
+    def _intent_question(self, command, slots):
+        if slots['help']:
+            self.speak("I can help open apps, perform calculations, tell the time, search the web, and more.")
+        else:
+            self.speak("I can help with many tasks — please try rephrasing or ask me to open an app or operations.")
+        return True
+
+    # --------- event loop core: capture -> recognize -> dispatch, speech and overlay as tasks ----------
+    def _capture_stage(self):
+        audio = self.listen_for_utterance()
+        if audio is None and (self._suppress_listen or not self.recognizer_backend):
+            # nothing to capture right now; don't spin
+            self._stop_event.wait(0.05)
+        return audio
+
+    def _recognize_stage(self, audio):
+        command = self.recognize(audio)
+        if command and self.handle_barge_in(command, getattr(audio, 'over_speech', None)):
+            return None
+        if getattr(audio, 'barge_in_only', False):
+            return None  # heard over the assistant without the wake word
+        return command
+
+    def _dispatch_stage(self, command):
+        if not self.process_command(command):
+            self.stop()
+
+    def _on_action_done(self, name, result, error):
+        if error is not None:
+            print(f"{Fore.RED}{name} action error: {error}{Style.RESET_ALL}")
+            self.speak("Sorry, something went wrong with that.")
+        elif result is False:
+            self.stop()
+
+    def _on_action_timeout(self, name):
+        self.speak("That is taking a while, so I'll keep listening.")
+
+    def pipeline_stats(self):
+        """Queue depth and latency of each pipeline stage."""
+        return {stage.stage_name: stage.stats() for stage in self.stages}
+
+    def _make_executors(self):
+        pool = concurrent.futures.ThreadPoolExecutor
+        return {
+            'audio': pool(1, thread_name_prefix='loki-audio'),
+            # an abandoned recognition or action keeps its thread until it returns
+            'recognize': pool(2, thread_name_prefix='loki-recognize'),
+            'dispatch': pool(1, thread_name_prefix='loki-dispatch'),
+            'actions': pool(ACTION_WORKERS, thread_name_prefix='loki-actions'),
+            'tts': pool(1, thread_name_prefix='loki-tts'),
+            'background': pool(1, thread_name_prefix='loki-background'),
+        }
+
+    async def serve(self, warm_cache=False):
+        """Run the assistant on the current event loop until stop() (or cancellation).
+
+        Capture, recognition and dispatch are AsyncStage tasks joined by bounded queues;
+        speech and the overlay bridge are tasks of their own. pyttsx3, the recognizer,
+        pyautogui and psutil only ever run in executors, so the loop itself never blocks.
+        """
+        loop = asyncio.get_running_loop()
+        self._stopping = asyncio.Event()
+        self._overlay_events = asyncio.Queue()
+        self.loop = loop
+        if self._stop_event.is_set():
+            self._stopping.set()
+        audio_queue = asyncio.Queue(maxsize=self.pipeline_queue_size)
+        command_queue = asyncio.Queue(maxsize=self.pipeline_queue_size)
+        self.stages = [
+            AsyncStage('capture', self._capture_stage, None, audio_queue, self.executors['audio']),
+            AsyncStage('recognize', self._recognize_stage, audio_queue, command_queue,
+                       self.executors['recognize'], RECOGNIZE_TIMEOUT),
+            AsyncStage('dispatch', self._dispatch_stage, command_queue, None, self.executors['dispatch']),
+        ]
+        tasks = [asyncio.create_task(stage.run(), name=f"loki-{stage.stage_name}") for stage in self.stages]
+        if self.overlay_queue:
+            tasks.append(asyncio.create_task(self._overlay_bridge(), name="loki-overlay"))
+        if warm_cache:
+            tasks.append(loop.run_in_executor(self.executors['background'], self.warm_speech_cache))
+        speech = asyncio.create_task(self._speech_task(), name="loki-tts")
+        try:
+            await self._stopping.wait()
+        finally:
+            self._stop_event.set()
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            self.actions.cancel_waiting()
+            events, self._overlay_events = self._overlay_events, None
+            while not events.empty():
+                self._post_overlay(*events.get_nowait())
+            # queued replies (the goodbye) still get spoken; anything said later is spoken directly
+            self.tts_queue.close()
+            if not self._stopping.is_set():
+                self.stop_speaking()
             try:
-                command = self.listen()
-            except Exception:
+                await asyncio.wait_for(speech, SPEECH_DRAIN_TIMEOUT)
+            except asyncio.TimeoutError:
+                self.stop_speaking()
+            self.loop = None
+
+    async def _speech_task(self):
+        loop = asyncio.get_running_loop()
+        while await loop.run_in_executor(self.executors['tts'], self._speak_next):
+            pass
+
+    async def _overlay_bridge(self):
+        # listening flips on every capture; forward only the latest value per key
+        events = self._overlay_events
+        while True:
+            latest = dict([await events.get()])
+            while not events.empty():
+                key, value = events.get_nowait()
+                latest[key] = value
+            for item in latest.items():
+                self.overlay_queue.put(item)
+            await asyncio.sleep(OVERLAY_INTERVAL)
+
+    def _post_overlay(self, key, value):
+        """Send a state change to the overlay, through the bridge task while the loop runs."""
+        if not self.overlay_queue:
+            return
+        loop, events = self.loop, self._overlay_events
+        if loop is not None and events is not None:
+            try:
+                loop.call_soon_threadsafe(events.put_nowait, (key, value))
+                return
+            except RuntimeError:
+                pass  # the loop has just closed
+        try:
+            self.overlay_queue.put((key, value))
+        except Exception:
+            pass
+
+    def stop(self):
+        """Ask serve() to wind down; safe to call from any thread."""
+        self._stop_event.set()
+        loop, stopping = self.loop, self._stopping
+        if loop is not None and stopping is not None:
+            try:
+                loop.call_soon_threadsafe(stopping.set)
+            except RuntimeError:
                 pass
-            if command:
-                running = self.process_command(command)
-            time.sleep(0.1)
+
+    def start_pipeline(self):
+        """Run serve() on an event loop in a background thread until stop_pipeline()."""
+        self._stop_event.clear()
+        self._loop_thread = threading.Thread(target=asyncio.run, args=(self.serve(),), name="loki-loop", daemon=True)
+        self._loop_thread.start()
+
+    def stop_pipeline(self):
+        self.stop()
+        if self._loop_thread is not None:
+            self._loop_thread.join(timeout=SPEECH_DRAIN_TIMEOUT + 2)
+
+    def print_stats(self):
+        for name, st in self.pipeline_stats().items():
+            print(f"{Fore.BLUE}[{name}] processed={st['processed']} depth={st['depth']} "
+                  f"avg={st['avg_ms']:.1f}ms max={st['max_ms']:.1f}ms "
+                  f"wait={st['avg_wait_ms']:.1f}ms timeouts={st['timeouts']}{Style.RESET_ALL}")
+        st = self.actions.stats()
+        print(f"{Fore.BLUE}[actions] submitted={st['submitted']} pending={st['pending']} failed={st['failed']} "
+              f"timeouts={st['timeouts']} rejected={st['rejected']} avg={st['avg_ms']:.1f}ms "
+              f"max={st['max_ms']:.1f}ms wait={st['avg_wait_ms']:.1f}ms{Style.RESET_ALL}")
+        if self.recognizer_backend:
+            st = self.recognizer_backend.stats()
+            print(f"{Fore.BLUE}[recognizer:{st['backend']}] calls={st['calls']} failures={st['failures']} "
+                  f"avg={st['avg_ms']:.1f}ms max={st['max_ms']:.1f}ms{Style.RESET_ALL}")
+        if self.wake_gate.enabled:
+            st = self.wake_gate.stats()
+            print(f"{Fore.BLUE}[wake gate] checked={st['checked']} passed={st['passed']} "
+                  f"rejected={st['rejected']} cpu={st['cpu_ms_per_audio_s']:.2f}ms per audio second"
+                  f"{Style.RESET_ALL}")
+        if self.echo_gate is not None:
+            print(f"{Fore.BLUE}[echo gate] coupling={self.echo_gate.coupling or 0.0:.3f} "
+                  f"echo_frames={self.echo_gate.echo_frames} "
+                  f"barge_ins={self.player.interrupted}{Style.RESET_ALL}")
+        if self.synthesizer.starts:
+            st = self.synthesizer.stats()
+            print(f"{Fore.BLUE}[synthesizer] starts={st['starts']} requests={st['requests']} "
+                  f"failures={st['failures']} avg={st['avg_ms']:.1f}ms{Style.RESET_ALL}")
+        st = self.speech_cache.stats()
+        print(f"{Fore.BLUE}[tts cache] hits={st['hits']} (disk {st['disk_hits']}) misses={st['misses']} "
+              f"hit_rate={st['hit_rate']:.0%} entries={st['entries']} evictions={st['evictions']}{Style.RESET_ALL}")
+        st = self.tts_queue.stats()
+        print(f"{Fore.BLUE}[speech queue] queued={st['queued']} depth={st['depth']} max_depth={st['max_depth']} "
+              f"coalesced={st['coalesced']} replaced={st['replaced']} dropped={st['dropped']} "
+              f"cleared={st['cleared']} wait={st['avg_wait_ms']:.1f}ms{Style.RESET_ALL}")
+        st = self.intents.cache_stats()
+        print(f"{Fore.BLUE}[intent cache] hits={st['hits']} misses={st['misses']} hit_rate={st['hit_rate']:.0%} "
+              f"entries={st['entries']} evictions={st['evictions']} "
+              f"invalidations={st['invalidations']} corrected={st['corrections']}{Style.RESET_ALL}")
+        if self.duplicates_suppressed:
+            counts = ' '.join(f"{name}={n}" for name, n in self.duplicates_suppressed.most_common())
+            print(f"{Fore.BLUE}[dedup] suppressed={sum(self.duplicates_suppressed.values())} "
+                  f"window={self.duplicate_action_window}s {counts}{Style.RESET_ALL}")
+        for name, st in self.intents.stats().items():
+            print(f"{Fore.BLUE}[intent:{name}] calls={st['calls']} avg={st['avg_ms']:.1f}ms "
+                  f"max={st['max_ms']:.1f}ms{Style.RESET_ALL}")
+        st = self.player.stats()
+        if st['plays']:
+            print(f"{Fore.BLUE}[tts] plays={st['plays']} first_audio avg={st['avg_first_audio_ms']:.1f}ms "
+                  f"max={st['max_first_audio_ms']:.1f}ms underruns={st['underruns']}{Style.RESET_ALL}")
+
+    def start(self):
+        """Start the voice engine and open the microphone side by side, then queue the greeting.
+
+        The engine starts on the TTS thread, where it will be used, and the greeting is
+        spoken there as soon as it is ready. Returns the engine's future.
+        """
+        engine = self.executors['tts'].submit(self.init_engine)
+        start = time.perf_counter()
+        try:
+            # open the microphone first so the greeting is registered as echo
+            self._ensure_capture()
+        except Exception as e:
+            print(f"{Fore.RED}Recording error: {e}{Style.RESET_ALL}")
+        self.capture_init_time = time.perf_counter() - start
+        self.speak(GREETING)
+        return engine
+
+    def run(self):
+        self.start()
+        # capture -> recognize -> dispatch run concurrently, so the microphone keeps
+        # taking the next utterance while the previous one is recognized or acted on
+        self._stop_event.clear()
+        try:
+            asyncio.run(self.serve(warm_cache=True))
+        finally:
+            if self.print_responses:
+                self.print_stats()
 
     def shutdown(self):
+        self.stop_pipeline()
+        self.tts_queue.close()
+        for executor in self.executors.values():
+            executor.shutdown(wait=False, cancel_futures=True)
+        self.player.stop()
+        self.synthesizer.close()
+        if self.mic is not None:
+            self.mic.stop()
+
+# ---------- Benchmarks ----------
+def _time_per_call(fn, repeats):
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    return (time.perf_counter() - start) / repeats
+
+def benchmark_capture(utterance_seconds=2.0, repeats=20):
+    """Per-utterance memory and CPU cost of the old 44.1 kHz float path vs 16 kHz int16 capture.
+
+    "hand-off" is the work left after the utterance ends (what the user waits for);
+    "in callback" is spread over the capture callbacks while the user is still talking.
+    """
+    rng = np.random.default_rng(0)
+    block_duration = 0.05
+    results = []
+
+    signal_44k = (rng.standard_normal(int(utterance_seconds * 44100)) * 0.1).astype(np.float32)
+    temp_file = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_recording.wav")
+
+    def old_path():
+        # sd.rec float32 -> int16 copy -> temp WAV -> sr.AudioFile re-read
+        with wave.open(temp_file, 'wb') as wf:
+            wf.setnchannels(1)
+            wf.setsampwidth(2)
+            wf.setframerate(44100)
+            wf.writeframes((signal_44k * 32767).astype(np.int16).tobytes())
+        with sr.AudioFile(temp_file) as source:
+            sr.Recognizer().record(source)
+        os.remove(temp_file)
+
+    n_old = len(signal_44k)
+    # float32 recording + int16 copy + tobytes() + frame_data read back from the WAV
+    results.append(("44.1 kHz float32 + temp WAV (old)", n_old, n_old * (4 + 2 + 2 + 2),
+                    _time_per_call(old_path, repeats), 0.0))
+
+    ring = AudioRingBuffer(RECOGNIZER_SAMPLE_RATE * 30)
+    for rate in (16000, 48000, 44100):
+        pcm = (rng.standard_normal(int(utterance_seconds * rate)) * 3000).astype(np.int16)
+        step = int(rate * block_duration)
+        blocks = [pcm[i:i + step] for i in range(0, len(pcm), step)]
+        resampler = PolyphaseResampler(rate, RECOGNIZER_SAMPLE_RATE) if rate != RECOGNIZER_SAMPLE_RATE else None
+
+        def fill(blocks=blocks, resampler=resampler):
+            for block in blocks:
+                ring.write(resampler.process(block) if resampler else block)
+
+        def hand_off():
+            end = ring.position
+            sr.AudioData(ring.read_bytes(end - int(utterance_seconds * RECOGNIZER_SAMPLE_RATE), end),
+                         RECOGNIZER_SAMPLE_RATE, 2)
+
+        n_new = int(utterance_seconds * RECOGNIZER_SAMPLE_RATE)
+        if resampler:
+            label = f"{rate / 1000:g} kHz int16 -> 16 kHz polyphase"
+        else:
+            label = "16 kHz int16 native"
+        in_callback = _time_per_call(fill, repeats)
+        results.append((label, n_new, n_new * 2, _time_per_call(hand_off, repeats), in_callback))
+
+    print(f"Per {utterance_seconds:g} s utterance ({repeats} runs each):")
+    print(f"  {'path':<38}{'samples':>10}{'bytes':>12}{'hand-off ms':>14}{'in callback ms':>17}")
+    for label, samples, nbytes, secs, cb_secs in results:
+        print(f"  {label:<38}{samples:>10}{nbytes:>12}{secs * 1000:>14.3f}{cb_secs * 1000:>17.3f}")
+    base_bytes, base_secs = results[0][2], results[0][3]
+    for label, _, nbytes, secs, _ in results[1:]:
+        print(f"  {label}: {base_bytes - nbytes} fewer bytes, "
+              f"{(base_secs - secs) * 1000:.3f} ms less hand-off per utterance")
+
+def _load_fixture_clips(fixture_dir):
+    """Return [(16 kHz int16 PCM bytes, transcript)] for the WAV fixtures in `fixture_dir`."""
+    reference = FixtureRecognizerBackend(fixture_dir)
+    clips = []
+    for name, _, _, text in reference.fixtures:
+        with sr.AudioFile(os.path.join(fixture_dir, name)) as source:
+            audio = sr.Recognizer().record(source)
+        clips.append((audio.get_raw_data(convert_rate=RECOGNIZER_SAMPLE_RATE, convert_width=2), text))
+    return clips
+
+def benchmark_recognizers(fixture_dir=FIXTURE_DIR):
+    """Run every constructible recognizer backend over the WAV fixtures and compare latency and accuracy."""
+    try:
+        clips = _load_fixture_clips(fixture_dir)
+    except Exception as e:
+        print(f"No fixtures to benchmark: {e}")
+        return
+    print(f"{len(clips)} fixtures from {fixture_dir}")
+    for backend_name, cls in RECOGNIZER_BACKENDS.items():
         try:
-            self._tts_running = False
+            backend = cls(fixture_dir) if cls is FixtureRecognizerBackend else cls()
+        except Exception as e:
+            print(f"  {backend_name:<10} unavailable: {e}")
+            continue
+        correct = 0
+        for pcm, text in clips:
             try:
-                self.tts_queue.put_nowait(None)
+                heard = backend.recognize(sr.AudioData(pcm, RECOGNIZER_SAMPLE_RATE, 2))
             except Exception:
-                pass
-            if self.tts_thread.is_alive():
-                self.tts_thread.join(timeout=1)
+                heard = ""
+            correct += heard.lower().strip() == text.lower().strip()
+        st = backend.stats()
+        print(f"  {backend_name:<10} avg={st['avg_ms']:.1f}ms max={st['max_ms']:.1f}ms "
+              f"exact={correct}/{len(clips)} failures={st['failures']}")
+
+def benchmark_wake_gate(fixture_dir=FIXTURE_DIR, repeats=5):
+    """CPU per second of audio for the wake-word gate vs recognizing every utterance."""
+    try:
+        clips = _load_fixture_clips(fixture_dir)
+    except Exception as e:
+        print(f"No fixtures to benchmark: {e}")
+        return
+    rate = RECOGNIZER_SAMPLE_RATE
+    gate = WakeWordGate()
+    if not gate.enabled:
+        # no enrolled wake word: use the first fixture as a stand-in template to measure cost
+        pcm = np.frombuffer(clips[0][0], dtype=np.int16)
+        gate.templates.append((rate, log_mel_features(WakeWordGate._trim(pcm, rate), rate)))
+        gate.threshold = 0.25
+        print("No wake word enrolled; timing the gate with the first fixture as template.")
+    audio_seconds = sum(len(pcm) // 2 for pcm, _ in clips) / rate
+
+    cpu_start = time.process_time()
+    for _ in range(repeats):
+        for pcm, _ in clips:
+            gate.armed_until = 0.0
+            gate.check(sr.AudioData(pcm, rate, 2))
+    gate_cpu = (time.process_time() - cpu_start) / repeats
+    print(f"{len(clips)} fixtures, {audio_seconds:.1f} s of audio")
+    print(f"  wake gate       cpu={1000 * gate_cpu / audio_seconds:.2f} ms per audio second")
+
+    for backend_name, cls in RECOGNIZER_BACKENDS.items():
+        try:
+            backend = cls(fixture_dir) if cls is FixtureRecognizerBackend else cls()
         except Exception:
-            pass
+            continue
+        cpu_start = time.process_time()
+        wall_start = time.perf_counter()
+        for pcm, _ in clips:
+            try:
+                backend.recognize(sr.AudioData(pcm, rate, 2))
+            except Exception:
+                pass
+        cpu = time.process_time() - cpu_start
+        wall = time.perf_counter() - wall_start
+        print(f"  recognize all ({backend_name:<7}) cpu={1000 * cpu / audio_seconds:.2f} ms, "
+              f"wall={1000 * wall / audio_seconds:.1f} ms per audio second")
+
+def benchmark_synth(utterances=10, kinds=None):
+    """Per-utterance cost of a fresh synthesizer process (the old one-shot PowerShell way) vs a persistent one.
+
+    Utterances are rendered to a temporary WAV so nothing is played. The 'fake' host
+    shows the bare process overhead; the platform voice is timed if it can start.
+    """
+    kinds = kinds or ['fake', 'sapi' if platform.system().lower() == 'windows' else 'espeak']
+    text = "The current time is 11 47 PM"
+    fd, path = tempfile.mkstemp(prefix='loki_bench_', suffix='.wav')
+    os.close(fd)
+    print(f"{utterances} utterances of {len(text)} characters, rendered to a WAV file:")
+    print(f"  {'host':<8}{'one-shot ms':>14}{'persistent ms':>16}{'first start ms':>17}{'saved ms':>11}")
+    try:
+        for kind in kinds:
+            command = synth_host_command(kind)
+
+            def one_shot():
+                synth = PersistentSynthesizer(command, max_start_failures=1)
+                try:
+                    synth.speak(text, path=path)
+                finally:
+                    synth.close()
+
+            try:
+                fresh = _time_per_call(one_shot, utterances)
+            except Exception as e:
+                print(f"  {kind:<8} unavailable: {e or type(e).__name__}")
+                continue
+            synth = PersistentSynthesizer(command)
+            start = time.perf_counter()
+            synth.start()
+            startup = time.perf_counter() - start
+            persistent = _time_per_call(lambda: synth.speak(text, path=path), utterances)
+            synth.close()
+            print(f"  {kind:<8}{fresh * 1000:>14.1f}{persistent * 1000:>16.1f}{startup * 1000:>17.1f}"
+                  f"{(fresh - persistent) * 1000:>11.1f}")
+    finally:
+        os.remove(path)
+
+ROUTER_BENCH_COMMANDS = (
+    "hey loki what time is it", "open chrome", "loki open youtube", "search python asyncio tutorial",
+    "what is 12 plus 7", "calculate 9 times 8", "close spotify", "take a screenshot",
+    "skip ad", "play next song", "pause the music", "what's the weather like today",
+    "set listening to 8 seconds", "speak faster", "change speech rate to 180", "who are you",
+    "tell me a joke", "open the calculator", "thank you", "how can you help me",
+    "open google and search for news", "open whatsapp", "lokesh open vs code", "goodbye",
+    "i was just talking to someone else", "sometimes i think about it", "which one is better",
+    "open microsoft edge", "can you open camera", "do you know anything",
+    "tell me hello who are you", "can you sometimes open chrome", "what is the knowledge cutoff",
+)
+
+def _chain_route(command, question_words=QUESTION_WORDS[:-1], action_keywords=ACTION_KEYWORDS):
+    # the process_command if-chain the intent registry replaced, reduced to the intent it picked
+    if not command:
+        return None
+    original = command
+    command = command.lower().strip()
+    for w in ['loki', 'lokesh', 'low key', 'hey']:
+        if command.startswith(w):
+            command = command.replace(w, '', 1).strip()
+    command = re.sub(r'\s+', ' ', command)
+    words = set(command.split())
+    is_question = any(command.strip().startswith(q) for q in question_words) or '?' in original
+    math_patterns = [
+        r"^what\s+is\s+\d+[\s+\+\-\*/x]\s*\d+", r"^calculate\s+\d+[\s+\+\-\*/x]\s*\d+",
+        r"^solve\s+\d+[\s+\+\-\*/x]\s*\d+", r"^how\s+much\s+is\s+\d+[\s+\+\-\*/x]\s*\d+",
+    ]
+    if any(re.search(pattern, command) for pattern in math_patterns):
+        is_question = True
+    question_patterns = [
+        r"^can you", r"^could you", r"^tell me", r"^do you",
+        r"^how (do|can|would|could|should|is|are|to)", r"^what (is|are|should|can|do|does)",
+        r"^when (is|are|should|will)", r"^where (is|are|can)", r"^why (is|are|do|does)",
+        r"^which (is|are|one)", r"^would you", r"^will you", r"^show me", r"^let me know",
+    ]
+    if any(re.search(pattern, command) for pattern in question_patterns):
+        is_question = True
+    is_action = any(re.search(r'\b' + re.escape(k) + r'\b', command) for k in action_keywords)
+    if not (is_question or is_action):
+        return None
+    if ("listening" in command or "listen" in command) and any(w in words for w in ["set", "change", "make"]):
+        return 'listen_duration'
+    if any(w in command for w in ["speech rate", "speak faster", "speak slower", "change speech"]):
+        if re.search(r"(\d{2,3})", command) or 'faster' in command or 'slower' in command:
+            return 'speech_rate'
+    for w in ['loki', 'lokesh', 'low key']:
+        if command.startswith(w):
+            command = command.replace(w, '', 1).strip()
+    command = re.sub(r'\s+', ' ', command)
+    if not command:
+        return None
+    chain = (
+        ('hello', lambda: any(word in command for word in ["hello", "hi", "hey"])),
+        ('who_are_you', lambda: "who are you" in command),
+        ('time', lambda: any(t in command for t in ["time", "clock"])),
+        ('weather', lambda: any(w in command for w in ["weather", "temperature", "forecast"])),
+        ('screenshot', lambda: "screenshot" in command or "capture" in command or "screen shot" in command),
+        ('skip_ad', lambda: "skip ad" in command or "skip ads" in command or "skip the ad" in command),
+        ('next_track', lambda: "play next song" in command or "play next songs" in command
+            or "next song" in command or "play next" in command or "next track" in command),
+        ('play_music', lambda: "play music" in command or ("play" in command and "music" in command)),
+        ('pause', lambda: "pause" in command or ("stop" in command and "music" in command)),
+        ('close_app', lambda: "close" in command),
+        ('open_chrome', lambda: any(b in command for b in ["chrome", "browser", "chorme", "crome"])),
+        ('open_camera', lambda: "camera" in command),
+        ('open_whatsapp', lambda: "whatsapp" in command),
+        ('open_music', lambda: any(m in command for m in ["music", "songs", "song"])),
+        ('open_youtube', lambda: "youtube" in command),
+        ('open_edge', lambda: "edge" in command or "microsoft edge" in command),
+        ('open_spotify', lambda: "spotify" in command),
+        ('open_google', lambda: "google" in command and ("open" in command or "search" in command)),
+        ('open_vscode', lambda: any(k in command for k in ["code", "vs code", "visual studio code"])),
+        ('thank_you', lambda: "thank you" in command),
+        ('goodbye', lambda: any(word in command for word in ["goodbye", "bye", "quit", "exit"])),
+        ('joke', lambda: "joke" in command),
+        ('open_calculator', lambda: "calculator" in command),
+        ('search', lambda: "search" in command),
+        ('math', lambda: any(op in command for op in ['plus', 'minus', 'times', 'multiplied by', 'divided by',
+                                                      '+', '-', '*', '/', 'x'])
+            or (any(w in command for w in ['what', 'calculate', 'solve'])
+                and any(n.isdigit() for n in command.split()))),
+        ('question', lambda: is_question),
+    )
+    for intent, test in chain:
+        if test():
+            return intent
+    return None
+
+def benchmark_router(repeats=200):
+    """Commands/sec of the old process_command if-chain vs the IntentRegistry.
+
+    Routing only (no handler runs), with the registry's route cache off and then warm,
+    as it is for the same few commands said over and over. Commands the chain and the
+    registry route differently are listed: the
+    registry matches whole words, ranks intents by priority and strips every leading
+    wake word up front, where the chain stripped one before deciding to listen at all.
+    """
+    commands = ROUTER_BENCH_COMMANDS
+    start = time.perf_counter()
+    registry = IntentRegistry(cache_size=0).load(LokiAssistant)
+    registry.route(commands[0])
+    build = time.perf_counter() - start
+    cached = IntentRegistry().load(LokiAssistant)
+    print(f"{len(commands)} commands x {repeats}; registry loaded once in {build * 1000:.2f} ms "
+          f"({len(registry.intents)} intents)")
+    results = []
+    for label, route in (("if-chain (old)", _chain_route),
+                         ("IntentRegistry", lambda command: getattr(registry.route(command), 'intent', None)),
+                         ("cached", lambda command: getattr(cached.route(command), 'intent', None))):
+        secs = _time_per_call(lambda: [route(command) for command in commands], repeats)
+        results.append((label, secs))
+        print(f"  {label:<16}{len(commands) / secs:>12,.0f} commands/s{secs / len(commands) * 1e6:>10.1f} us/command")
+    for label, secs in results[1:]:
+        print(f"  {label} speed-up: {results[0][1] / secs:.1f}x")
+    st = cached.cache_stats()
+    print(f"  cache: hit_rate={st['hit_rate']:.1%} entries={st['entries']}")
+    for command in commands:
+        old = _chain_route(command)
+        new = getattr(registry.route(command), 'intent', None)
+        if old != new:
+            print(f"  differs: {command!r}: {old} -> {new}")
+
+# used when there is no TRANSCRIPT_CORPUS: commands as a recognizer tends to mishear them
+# (transcript, intent it should route to); "calculater" reads as calculate + r, so it's left alone
+SPELLING_BENCH_CASES = (
+    ("open chorme", 'open_chrome'), ("open crome", 'open_chrome'), ("opne youtube", 'open_youtube'),
+    ("clsoe spotify", 'close_app'), ("what tiem is it", 'time'), ("can you oepn whatsapp", 'open_whatsapp'),
+    ("serch python tutorials", 'search'), ("tell me a jokes", 'joke'), ("take a screenshoot", 'screenshot'),
+    ("wheather forecast please", None), ("open calculater", None), ("what is the temprature", 'weather'),
+    ("skip the add", None), ("play nxet song", 'open_music'), ("open spotfy", 'open_spotify'),
+    ("open googel and search news", 'search'), ("pasue the music", None), ("open youtub", 'open_youtube'),
+    ("open the camra", 'open_camera'), ("open chrome", 'open_chrome'), ("what time is it", 'time'),
+    ("search for cats", 'search'), ("how can you help me", 'question'), ("who are you", 'who_are_you'),
+    ("tell me something nice", 'question'), ("set a timer for five minutes", None),
+    ("search for cameras near me", 'search'), ("search for codes", 'search'), ("search for edges", 'search'),
+    ("search for closet ideas", 'search'), ("search for the second world war", 'search'),
+)
+
+def benchmark_spelling(corpus=TRANSCRIPT_CORPUS, repeats=20):
+    """Cost of correcting transcript words, and how many fallback replies it saves.
+
+    Reads one recognized transcript per line from `corpus` (or uses a built-in sample).
+    A fallback is a command ignored or answered with "please try rephrasing", which costs
+    another listen cycle.
+    """
+    try:
+        with open(corpus, encoding='utf-8') as f:
+            transcripts = [line.strip() for line in f if line.strip()]
+        source = corpus
+    except OSError:
+        transcripts = [text for text, _ in SPELLING_BENCH_CASES]
+        source = "built-in sample"
+    plain = IntentRegistry(cache_size=0, correct_spelling=False).load(LokiAssistant)
+    fuzzy = IntentRegistry(cache_size=0).load(LokiAssistant)
+    start = time.perf_counter()
+    fuzzy.route(transcripts[0])
+    build = time.perf_counter() - start
+    speller = fuzzy._speller
+    tokens = [token for text in transcripts for token in fuzzy.normalize(text).split()]
+    lookup = _time_per_call(lambda: [speller._lookup(token) for token in tokens], repeats) / len(tokens)
+    cached = _time_per_call(lambda: [speller.lookup(token) for token in tokens], repeats) / len(tokens)
+    print(f"{len(transcripts)} transcripts ({len(tokens)} words) from {source}")
+    print(f"  index: {len(speller.vocabulary)} words, {len(speller._index)} entries, "
+          f"built with the registry in {build * 1000:.2f} ms")
+    print(f"  lookup: {lookup * 1e6:.1f} us/word ({cached * 1e6:.2f} us/word memoized)")
+
+    def fallback(route):
+        return route is None or (route.intent == 'question' and not route.slots['help'])
+
+    before = after = 0
+    for text in transcripts:
+        old, new = plain.route(text), fuzzy.route(text)
+        before += fallback(old)
+        after += fallback(new)
+        if getattr(old, 'intent', None) != getattr(new, 'intent', None):
+            print(f"  {text!r}: {getattr(old, 'intent', None)} -> {getattr(new, 'intent', None)} "
+                  f"({new.command if new else ''})")
+    print(f"  fallback re-prompts: {before} -> {after} ({before - after} saved)")
+
+# (spoken question, expected answer or None)
+MATH_BENCH_CASES = (
+    ("what is 12 plus 7", 19), ("calculate 9 x 8", 72), ("what is 100 divided by 4", 25),
+    ("what is six times seven", 42), ("twelve hundred divided by three plus four", 404),
+    ("open bracket two plus three close bracket times four", 20), ("2 to the power of 10", 1024),
+    ("what is 20 percent of 50", 10), ("1 plus 2 plus 3 plus 4", 10), ("what's 3.5 plus 2.25", 5.75),
+    ("negative four times three", -12), ("five squared minus three cubed", -2),
+    ("what is next plus 2", None), ("10 divided by 0", None), ("what is covid-19", None),
+    ("how much is a 4 x 4 truck", None), ("what is mp3 x 2", None), ("search for spider-man 2", None),
+    ("what is twenty-five plus 5", 30), ("3 point 0 5 plus 1", 4.05), ("what is 3 point 0 5 times 2", 6.1),
+    ("two point five million plus 1", 2500001),
+)
+
+def _replace_chain_solve(expression):
+    # solve_math before the spoken-arithmetic parser: two numbers, one operator
+    expr = expression.lower()
+    expr = expr.replace('what is', '').replace('calculate', '').replace('solve', '')
+    expr = expr.replace("what's", '').replace('whats', '').replace('equals', '')
+    expr = expr.replace('equal to', '').replace('answer', '').strip()
+    expr = expr.replace('plus', '+').replace('minus', '-').replace('x', '*')
+    expr = expr.replace('times', '*').replace('multiplied by', '*').replace('divided by', '/')
+    numbers = list(map(float, re.findall(r'-?\d+(?:\.\d+)?', expr)))
+    if len(numbers) != 2:
+        return None
+    op_match = re.search(r'[\+\-\*/x]', expr)
+    if not op_match:
+        return None
+    operators = {
+        '+': lambda x, y: x + y,
+        '-': lambda x, y: x - y,
+        '*': lambda x, y: x * y,
+        '/': lambda x, y: x / y if y != 0 else None
+    }
+    result = operators[op_match.group()](*numbers)
+    if result is not None and float(result).is_integer():
+        return int(result)
+    return result
+
+def benchmark_math(repeats=500):
+    """Per-question cost and answers of the old replace-chain solve_math vs the spoken-arithmetic parser."""
+    cases = MATH_BENCH_CASES
+    questions = [text for text, _ in cases]
+
+    def uncached(text):
+        try:
+            result = evaluate_arithmetic(parse_arithmetic.__wrapped__(text))
+        except (ValueError, ArithmeticError):
+            return None
+        return int(result) if float(result).is_integer() else round(result, 6)
+
+    print(f"{len(cases)} questions x {repeats}:")
+    print(f"  {'solver':<26}{'us/question':>13}{'right':>8}")
+    for label, solve in (("replace chain (old)", _replace_chain_solve),
+                         ("parser, cold", uncached),
+                         ("parser, cached AST", solve_arithmetic)):
+        secs = _time_per_call(lambda: [solve(text) for text in questions], repeats) / len(questions)
+        right = sum(1 for text, expected in cases if solve(text) == expected)
+        print(f"  {label:<26}{secs * 1e6:>13.2f}{right:>5}/{len(cases)}")
+    for text, expected in cases:
+        old, new = _replace_chain_solve(text), solve_arithmetic(text)
+        if old != new:
+            print(f"  {text!r}: {old} -> {new}")
+
+# (spoken question, expected value or None)
+UNIT_BENCH_CASES = (
+    ("how many feet in 3.5 kilometers", 11482.939632), ("convert 100 fahrenheit to celsius", 37.777778),
+    ("what is 20 degrees celsius in fahrenheit", 68), ("minus forty celsius to fahrenheit", -40),
+    ("convert 300 kelvin to celsius", 26.85), ("how many feet in a mile", 5280),
+    ("how many ounces in two pounds", 32), ("how many seconds in a day", 86400),
+    ("how many cups in a gallon", 16), ("how many teaspoons in a tablespoon", 3),
+    ("what is 60 mph in kilometers per hour", 96.56064), ("how many meters in 100 yards", 91.44),
+    ("how many acres in one hectare", 2.471054), ("convert 1.5 gigabytes to megabytes", 1500),
+    ("how many inches in 1 m", 39.370079), ("one hundred and five feet in meters", 32.004),
+    ("how many cm in 5 inches", 12.7), ("convert 5 kilograms to miles", None),
+    ("what time is it in 5 minutes", None),
+)
+
+def benchmark_units(repeats=500):
+    """Graph load time, per-question conversion cost and answers for UNIT_BENCH_CASES."""
+    start = time.perf_counter()
+    graph = UnitGraph()
+    print(f"unit graph: {len(graph.plurals)} units, {len(set(graph.dimension.values()))} dimensions, "
+          f"loaded in {(time.perf_counter() - start) * 1e3:.2f} ms")
+    cases = UNIT_BENCH_CASES
+
+    def solve(parse, text):
+        query = parse(text)
+        if query is None:
+            return None
+        try:
+            return graph.convert(*query)
+        except ValueError:
+            return None
+
+    def cold(text):
+        graph.transform.cache_clear()
+        return solve(graph._parse, text)
+
+    print(f"{len(cases)} questions x {repeats}:")
+    print(f"  {'conversion':<26}{'us/question':>13}{'right':>8}")
+    for label, convert in (("parse + path, cold", cold),
+                           ("cached parse + path", lambda text: solve(graph.parse, text))):
+        secs = _time_per_call(lambda: [convert(text) for text, _ in cases], repeats) / len(cases)
+        right = sum(1 for text, expected in cases
+                    if (expected is None and convert(text) is None)
+                    or (expected is not None and convert(text) is not None
+                        and math.isclose(convert(text), expected, rel_tol=1e-6, abs_tol=1e-6)))
+        print(f"  {label:<26}{secs * 1e6:>13.2f}{right:>5}/{len(cases)}")
+    for text, expected in cases:
+        query = graph.parse(text)
+        print(f"  {text!r}: {graph.answer(*query) if query else None}")
+
+BENCHMARKS = {
+    'capture': benchmark_capture,
+    'recognizers': benchmark_recognizers,
+    'wake-gate': benchmark_wake_gate,
+    'synth': benchmark_synth,
+    'router': benchmark_router,
+    'spelling': benchmark_spelling,
+    'math': benchmark_math,
+    'units': benchmark_units,
+}
+
+def enroll_wake_word(count=3, template_dir=WAKE_WORD_DIR):
+    """Record `count` examples of the wake word for the WakeWordGate."""
+    os.makedirs(template_dir, exist_ok=True)
+    assistant = LokiAssistant()
+    saved = 0
+    try:
+        for _ in range(count * 3):
+            if saved >= count:
+                break
+            print(f"{Fore.CYAN}Say the wake word ({saved + 1}/{count})...{Style.RESET_ALL}")
+            audio = assistant.capture_utterance(timeout=10)
+            if audio is None:
+                print(f"{Fore.YELLOW}Didn't hear anything, try again.{Style.RESET_ALL}")
+                continue
+            path = os.path.join(template_dir, f"wake_{int(time.time() * 1000)}.wav")
+            assistant.save_audio(audio, path)
+            saved += 1
+        print(f"{Fore.GREEN}Saved {saved} wake word recordings to {template_dir}{Style.RESET_ALL}")
+    finally:
+        assistant.shutdown()
+
+# ---------- Replay harness ----------
+class RecordingStandIn:
+    """Stands in for a module with side effects (pyautogui, webbrowser, subprocess...).
+
+    Every call is logged as (perf_counter, "module.function", args) and answered from
+    `results` (a value, or a callable producing one), else None. Constants such as
+    subprocess.PIPE come from the real module when it is given. With `only`, just those
+    functions are recorded and the rest of the real module is used as is.
+    """
+
+    def __init__(self, name, log, real=None, results=None, only=None):
+        self._name = name
+        self._log = log
+        self._real = real
+        self._results = results or {}
+        self._only = only
+
+    def __getattr__(self, attr):
+        value = getattr(self._real, attr, None)
+        if value is not None and (not callable(value) or (self._only is not None and attr not in self._only)):
+            return value
+
+        def record(*args, **kwargs):
+            self._log.append((time.perf_counter(), f"{self._name}.{attr}", repr(args)[:120]))
+            result = self._results.get(attr)
+            return result() if callable(result) else result
+        return record
+
+@contextlib.contextmanager
+def _stand_ins(stand_ins):
+    """Put `stand_ins` in place of the modules of the same names, here and in loki_core.
+
+    The real modules are back when the block is left, however it is left.
+    """
+    here, core = globals(), vars(loki_core)
+    saved = [(here, name, here[name]) for name in stand_ins]
+    saved += [(core, name, core[name]) for name in stand_ins if name in core]
+    try:
+        for namespace, name, _ in saved:
+            namespace[name] = stand_ins[name]
+        yield
+    finally:
+        for namespace, name, module in saved:
+            namespace[name] = module
+
+def _desktop_stand_ins(log, running=()):
+    """Recording stand-ins for everything a command handler can touch outside the process.
+
+    pyttsx3, pyautogui, webbrowser, subprocess, pygetwindow, psutil and os.system,
+    os.startfile and os.makedirs log to `log` instead of acting; psutil lists the
+    process names in `running` as the only processes.
+    """
+    return {
+        'pyttsx3': RecordingStandIn('pyttsx3', log, results={'init': lambda: ReplayTTSEngine(log)}),
+        'pyautogui': RecordingStandIn('pyautogui', log, results={
+            'screenshot': _ReplayImage, 'size': (1920, 1080), 'position': (0, 0)}),
+        'webbrowser': RecordingStandIn('webbrowser', log, results={'open': True, 'open_new_tab': True}),
+        'subprocess': RecordingStandIn('subprocess', log, subprocess, results={
+            'Popen': _ReplayProcess, 'run': _ReplayProcess, 'call': 0, 'check_output': ''}),
+        'gw': RecordingStandIn('pygetwindow', log, results={
+            'getWindowsWithTitle': list, 'getAllWindows': list, 'getAllTitles': list}),
+        'psutil': RecordingStandIn('psutil', log, results={
+            'process_iter': lambda: [_DryRunProcess(name, pid) for pid, name in enumerate(running, 1)],
+            'Process': lambda: RecordingStandIn('psutil.Process', log)}),
+        'os': RecordingStandIn('os', log, os, results={'system': 0}, only={'system', 'startfile', 'makedirs'}),
+    }
+
+class _ReplayProcess:
+    returncode = 0
+    stdout = ''
+    stderr = ''
+    pid = 0
+
+    def wait(self, *args, **kwargs):
+        return 0
+
+    def poll(self):
+        return 0
+
+    def communicate(self, *args, **kwargs):
+        return '', ''
+
+    def kill(self):
+        pass
+
+    terminate = kill
+
+class _DryRunProcess:
+    """An entry of psutil.process_iter() for a process the dry run pretends is running."""
+
+    def __init__(self, name, pid):
+        self.info = {'name': name, 'pid': pid}
+
+class _ReplayImage:
+    def save(self, *args, **kwargs):
+        pass
+
+class _ReplayVoice:
+    id = 'replay'
+    name = 'Replay voice'
+
+class ReplayTTSEngine:
+    """pyttsx3 stand-in that renders `ms_per_char` of tone per character instead of a voice."""
+
+    def __init__(self, log, sample_rate=RECOGNIZER_SAMPLE_RATE, ms_per_char=60):
+        self.log = log
+        self.sample_rate = sample_rate
+        self.ms_per_char = ms_per_char
+        self.properties = {'rate': 150, 'volume': 1.0, 'voices': [_ReplayVoice()], 'voice': 'replay'}
+        self._pending = []
+
+    def getProperty(self, name):
+        return self.properties.get(name)
+
+    def setProperty(self, name, value):
+        self.properties[name] = value
+
+    def say(self, text):
+        self._pending.append((text, None))
+
+    def save_to_file(self, text, path):
+        self._pending.append((text, path))
+
+    def runAndWait(self):
+        for text, path in self._pending:
+            self.log.append((time.perf_counter(), 'pyttsx3.say' if path is None else 'pyttsx3.save_to_file',
+                             repr(text)[:120]))
+            if path is None:
+                continue
+            n = int(self.sample_rate * self.ms_per_char * len(text) / 1000)
+            t = np.arange(n) / self.sample_rate
+            pcm = (3000 * np.sin(2 * np.pi * 220 * t)).astype(np.int16)
+            with wave.open(path, 'wb') as wf:
+                wf.setnchannels(1)
+                wf.setsampwidth(2)
+                wf.setframerate(self.sample_rate)
+                wf.writeframes(pcm.tobytes())
+        self._pending = []
+
+class ReplayAudio:
+    """sounddevice stand-in: the microphone plays queued clips, the speaker only keeps time.
+
+    Both streams run on their own threads at `speed` times real time. The moment the
+    first sample of each clip reaches the capture callback and the moment each output
+    stream asks for its first block are recorded for the latency report.
+    """
+
+    CallbackStop = type('CallbackStop', (Exception,), {})
+
+    def __init__(self, speed=1.0):
+        self.speed = speed
+        self.clips = queue.Queue()
+        self.clip_starts = []     # (perf_counter, clip name)
+        self.output_starts = []   # perf_counter of each playback's first block
+        audio = self
+
+        class InputStream:
+            def __init__(self, samplerate, channels=1, dtype='int16', blocksize=1024, callback=None,
+                         device=None, **kwargs):
+                self.samplerate = samplerate
+                self.blocksize = blocksize
+                self.callback = callback
+                self.latency = 0.0
+                self._stop = threading.Event()
+
+            def start(self):
+                threading.Thread(target=audio._capture_loop, args=(self,), daemon=True).start()
+
+            def stop(self):
+                self._stop.set()
+
+            def close(self):
+                self._stop.set()
+
+        class OutputStream:
+            def __init__(self, samplerate, channels=1, dtype='int16', callback=None, finished_callback=None,
+                         blocksize=512, **kwargs):
+                self.samplerate = samplerate
+                self.blocksize = blocksize
+                self.callback = callback
+                self.finished_callback = finished_callback
+                self.latency = 0.0
+
+            def start(self):
+                threading.Thread(target=audio._playback_loop, args=(self,), daemon=True).start()
+
+            def close(self):
+                pass
+
+        self.InputStream = InputStream
+        self.OutputStream = OutputStream
+
+    def check_input_settings(self, **kwargs):
+        pass
+
+    def query_devices(self, device=None, kind=None):
+        return {'name': 'replay', 'default_samplerate': float(RECOGNIZER_SAMPLE_RATE)}
+
+    def play_clip(self, name, pcm):
+        """Queue 16 kHz int16 PCM to be 'spoken' into the microphone next."""
+        self.clips.put((name, pcm))
+
+    def _capture_loop(self, stream):
+        step = stream.blocksize
+        interval = step / stream.samplerate / self.speed
+        clip, name, pos = None, None, 0
+        next_time = time.perf_counter()
+        while not stream._stop.is_set():
+            block = np.zeros((step, 1), dtype=np.int16)
+            if clip is None:
+                try:
+                    name, clip = self.clips.get_nowait()
+                    pos = 0
+                    self.clip_starts.append((time.perf_counter(), name))
+                except queue.Empty:
+                    pass
+            if clip is not None:
+                chunk = clip[pos:pos + step]
+                block[:len(chunk), 0] = chunk
+                pos += len(chunk)
+            stream.callback(block, step, None, None)
+            if clip is not None and pos >= len(clip):
+                clip = None
+            next_time += interval
+            time.sleep(max(0.0, next_time - time.perf_counter()))
+
+    def _playback_loop(self, stream):
+        step = stream.blocksize
+        interval = step / stream.samplerate / self.speed
+        first = True
+        while True:
+            block = np.zeros((step, 1), dtype=np.int16)
+            try:
+                stream.callback(block, step, None, None)
+            except self.CallbackStop:
+                break
+            finally:
+                if first:
+                    self.output_starts.append(time.perf_counter())
+                    first = False
+            time.sleep(interval)
+        if stream.finished_callback:
+            stream.finished_callback()
+
+def _percentiles(seconds):
+    if not seconds:
+        return {'n': 0}
+    ms = np.asarray(seconds) * 1000.0
+    return {
+        'n': int(ms.size),
+        'p50': round(float(np.percentile(ms, 50)), 2),
+        'p90': round(float(np.percentile(ms, 90)), 2),
+        'p99': round(float(np.percentile(ms, 99)), 2),
+        'max': round(float(ms.max()), 2),
+    }
+
+def _speech_end(pcm, sample_rate):
+    """Seconds into `pcm` at which its last non-silent 10 ms frame ends."""
+    frame = max(1, sample_rate // 100)
+    n = len(pcm) // frame
+    if n == 0:
+        return 0.0
+    x = pcm[:n * frame].astype(np.float32).reshape(n, frame) / 32768.0
+    energy = np.sqrt(np.mean(x * x, axis=1))
+    active = np.flatnonzero(energy > max(energy.max() * 0.1, 1e-4))
+    return (active[-1] + 1) * frame / sample_rate if active.size else 0.0
+
+def replay_fixtures(fixture_dir=FIXTURE_DIR, speed=1.0, gap=0.5, timeout=15.0, recognizer=None):
+    """Speak every WAV fixture into a real LokiAssistant pipeline and time each hop.
+
+    sounddevice and everything a handler can touch (see _desktop_stand_ins) are swapped
+    for recording stand-ins, so nothing reaches the desktop or the disk and runs are
+    repeatable.
+    Each fixture is played once the previous one has been answered. Returns a report
+    with a record per utterance (times in ms after the speech in the fixture ends) and
+    latency percentiles per stage. Times are wall clock, so only speed=1.0 gives the
+    latency a user would see.
+    """
+    reference = FixtureRecognizerBackend(fixture_dir)
+    clips = [(name, np.frombuffer(pcm, dtype=np.int16), text)
+             for (name, _, _, _), (pcm, text) in zip(reference.fixtures, _load_fixture_clips(fixture_dir))]
+    speech_ends = {name: _speech_end(pcm, RECOGNIZER_SAMPLE_RATE) / speed for name, pcm, _ in clips}
+    if not clips:
+        raise RuntimeError(f"No transcribed WAV fixtures in {fixture_dir}")
+
+    log = []
+    audio = ReplayAudio(speed)
+    stand_ins = dict(_desktop_stand_ins(log), sd=audio)
+    records = []
+    with _stand_ins(stand_ins):
+        # 'fixture' means the fixtures being replayed, not the default fixture directory
+        backend = reference if recognizer in (None, 'fixture') else recognizer
+        assistant = LokiAssistant(recognizer_backend=backend)
+        assistant.print_responses = False
+        assistant.speech_cache = SpeechCache(cache_dir=None)
+        _instrument_for_replay(assistant, audio, speech_ends, records)
+        assistant._ensure_capture()
+        assistant.start_pipeline()
+        try:
+            for name, pcm, text in clips:
+                if assistant._stop_event.is_set():
+                    break
+                expected = len(records) + 1
+                audio.play_clip(name, pcm)
+                deadline = time.perf_counter() + len(pcm) / RECOGNIZER_SAMPLE_RATE / speed + timeout
+                while time.perf_counter() < deadline and not assistant._stop_event.is_set():
+                    if len(records) >= expected and 'dispatched' in records[expected - 1] and \
+                            assistant.tts_queue.unfinished_tasks == 0 and not assistant.is_speaking:
+                        break
+                    time.sleep(0.01)
+                time.sleep(gap / speed)
+        finally:
+            assistant.stop_pipeline()
+            stats = assistant.pipeline_stats()
+            cache_stats = assistant.speech_cache.stats()
+            assistant.shutdown()
+
+    expected_text = {name: text for name, _, text in clips}
+    utterances = []
+    hops = {'endpoint': [], 'recognize': [], 'queue_wait': [], 'dispatch': [],
+            'first_response': [], 'first_audio': []}
+    for rec in records:
+        t0 = rec.get('spoken_end') or rec['captured']
+        row = {'fixture': rec.get('fixture'), 'expected': expected_text.get(rec.get('fixture')),
+               'heard': rec.get('heard'), 'responses': rec['responses'],
+               'actions': [call for t, call, _ in log
+                           if rec.get('dispatch_start', 0) <= t <= rec.get('dispatched', 0)
+                           and not call.startswith('pyttsx3')]}
+        for key in ('captured', 'recognized', 'dispatch_start', 'dispatched', 'first_speak', 'first_audio'):
+            if key in rec:
+                row[f'{key}_ms'] = round(1000.0 * (rec[key] - t0), 2)
+        utterances.append(row)
+        if 'recognized' in rec:
+            hops['endpoint'].append(rec['captured'] - t0)
+            hops['recognize'].append(rec['recognized'] - rec['captured'])
+        if 'dispatched' in rec:
+            hops['queue_wait'].append(rec['dispatch_start'] - rec['recognized'])
+            hops['dispatch'].append(rec['dispatched'] - rec['dispatch_start'])
+        if 'first_speak' in rec:
+            hops['first_response'].append(rec['first_speak'] - t0)
+        if 'first_audio' in rec:
+            hops['first_audio'].append(rec['first_audio'] - t0)
+    heard = {row['fixture'] for row in utterances}
+    return {
+        'fixtures': len(clips),
+        'speed': speed,
+        'missed': [name for name, _, _ in clips if name not in heard],
+        'correct': sum(1 for row in utterances if row['heard'] and row['heard'] == (row['expected'] or '').lower()),
+        'stages': {name: _percentiles(values) for name, values in hops.items()},
+        'pipeline': stats,
+        'tts_cache': cache_stats,
+        'utterances': utterances,
+    }
+
+def _instrument_for_replay(assistant, audio, speech_ends, records):
+    """Wrap the pipeline hooks of `assistant` to timestamp each utterance as it moves through."""
+    to_dispatch = collections.deque()
+    to_play = collections.deque()
+    by_audio = {}
+    # the utterance being dispatched, and on action threads the one the action is for
+    current = threading.local()
+    listen_for_utterance = assistant.listen_for_utterance
+    recognize_stage = assistant._recognize_stage
+    dispatch_stage = assistant._dispatch_stage
+    submit = assistant.actions.submit
+    speak = assistant.speak
+    speak_rendered = assistant._speak_rendered
+
+    def timed_listen():
+        captured = listen_for_utterance()
+        if captured is not None:
+            rec = {'captured': time.perf_counter(), 'responses': []}
+            if audio.clip_starts:
+                started, rec['fixture'] = audio.clip_starts[-1]
+                rec['spoken_end'] = started + speech_ends.get(rec['fixture'], 0.0)
+            records.append(rec)
+            by_audio[id(captured)] = rec
+        return captured
+
+    def timed_recognize(captured):
+        rec = by_audio.pop(id(captured), None)
+        command = recognize_stage(captured)
+        if rec is not None:
+            rec['recognized'] = time.perf_counter()
+            rec['heard'] = command
+            if command:
+                to_dispatch.append(rec)
+        return command
+
+    def timed_dispatch(command):
+        rec = to_dispatch.popleft() if to_dispatch else None
+        if rec is not None:
+            rec['dispatch_start'] = time.perf_counter()
+        current.rec = rec
+        try:
+            return dispatch_stage(command)
+        finally:
+            current.rec = None
+            # with an action submitted, the utterance is dispatched once the action is done
+            if rec is not None and not rec.get('action'):
+                rec['dispatched'] = time.perf_counter()
+
+    def timed_submit(name, work, resource=None, timeout=None):
+        rec = getattr(current, 'rec', None)
+
+        def traced():
+            current.rec = rec
+            try:
+                return work()
+            finally:
+                current.rec = None
+                if rec is not None:
+                    rec['dispatched'] = time.perf_counter()
+
+        if rec is not None:
+            rec['action'] = name
+        return submit(name, traced, resource, timeout)
+
+    def timed_speak(text, category=None):
+        rec = getattr(current, 'rec', None)
+        if rec is not None and text:
+            rec.setdefault('first_speak', time.perf_counter())
+            rec['responses'].append(text)
+        if text:
+            to_play.append(rec)
+        return speak(text, category)
+
+    def timed_speak_rendered(text):
+        rec = to_play.popleft() if to_play else None
+        started = len(audio.output_starts)
+        rendered = speak_rendered(text)
+        if rec is not None and len(audio.output_starts) > started:
+            rec.setdefault('first_audio', audio.output_starts[started])
+        return rendered
+
+    assistant.listen_for_utterance = timed_listen
+    assistant._recognize_stage = timed_recognize
+    assistant._dispatch_stage = timed_dispatch
+    assistant.actions.submit = timed_submit
+    assistant.speak = timed_speak
+    assistant._speak_rendered = timed_speak_rendered
+
+# ---------- Dry-run batch ----------
+def dry_run_commands(lines, out, line_seconds=DRY_RUN_LINE_SECONDS):
+    """Route and dispatch text commands with every side effect recorded instead of performed.
+
+    Each non-empty line of `lines` goes through the intent registry and its handler as
+    process_command would, one at a time and as it arrives. webbrowser, subprocess,
+    pyautogui, pygetwindow, psutil, os.system/startfile, time.sleep and speech are
+    recording stand-ins; every process close_app knows of appears to be running. Lines
+    go through process_command's duplicate check as if said `line_seconds` apart, so a
+    repeat that it would drop is marked "duplicate" and not dispatched, the same on
+    every run. One JSON object per command is written to `out` and anything the
+    handlers print goes to stderr. Returns a summary with commands/sec and latency
+    percentiles.
+    """
+    log = []
+    running = sorted({name for _, names in CLOSE_TARGETS for name in names})
+    stand_ins = dict(_desktop_stand_ins(log, running), time=RecordingStandIn('time', log, time, only={'sleep'}))
+    latencies = []
+    intents = collections.Counter()
+    with _stand_ins(stand_ins), contextlib.redirect_stdout(sys.stderr):
+        assistant = LokiAssistant()
+        try:
+            assistant.print_responses = False
+            responses = []
+
+            def record_speak(text, category=None):
+                if text:
+                    responses.append(text)
+
+            assistant.speak = record_speak
+            start = time.perf_counter()
+            for number, line in enumerate(lines, 1):
+                text = line.strip()
+                if not text:
+                    continue
+                del log[:], responses[:]
+                began = time.perf_counter()
+                route = assistant.intents.route(text)
+                duplicate = route is not None and assistant._is_duplicate(
+                    route, assistant.intents.spec(route.intent), now=number * line_seconds)
+                keep_going = assistant.intents.dispatch(route) if route is not None and not duplicate else True
+                elapsed = time.perf_counter() - began
+                latencies.append(elapsed)
+                intents[route.intent if route else None] += 1
+                out.write(json.dumps({
+                    'line': number,
+                    'text': text,
+                    'command': route.command if route else assistant.intents.normalize(text),
+                    'intent': route.intent if route else None,
+                    'slots': route.slots if route else {},
+                    'duplicate': duplicate,
+                    'responses': list(responses),
+                    'actions': [call + args for _, call, args in log if not call.startswith('pyttsx3')],
+                    'continue': bool(keep_going),
+                    'ms': round(elapsed * 1000.0, 3),
+                }) + "\n")
+                out.flush()
+            elapsed = time.perf_counter() - start
+        finally:
+            assistant.shutdown()
+    return {
+        'commands': len(latencies),
+        'seconds': round(elapsed, 3),
+        'commands_per_sec': round(len(latencies) / elapsed, 1) if elapsed > 0 else 0.0,
+        'latency_ms': _percentiles(latencies),
+        'intents': {str(name): count for name, count in intents.most_common()},
+        'duplicates': sum(assistant.duplicates_suppressed.values()),
+    }
+
+# ---------- Startup profile ----------
+def profile_startup(timeout=15.0):
+    """Start the assistant as run() does and report where the time to the greeting goes."""
+    launched = time.perf_counter()
+    assistant = LokiAssistant()
+    constructed = time.perf_counter()
+    assistant.print_responses = False
+    try:
+        engine = assistant.start()
+        assistant.start_pipeline()
+        deadline = time.perf_counter() + timeout
+        while assistant.player.first_audio_at is None and time.perf_counter() < deadline:
+            if engine.done() and assistant.tts_queue.unfinished_tasks == 0:
+                break  # spoken without the player (no audio device)
+            time.sleep(0.005)
+        engine.result(timeout=max(0.0, deadline - time.perf_counter()))
+    finally:
+        assistant.stop_speaking()
+        assistant.shutdown()
+
+    def line(label, seconds, note=""):
+        value = "-" if seconds is None else f"{1000.0 * seconds:8.1f}ms"
+        print(f"{Fore.BLUE}{label:<32}{value:>12}{note}{Style.RESET_ALL}")
+
+    line("[startup] module load", launched - LOAD_STARTED, "  (eager imports and definitions)")
+    line("[startup] LokiAssistant()", constructed - launched)
+    line("[startup] capture open", assistant.capture_init_time, "  (alongside the tts engine)")
+    line("[startup] tts engine", assistant.engine_init_time)
+    first_audio = assistant.player.first_audio_at
+    line("[startup] greeting first audio", None if first_audio is None else first_audio - LOAD_STARTED,
+         "  after module load began")
+    for name, seconds in sorted(IMPORT_TIMES.items(), key=lambda item: -item[1]):
+        line(f"[import] {name}", seconds)
 
 # ---------- Main ----------
 def main():
+    parser = argparse.ArgumentParser(description="Loki voice assistant")
+    parser.add_argument('--benchmark', choices=sorted(BENCHMARKS), help="run a micro-benchmark and exit")
+    parser.add_argument('--recognizer', choices=sorted(RECOGNIZER_BACKENDS),
+                        help=f"speech recognition backend (default: {RECOGNIZER_BACKEND}; fixture for --replay)")
+    parser.add_argument('--enroll-wake-word', type=int, metavar='N', help="record N wake word examples and exit")
+    parser.add_argument('--replay', nargs='?', const=FIXTURE_DIR, metavar='DIR',
+                        help="replay WAV fixtures through the pipeline with stand-ins and print latency JSON")
+    parser.add_argument('--replay-speed', type=float, default=1.0, help="replay at this multiple of real time")
+    parser.add_argument('--replay-output', metavar='FILE', help="write the replay report here instead of stdout")
+    parser.add_argument('--batch', metavar='FILE',
+                        help="dry-run text commands from FILE ('-' for stdin), one per line, and print JSONL")
+    parser.add_argument('--profile-startup', action='store_true',
+                        help="time imports, engine init and capture setup up to the greeting and exit")
+    args = parser.parse_args()
+    if args.profile_startup:
+        profile_startup()
+        return
+    if args.replay:
+        report = json.dumps(replay_fixtures(args.replay, speed=args.replay_speed, recognizer=args.recognizer),
+                            indent=2)
+        if args.replay_output:
+            with open(args.replay_output, 'w', encoding='utf-8') as f:
+                f.write(report + "\n")
+        else:
+            print(report)
+        return
+    if args.batch:
+        if args.batch == '-':
+            summary = dry_run_commands(sys.stdin, sys.stdout)
+        else:
+            with open(args.batch, encoding='utf-8') as f:
+                summary = dry_run_commands(f, sys.stdout)
+        latency = summary['latency_ms']
+        print(f"{Fore.BLUE}[batch] commands={summary['commands']} duplicates={summary['duplicates']} "
+              f"{summary['commands_per_sec']:,.0f} commands/s "
+              f"latency p50={latency.get('p50', 0)}ms p90={latency.get('p90', 0)}ms "
+              f"p99={latency.get('p99', 0)}ms max={latency.get('max', 0)}ms{Style.RESET_ALL}", file=sys.stderr)
+        return
+    if args.benchmark:
+        BENCHMARKS[args.benchmark]()
+        return
+    if args.enroll_wake_word:
+        enroll_wake_word(args.enroll_wake_word)
+        return
+
     overlay_queue = queue.Queue() if ENABLE_GUI else None
     overlay = None
     if ENABLE_GUI:
         overlay = OverlayGUI(GIF_PATH, queue_in=overlay_queue, size=120)
         overlay.start()
-    assistant = LokiAssistant(overlay_queue=overlay_queue)
+    assistant = LokiAssistant(overlay_queue=overlay_queue, recognizer_backend=args.recognizer)
 
     try:
         assistant.run()
@@ -0,0 +1,1722 @@
+# -*- coding: utf-8 -*-
+"""
+Loki Assistant — audio, speech and arithmetic pieces shared by loki_assistant.py
+and loki_assistant2.py.
+
+Microphone capture and endpointing, the recognizer backends, the wake-word gate, the
+persistent synthesizer and speech cache, echo gating and playback, the pipeline stage
+and the spoken arithmetic parser live here once; both scripts import them.
+"""
+
+import os
+import sys
+import threading
+import asyncio
+import time
+import queue
+import subprocess
+import re
+import platform
+import math
+import json
+import functools
+import collections
+import hashlib
+import importlib
+import importlib.util
+
+# ---------- Lazy imports ----------
+# seconds spent importing each lazily loaded module, in the order they were first used
+IMPORT_TIMES = {}
+
+class LazyModule:
+    """Stands in for a feature module until it is first used, then imports it.
+
+    Once loaded the module replaces the stand-in under `alias` in `namespace`, so later
+    lookups cost nothing. Truth-testing imports it and tells whether that worked, which
+    keeps optional-dependency checks as `if cv2:`.
+    """
+
+    def __init__(self, name, alias, namespace):
+        self._name = name
+        self._alias = alias
+        self._namespace = namespace
+        self._module = None
+        self._error = None
+
+    def _load(self):
+        if self._module is None:
+            if self._error is not None:
+                raise self._error
+            start = time.perf_counter()
+            try:
+                self._module = importlib.import_module(self._name)
+            except Exception as e:
+                # not just ImportError: pyautogui needs a display, pygetwindow an OS it supports
+                self._error = ImportError(f"{self._name} is unavailable: {e}")
+                raise self._error from e
+            finally:
+                # both scripts and this module declare some of the same stand-ins
+                IMPORT_TIMES.setdefault(self._name, time.perf_counter() - start)
+            if self._namespace.get(self._alias) is self:
+                self._namespace[self._alias] = self._module
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __bool__(self):
+        try:
+            self._load()
+        except ImportError:
+            return False
+        return True
+
+    def __repr__(self):
+        return f"<lazy module {self._name!r}>"
+
+def _importable(name):
+    """True if `name` could be imported, without importing it."""
+    try:
+        return importlib.util.find_spec(name) is not None
+    except (ImportError, ValueError):
+        return False
+
+# audio and recognition libraries, loaded on first use
+sr = LazyModule('speech_recognition', 'sr', globals())
+sd = LazyModule('sounddevice', 'sd', globals())
+np = LazyModule('numpy', 'np', globals())
+import wave
+
+# optional offline speech recognition
+vosk = LazyModule('vosk', 'vosk', globals())
+
+# ---------- Config ----------
+# Audio capture: recognizers work at 16 kHz; devices are tried from the lowest rate up
+RECOGNIZER_SAMPLE_RATE = 16000
+CAPTURE_RATES = (16000, 22050, 32000, 44100, 48000)
+
+# Speech recognition backend: 'google' (online), 'vosk' (offline) or 'fixture' (deterministic stand-in)
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+RECOGNIZER_BACKEND = os.environ.get("LOKI_RECOGNIZER", "google")
+VOSK_MODEL_PATH = os.environ.get("LOKI_VOSK_MODEL", os.path.join(SCRIPT_DIR, "vosk-model"))
+FIXTURE_DIR = os.environ.get("LOKI_FIXTURES", os.path.join(SCRIPT_DIR, "fixtures"))
+
+# Wake word: enrolled recordings of "Loki" (record them with --enroll-wake-word);
+# with none present every utterance goes to the recognizer as before
+WAKE_WORD_DIR = os.environ.get("LOKI_WAKE_WORDS", os.path.join(SCRIPT_DIR, "wake_word"))
+
+# Rendered speech is cached here
+TTS_CACHE_DIR = os.environ.get("LOKI_TTS_CACHE", os.path.join(SCRIPT_DIR, "tts_cache"))
+
+# ---------- Audio capture ----------
+class AudioRingBuffer:
+    """Preallocated circular buffer of mono samples, addressed by absolute sample index."""
+
+    def __init__(self, capacity, dtype='int16'):
+        self.capacity = int(capacity)
+        self._buf = np.zeros(self.capacity, dtype=dtype)
+        self._written = 0
+        self._cond = threading.Condition()
+
+    @property
+    def position(self):
+        """Absolute index one past the newest sample written."""
+        return self._written
+
+    @property
+    def oldest(self):
+        """Absolute index of the oldest sample still held."""
+        return max(0, self._written - self.capacity)
+
+    def write(self, samples):
+        n = len(samples)
+        if n == 0:
+            return
+        with self._cond:
+            if n > self.capacity:
+                self._written += n - self.capacity
+                samples = samples[-self.capacity:]
+                n = self.capacity
+            start = self._written % self.capacity
+            first = min(n, self.capacity - start)
+            self._buf[start:start + first] = samples[:first]
+            if first < n:
+                self._buf[:n - first] = samples[first:]
+            self._written += n
+            self._cond.notify_all()
+
+    def wait_for(self, position, timeout=None):
+        """Block until sample `position` has been written; False on timeout."""
+        with self._cond:
+            return self._cond.wait_for(lambda: self._written >= position, timeout)
+
+    def read(self, start, end):
+        """Copy samples [start, end) out of the buffer, clamped to what is still held."""
+        with self._cond:
+            start = max(start, self._written - self.capacity, 0)
+            end = min(end, self._written)
+            if end <= start:
+                return self._buf[:0].copy()
+            s = start % self.capacity
+            e = s + (end - start)
+            if e <= self.capacity:
+                return self._buf[s:e].copy()
+            return np.concatenate((self._buf[s:], self._buf[:e - self.capacity]))
+
+    def read_bytes(self, start, end):
+        """Like read(), but returns raw PCM bytes made with a single copy."""
+        with self._cond:
+            start = max(start, self._written - self.capacity, 0)
+            end = min(end, self._written)
+            if end <= start:
+                return b""
+            s = start % self.capacity
+            e = s + (end - start)
+            if e <= self.capacity:
+                return self._buf[s:e].tobytes()
+            return b"".join((memoryview(self._buf[s:]), memoryview(self._buf[:e - self.capacity])))
+
+class PolyphaseResampler:
+    """Streaming rational-ratio resampler (e.g. 48000 -> 16000, 44100 -> 16000).
+
+    A Kaiser-windowed sinc low-pass is split into `up` polyphase branches, so only
+    the output samples that are kept are ever computed. Each block is evaluated
+    with one NumPy gather + dot product, and filter history carries across blocks
+    so consecutive capture callbacks join without clicks.
+    """
+
+    def __init__(self, rate_in, rate_out, zero_crossings=10, rolloff=0.9, beta=8.0):
+        g = math.gcd(int(rate_in), int(rate_out))
+        self.rate_in = int(rate_in)
+        self.rate_out = int(rate_out)
+        self.up = self.rate_out // g
+        self.down = self.rate_in // g
+        n = 2 * zero_crossings * max(self.up, self.down) + 1
+        taps = -(-n // self.up)
+        cutoff = rolloff * 0.5 / max(self.up, self.down)
+        t = np.arange(n) - (n - 1) / 2.0
+        h = 2.0 * cutoff * np.sinc(2.0 * cutoff * t) * np.kaiser(n, beta) * self.up
+        h = np.concatenate((h, np.zeros(taps * self.up - n)))
+        # phases[p, k] = h[p + k * up]
+        self._phases = np.ascontiguousarray(h.reshape(taps, self.up).T, dtype=np.float32)
+        self._taps = taps
+        self._offsets = np.arange(taps)
+        self._history = np.zeros(taps - 1, dtype=np.float32)
+        self._t = 0
+
+    def process(self, block):
+        """Resample one block of int16 samples; returns int16 at the output rate."""
+        x = np.asarray(block, dtype=np.float32)
+        n_in = len(x)
+        hist = len(self._history)
+        buf = np.concatenate((self._history, x))
+        span = n_in * self.up - self._t
+        count = -(-span // self.down) if span > 0 else 0
+        if count:
+            t = self._t + self.down * np.arange(count)
+            n, p = np.divmod(t, self.up)
+            idx = (hist + n)[:, None] - self._offsets
+            y = np.einsum('ij,ij->i', self._phases[p], buf[idx])
+        else:
+            y = np.zeros(0, dtype=np.float32)
+        self._t += count * self.down - n_in * self.up
+        self._history = buf[len(buf) - hist:] if hist else self._history
+        return np.clip(np.rint(y), -32768, 32767).astype(np.int16)
+
+def negotiate_capture_rate(target=16000, device=None):
+    """Return the lowest capture rate >= `target` that the input device accepts.
+
+    Falls back to the device's default rate; the capture path resamples down to
+    `target` whenever the two differ.
+    """
+    for rate in sorted(r for r in CAPTURE_RATES if r >= target):
+        try:
+            sd.check_input_settings(device=device, samplerate=rate, channels=1, dtype='int16')
+            return rate
+        except Exception:
+            continue
+    try:
+        return int(sd.query_devices(device, 'input')['default_samplerate'])
+    except Exception:
+        return 44100
+
+class MicrophoneStream:
+    """Continuously running sd.InputStream that fills an AudioRingBuffer.
+
+    PortAudio delivers blocks on its own capture thread, so the microphone keeps
+    recording while the assistant is recognizing or acting on a command. Samples
+    are captured as int16, the format the recognizer consumes, so no conversion
+    pass is needed later.
+
+    The ring buffer always holds `sample_rate` audio. The device is opened at the
+    lowest rate it supports at or above that, and resampled in the callback if needed.
+    """
+
+    def __init__(self, sample_rate=RECOGNIZER_SAMPLE_RATE, buffer_seconds=30, block_duration=0.05,
+                 device=None, capture_rate=None):
+        self.sample_rate = sample_rate
+        self.device = device
+        self.capture_rate = capture_rate
+        self.block_duration = block_duration
+        self.block_size = None
+        self.resampler = None
+        self.ring = AudioRingBuffer(int(sample_rate * buffer_seconds))
+        self.overflows = 0
+        self._stream = None
+
+    @property
+    def active(self):
+        return self._stream is not None
+
+    def start(self):
+        if self._stream is not None:
+            return
+        if self.capture_rate is None:
+            self.capture_rate = negotiate_capture_rate(self.sample_rate, self.device)
+        if self.capture_rate != self.sample_rate and self.resampler is None:
+            self.resampler = PolyphaseResampler(self.capture_rate, self.sample_rate)
+        self.block_size = max(1, int(self.capture_rate * self.block_duration))
+        stream = sd.InputStream(samplerate=self.capture_rate, channels=1, dtype='int16',
+                                blocksize=self.block_size, device=self.device,
+                                callback=self._callback)
+        stream.start()
+        self._stream = stream
+
+    def _callback(self, indata, frames, time_info, status):
+        if status:
+            self.overflows += 1
+        block = indata[:, 0]
+        if self.resampler is not None:
+            block = self.resampler.process(block)
+        self.ring.write(block)
+
+    def stop(self):
+        stream, self._stream = self._stream, None
+        if stream is None:
+            return
+        try:
+            stream.stop()
+            stream.close()
+        except Exception:
+            pass
+
+class VoiceActivityDetector:
+    """Frame classifier based on short-time energy and zero-crossing rate.
+
+    Frames are scored a whole block at a time with NumPy. The noise floor tracks
+    the background level from frames judged silent, so thresholds follow the room.
+    """
+
+    def __init__(self, sample_rate, frame_ms=20, energy_ratio=3.0, zcr_energy_ratio=1.5,
+                 zcr_threshold=0.25, adapt_rate=0.05, min_noise=1e-4):
+        self.sample_rate = sample_rate
+        self.frame_len = max(1, int(sample_rate * frame_ms / 1000))
+        self.energy_ratio = energy_ratio
+        self.zcr_energy_ratio = zcr_energy_ratio
+        self.zcr_threshold = zcr_threshold
+        self.adapt_rate = adapt_rate
+        self.min_noise = min_noise
+        self.noise_floor = None
+        self.last_energy = None
+
+    def features(self, frames):
+        """Return per-frame RMS energy (full scale = 1.0) and zero-crossing rate."""
+        x = frames.astype(np.float32)
+        if np.issubdtype(frames.dtype, np.integer):
+            x *= 1.0 / 32768.0
+        energy = np.sqrt(np.mean(x * x, axis=1))
+        signs = np.signbit(x)
+        zcr = np.count_nonzero(signs[:, 1:] != signs[:, :-1], axis=1) / max(1, x.shape[1] - 1)
+        return energy, zcr
+
+    def classify(self, frames):
+        """Return a boolean speech mask for an (n_frames, frame_len) block."""
+        energy, zcr = self.features(frames)
+        self.last_energy = energy
+        if energy.size == 0:
+            return np.zeros(0, dtype=bool)
+        if self.noise_floor is None:
+            self.noise_floor = max(self.min_noise, float(np.percentile(energy, 20)))
+        floor = self.noise_floor
+        speech = (energy > floor * self.energy_ratio) | \
+                 ((energy > floor * self.zcr_energy_ratio) & (zcr > self.zcr_threshold))
+        quiet = energy[~speech]
+        if quiet.size:
+            alpha = 1.0 - (1.0 - self.adapt_rate) ** quiet.size
+            floor += alpha * (float(quiet.mean()) - floor)
+        else:
+            # a louder steady background would otherwise read as endless speech
+            floor += self.adapt_rate * 0.1 * max(0.0, float(energy.min()) - floor)
+        self.noise_floor = max(self.min_noise, floor)
+        return speech
+
+class UtteranceEndpointer:
+    """Turns per-frame VAD decisions into utterance boundaries on the capture timeline.
+
+    An utterance starts after `onset_frames` consecutive speech frames (plus a short
+    pre-roll so the first phoneme is kept) and ends once `hangover_ms` of silence
+    follows the last speech frame. Boundaries are absolute ring-buffer positions.
+    With an `echo_gate`, frames that are only the assistant's own voice count as silence.
+    """
+
+    def __init__(self, vad, onset_frames=3, hangover_ms=300, preroll_ms=150, tail_ms=100,
+                 max_utterance=15.0, echo_gate=None):
+        self.vad = vad
+        self.echo_gate = echo_gate
+        self.frame_len = vad.frame_len
+        frame_ms = 1000.0 * vad.frame_len / vad.sample_rate
+        self.onset_frames = onset_frames
+        self.hangover_frames = max(1, int(round(hangover_ms / frame_ms)))
+        self.preroll = int(vad.sample_rate * preroll_ms / 1000)
+        self.tail = int(vad.sample_rate * tail_ms / 1000)
+        self.max_samples = int(vad.sample_rate * max_utterance)
+        self.reset()
+
+    def reset(self):
+        self.start = None
+        self._run = 0
+        self._silence = 0
+        self._speech_end = None
+
+    @property
+    def in_speech(self):
+        return self.start is not None
+
+    def feed(self, frames, first_pos):
+        """Consume a block of frames starting at `first_pos`; return (start, end) once an utterance ends."""
+        speech = self.vad.classify(frames)
+        if self.echo_gate is not None:
+            speech &= ~self.echo_gate.echo_mask(self.vad.last_energy, first_pos)
+        frame_len = self.frame_len
+        for i, is_speech in enumerate(speech):
+            pos = first_pos + i * frame_len
+            if self.start is None:
+                if not is_speech:
+                    self._run = 0
+                    continue
+                self._run += 1
+                if self._run >= self.onset_frames:
+                    onset = pos - (self.onset_frames - 1) * frame_len
+                    self.start = max(0, onset - self.preroll)
+                    self._speech_end = pos + frame_len
+                    self._silence = 0
+                continue
+            if is_speech:
+                self._speech_end = pos + frame_len
+                self._silence = 0
+            else:
+                self._silence += 1
+                if self._silence >= self.hangover_frames:
+                    return self.start, min(self._speech_end + self.tail, pos + frame_len)
+            if pos + frame_len - self.start >= self.max_samples:
+                return self.start, pos + frame_len
+        return None
+
+# ---------- Speech recognition backends ----------
+class RecognizerBackend:
+    """Turns captured sr.AudioData into text and keeps latency statistics.
+
+    Like SpeechRecognition's recognize_* methods, backends raise sr.UnknownValueError
+    when nothing intelligible was heard and sr.RequestError when the engine failed.
+    """
+
+    name = 'base'
+
+    def __init__(self):
+        self.calls = 0
+        self.failures = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self.last_latency = 0.0
+        self._lock = threading.Lock()
+
+    def recognize(self, audio):
+        start = time.perf_counter()
+        ok = False
+        try:
+            text = self._recognize(audio)
+            ok = True
+            return text
+        finally:
+            latency = time.perf_counter() - start
+            with self._lock:
+                self.calls += 1
+                self.failures += 0 if ok else 1
+                self.total_latency += latency
+                self.last_latency = latency
+                self.max_latency = max(self.max_latency, latency)
+
+    def _recognize(self, audio):
+        raise NotImplementedError
+
+    def stats(self):
+        with self._lock:
+            n = self.calls or 1
+            return {
+                'backend': self.name,
+                'calls': self.calls,
+                'failures': self.failures,
+                'avg_ms': 1000.0 * self.total_latency / n,
+                'max_ms': 1000.0 * self.max_latency,
+                'last_ms': 1000.0 * self.last_latency,
+            }
+
+class GoogleRecognizerBackend(RecognizerBackend):
+    """Google Web Speech API (needs network)."""
+
+    name = 'google'
+
+    def __init__(self, recognizer=None):
+        super().__init__()
+        self.recognizer = recognizer or sr.Recognizer()
+
+    def _recognize(self, audio):
+        return self.recognizer.recognize_google(audio)
+
+class VoskRecognizerBackend(RecognizerBackend):
+    """Offline recognition with a local Vosk model (https://alphacephei.com/vosk/models)."""
+
+    name = 'vosk'
+
+    def __init__(self, model_path=VOSK_MODEL_PATH):
+        super().__init__()
+        if not vosk:
+            raise RuntimeError("Please install vosk for offline recognition: pip install vosk")
+        if not os.path.isdir(model_path):
+            raise RuntimeError(f"Vosk model not found at {model_path}")
+        try:
+            vosk.SetLogLevel(-1)
+        except Exception:
+            pass
+        self.model = vosk.Model(model_path)
+
+    def _recognize(self, audio):
+        rec = vosk.KaldiRecognizer(self.model, audio.sample_rate)
+        rec.AcceptWaveform(audio.get_raw_data(convert_width=2))
+        text = json.loads(rec.FinalResult()).get('text', '')
+        if not text:
+            raise sr.UnknownValueError()
+        return text
+
+class FixtureRecognizerBackend(RecognizerBackend):
+    """Deterministic stand-in that maps audio fixtures to their known transcripts.
+
+    Fixtures are WAV files in `fixture_dir`, each with its transcript in a sidecar
+    .txt file or in a transcripts.json mapping file name -> text. Captured audio is
+    matched to the closest fixture by a silence-trimmed energy-envelope fingerprint,
+    so a replayed fixture yields the same transcript however it was endpointed.
+    """
+
+    name = 'fixture'
+    ENVELOPE_POINTS = 32
+
+    def __init__(self, fixture_dir=FIXTURE_DIR, max_distance=0.35):
+        super().__init__()
+        if not os.path.isdir(fixture_dir):
+            raise RuntimeError(f"Fixture directory not found: {fixture_dir}")
+        self.fixture_dir = fixture_dir
+        self.max_distance = max_distance
+        self.fixtures = []
+        transcripts = {}
+        index = os.path.join(fixture_dir, 'transcripts.json')
+        if os.path.exists(index):
+            with open(index, encoding='utf-8') as f:
+                transcripts = json.load(f)
+        for name in sorted(os.listdir(fixture_dir)):
+            if not name.lower().endswith('.wav'):
+                continue
+            path = os.path.join(fixture_dir, name)
+            text = transcripts.get(name)
+            sidecar = os.path.splitext(path)[0] + '.txt'
+            if text is None and os.path.exists(sidecar):
+                with open(sidecar, encoding='utf-8') as f:
+                    text = f.read().strip()
+            if text is None:
+                continue
+            with wave.open(path, 'rb') as wf:
+                pcm = np.frombuffer(wf.readframes(wf.getnframes()), dtype=np.int16)
+                if wf.getnchannels() > 1:
+                    pcm = pcm[::wf.getnchannels()]
+                rate = wf.getframerate()
+            fp = self.fingerprint(pcm, rate)
+            if fp is not None:
+                self.fixtures.append((name, fp[0], fp[1], text))
+
+    @classmethod
+    def fingerprint(cls, pcm, sample_rate):
+        """Return (normalized energy envelope, active duration in 10 ms frames), or None for silence."""
+        frame = max(1, sample_rate // 100)
+        n = len(pcm) // frame
+        if n == 0:
+            return None
+        x = pcm[:n * frame].astype(np.float32).reshape(n, frame) / 32768.0
+        energy = np.sqrt(np.mean(x * x, axis=1))
+        active = np.flatnonzero(energy > max(energy.max() * 0.1, 1e-4))
+        if active.size == 0:
+            return None
+        env = energy[active[0]:active[-1] + 1]
+        points = np.interp(np.linspace(0, len(env) - 1, cls.ENVELOPE_POINTS), np.arange(len(env)), env)
+        norm = np.linalg.norm(points)
+        return (points / norm if norm else points), len(env)
+
+    def match(self, audio):
+        """Return (fixture name, transcript, distance) of the closest fixture, or None."""
+        pcm = np.frombuffer(audio.get_raw_data(convert_width=2), dtype=np.int16)
+        fp = self.fingerprint(pcm, audio.sample_rate)
+        if fp is None or not self.fixtures:
+            return None
+        env, duration = fp
+        best = None
+        for name, f_env, f_duration, text in self.fixtures:
+            distance = float(np.linalg.norm(env - f_env)) + abs(math.log(duration / f_duration))
+            if best is None or distance < best[2]:
+                best = (name, text, distance)
+        return best
+
+    def _recognize(self, audio):
+        best = self.match(audio)
+        if best is None or best[2] > self.max_distance:
+            raise sr.UnknownValueError()
+        return best[1]
+
+RECOGNIZER_BACKENDS = {
+    'google': GoogleRecognizerBackend,
+    'vosk': VoskRecognizerBackend,
+    'fixture': FixtureRecognizerBackend,
+}
+
+# ---------- Wake word ----------
+@functools.lru_cache(maxsize=8)
+def _mel_filterbank(sample_rate, n_fft, n_mels):
+    def hz_to_mel(f):
+        return 2595.0 * np.log10(1.0 + f / 700.0)
+    mels = np.linspace(hz_to_mel(60.0), hz_to_mel(sample_rate / 2.0), n_mels + 2)
+    hz = 700.0 * (10.0 ** (mels / 2595.0) - 1.0)
+    bins = np.floor((n_fft + 1) * hz / sample_rate).astype(int)
+    fb = np.zeros((n_mels, n_fft // 2 + 1), dtype=np.float32)
+    for m in range(1, n_mels + 1):
+        left, center, right = bins[m - 1], bins[m], bins[m + 1]
+        center = max(center, left + 1)
+        right = max(right, center + 1)
+        fb[m - 1, left:center] = (np.arange(left, center) - left) / (center - left)
+        fb[m - 1, center:right] = (right - np.arange(center, right)) / (right - center)
+    return fb
+
+def log_mel_features(pcm, sample_rate, n_mels=24, frame_ms=25, hop_ms=10):
+    """Log-mel frames of int16 PCM, each normalized to zero mean so input gain doesn't matter."""
+    x = np.asarray(pcm, dtype=np.float32) / 32768.0
+    frame = int(sample_rate * frame_ms / 1000)
+    hop = int(sample_rate * hop_ms / 1000)
+    if len(x) < frame:
+        return np.zeros((0, n_mels), dtype=np.float32)
+    n = 1 + (len(x) - frame) // hop
+    frames = np.lib.stride_tricks.as_strided(x, shape=(n, frame), strides=(x.strides[0] * hop, x.strides[0]))
+    n_fft = 1 << (frame - 1).bit_length()
+    spec = np.abs(np.fft.rfft(frames * np.hamming(frame).astype(np.float32), n_fft)) ** 2
+    feats = np.log(spec @ _mel_filterbank(sample_rate, n_fft, n_mels).T + 1e-10)
+    feats -= feats.mean(axis=1, keepdims=True)
+    return feats.astype(np.float32)
+
+def _subsequence_dtw(template, query, max_start):
+    """Best DTW match of `template` against a prefix region of `query`.
+
+    The match must start within the first `max_start` query frames and may end
+    anywhere. Steps (1,0), (1,1) and (1,2) only look at the previous template row,
+    so each row is one vectorized update. Returns (cost per template frame, end frame).
+    """
+    t = template / (np.linalg.norm(template, axis=1, keepdims=True) + 1e-8)
+    q = query / (np.linalg.norm(query, axis=1, keepdims=True) + 1e-8)
+    cost = 1.0 - t @ q.T
+    m, n = cost.shape
+    row = np.full(n, np.inf, dtype=np.float32)
+    row[:max_start] = cost[0, :max_start]
+    for i in range(1, m):
+        best = row.copy()
+        np.minimum(best[1:], row[:-1], out=best[1:])
+        np.minimum(best[2:], row[:-2], out=best[2:])
+        row = cost[i] + best
+    end = int(np.argmin(row))
+    return float(row[end]) / m, end
+
+class WakeWordGate:
+    """Cheap on-device wake-word spotter in front of the full recognizer.
+
+    Each captured utterance is compared with enrolled recordings of the wake word by
+    DTW over log-mel frames. Utterances that start with the wake word go on with the
+    wake word cut off; a bare wake word lets the next utterance through within
+    `follow_up` seconds. Everything else is dropped before it costs a recognizer call.
+    With no enrolled templates the gate is disabled and passes everything.
+    """
+
+    HOP_MS = 10
+
+    def __init__(self, template_dir=WAKE_WORD_DIR, threshold=None, follow_up=6.0,
+                 search_seconds=1.6, max_start_seconds=0.4):
+        self.template_dir = template_dir
+        self.follow_up = follow_up
+        self.search_seconds = search_seconds
+        self.max_start_seconds = max_start_seconds
+        self.templates = []
+        self.threshold = threshold
+        self.armed_until = 0.0
+        self.woke = False
+        self.checked = 0
+        self.passed = 0
+        self.rejected = 0
+        self.audio_seconds = 0.0
+        self.cpu_seconds = 0.0
+        self._lock = threading.Lock()
+        if os.path.isdir(template_dir):
+            for name in sorted(os.listdir(template_dir)):
+                if name.lower().endswith('.wav'):
+                    try:
+                        self.add_template(os.path.join(template_dir, name))
+                    except Exception as e:
+                        print(f"Skipping wake word template {name}: {e}")
+        if self.threshold is None:
+            self.threshold = self._calibrate()
+
+    @property
+    def enabled(self):
+        return bool(self.templates)
+
+    def add_template(self, path):
+        with wave.open(path, 'rb') as wf:
+            pcm = np.frombuffer(wf.readframes(wf.getnframes()), dtype=np.int16)
+            rate = wf.getframerate()
+        feats = log_mel_features(self._trim(pcm, rate), rate)
+        if len(feats) >= 5:
+            self.templates.append((rate, feats))
+
+    @staticmethod
+    def _trim(pcm, sample_rate):
+        """Drop leading/trailing frames more than 20 dB below the loudest one."""
+        frame = max(1, sample_rate // 100)
+        n = len(pcm) // frame
+        if n == 0:
+            return pcm
+        x = pcm[:n * frame].astype(np.float32).reshape(n, frame)
+        energy = np.sqrt(np.mean(x * x, axis=1))
+        active = np.flatnonzero(energy > energy.max() * 0.1)
+        if active.size == 0:
+            return pcm
+        return pcm[active[0] * frame:(active[-1] + 1) * frame]
+
+    def _calibrate(self):
+        """Accept matches up to 1.5x the worst distance between enrolled templates, within sane bounds."""
+        worst = 0.0
+        for i, (_, a) in enumerate(self.templates):
+            for _, b in self.templates[i + 1:]:
+                worst = max(worst, _subsequence_dtw(a, b, max(1, len(b) // 4))[0])
+        if not worst:
+            return 0.25
+        return min(max(worst * 1.5, 0.12), 0.3)
+
+    def spot(self, pcm, sample_rate):
+        """Return (distance, end sample) of the best wake-word match at the start of `pcm`."""
+        query = log_mel_features(pcm[:int(sample_rate * self.search_seconds)], sample_rate)
+        if len(query) == 0:
+            return math.inf, 0
+        max_start = max(1, int(self.max_start_seconds * 1000 / self.HOP_MS))
+        best = (math.inf, 0)
+        for rate, template in self.templates:
+            if rate != sample_rate:
+                continue
+            distance, end = _subsequence_dtw(template, query, max_start)
+            if distance < best[0]:
+                best = (distance, end)
+        frame = int(sample_rate * 25 / 1000)
+        hop = int(sample_rate * self.HOP_MS / 1000)
+        return best[0], best[1] * hop + frame
+
+    def check(self, audio):
+        """Return the audio the recognizer should see (wake word removed), or None to drop it."""
+        self.woke = False
+        if not self.templates:
+            return audio
+        cpu_start = time.process_time()
+        pcm = np.frombuffer(audio.frame_data, dtype=np.int16)
+        try:
+            if time.time() < self.armed_until:
+                self.armed_until = 0.0
+                self._count(passed=True)
+                return audio
+            distance, cut = self.spot(pcm, audio.sample_rate)
+            if distance > self.threshold:
+                self._count(passed=False)
+                return None
+            rest = pcm[cut:]
+            if self._has_speech(rest, pcm[:cut], audio.sample_rate):
+                self._count(passed=True)
+                return sr.AudioData(rest.tobytes(), audio.sample_rate, 2)
+            # bare wake word: listen for the command in the next utterance
+            self.armed_until = time.time() + self.follow_up
+            self.woke = True
+            self._count(passed=False)
+            return None
+        finally:
+            with self._lock:
+                self.audio_seconds += len(pcm) / audio.sample_rate
+                self.cpu_seconds += time.process_time() - cpu_start
+
+    @staticmethod
+    def _has_speech(rest, wake, sample_rate):
+        frame = max(1, sample_rate // 50)
+        if len(rest) < sample_rate * 0.3 or len(wake) < frame:
+            return False
+        def frame_energy(x):
+            n = len(x) // frame
+            f = x[:n * frame].astype(np.float32).reshape(n, frame)
+            return np.sqrt(np.mean(f * f, axis=1))
+        return bool(frame_energy(rest).max() > 0.25 * frame_energy(wake).max())
+
+    def _count(self, passed):
+        with self._lock:
+            self.checked += 1
+            if passed:
+                self.passed += 1
+            else:
+                self.rejected += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'checked': self.checked,
+                'passed': self.passed,
+                'rejected': self.rejected,
+                'audio_s': self.audio_seconds,
+                'cpu_ms': 1000.0 * self.cpu_seconds,
+                'cpu_ms_per_audio_s': 1000.0 * self.cpu_seconds / self.audio_seconds if self.audio_seconds else 0.0,
+            }
+
+# ---------- Speech synthesis ----------
+# Child processes for PersistentSynthesizer. Both read one JSON request per line on stdin,
+# {"id", "text", "voice", "path"}, and answer {"id", "ok", "error"} on stdout once the text
+# has been spoken (or written as a WAV to "path"). The first line out is a ready message.
+SAPI_HOST_SCRIPT = r"""
+Add-Type -AssemblyName System.Speech
+$synth = New-Object System.Speech.Synthesis.SpeechSynthesizer
+$synth.Rate = 0
+$synth.Volume = 100
+[Console]::OutputEncoding = [System.Text.Encoding]::UTF8
+[Console]::Out.WriteLine('{"id": 0, "ok": true, "ready": "sapi"}')
+[Console]::Out.Flush()
+while ($null -ne ($line = [Console]::In.ReadLine())) {
+    $req = $line | ConvertFrom-Json
+    try {
+        if ($req.voice) { $synth.SelectVoice([string]$req.voice) }
+        if ($req.path) { $synth.SetOutputToWaveFile([string]$req.path) }
+        $synth.Speak([string]$req.text)
+        $reply = @{id = $req.id; ok = $true}
+    } catch {
+        $reply = @{id = $req.id; ok = $false; error = $_.Exception.Message}
+    } finally {
+        if ($req.path) { $synth.SetOutputToDefaultAudioDevice() }
+    }
+    [Console]::Out.WriteLine(($reply | ConvertTo-Json -Compress))
+    [Console]::Out.Flush()
+}
+"""
+
+PYTHON_SYNTH_HOST = r"""
+import json, sys, time, wave
+kind = sys.argv[1]
+engine = None
+if kind != 'fake':
+    import pyttsx3
+    engine = pyttsx3.init('espeak' if kind == 'espeak' else None)
+print(json.dumps({"id": 0, "ok": True, "ready": kind}), flush=True)
+for line in sys.stdin:
+    req = json.loads(line)
+    try:
+        if engine is None:
+            # fake voice for tests: 1 ms per character, silence when rendering
+            if req["text"] == "__crash__":
+                sys.exit(3)
+            time.sleep(0.001 * len(req["text"]))
+            if req.get("path"):
+                with wave.open(req["path"], "wb") as wf:
+                    wf.setnchannels(1)
+                    wf.setsampwidth(2)
+                    wf.setframerate(16000)
+                    wf.writeframes(b"\0\0" * 16 * len(req["text"]))
+        else:
+            if req.get("voice"):
+                engine.setProperty("voice", req["voice"])
+            if req.get("path"):
+                engine.save_to_file(req["text"], req["path"])
+            else:
+                engine.say(req["text"])
+            engine.runAndWait()
+        reply = {"id": req["id"], "ok": True}
+    except Exception as e:
+        reply = {"id": req["id"], "ok": False, "error": str(e)}
+    print(json.dumps(reply), flush=True)
+"""
+
+def synth_host_command(kind=None):
+    """Command line for a synthesizer child: 'sapi' (Windows), 'espeak', 'pyttsx3' or 'fake'."""
+    kind = kind or ('sapi' if platform.system().lower() == 'windows' else 'espeak')
+    if kind == 'sapi':
+        return ['powershell', '-NoProfile', '-NonInteractive', '-Command', SAPI_HOST_SCRIPT]
+    return [sys.executable, '-c', PYTHON_SYNTH_HOST, kind]
+
+class PersistentSynthesizer:
+    """One long-lived speech synthesizer process fed utterances over stdin.
+
+    The child loads its voice once, so each utterance costs a line of JSON each way
+    instead of a process launch. A child that crashes or stops answering is killed
+    and started again on the next request; after `max_start_failures` failed starts
+    in a row the synthesizer reports itself unavailable.
+    """
+
+    def __init__(self, command=None, timeout=30.0, start_timeout=15.0, max_start_failures=3):
+        self.command = command or synth_host_command()
+        self.timeout = timeout
+        self.start_timeout = start_timeout
+        self.max_start_failures = max_start_failures
+        self.starts = 0
+        self.start_failures = 0
+        self.requests = 0
+        self.failures = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self._proc = None
+        self._replies = None
+        self._next_id = 0
+        self._lock = threading.Lock()
+
+    @property
+    def available(self):
+        return self.start_failures < self.max_start_failures
+
+    @property
+    def running(self):
+        return self._proc is not None and self._proc.poll() is None
+
+    def start(self):
+        """Launch the child (if not running) and wait for its ready line."""
+        with self._lock:
+            self._ensure_started()
+
+    def _ensure_started(self):
+        if self.running:
+            return
+        self._kill()
+        if not self.available:
+            raise RuntimeError("synthesizer host keeps failing to start")
+        creationflags = getattr(subprocess, 'CREATE_NO_WINDOW', 0) if platform.system().lower() == 'windows' else 0
+        proc = None
+        try:
+            proc = subprocess.Popen(self.command, stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                    stderr=subprocess.DEVNULL, text=True, encoding='utf-8', bufsize=1,
+                                    creationflags=creationflags)
+            replies = queue.Queue()
+            threading.Thread(target=self._read_replies, args=(proc, replies), daemon=True).start()
+            ready = replies.get(timeout=self.start_timeout)
+            if ready is None or not ready.get('ok'):
+                raise RuntimeError("synthesizer host exited during startup")
+        except Exception:
+            self.start_failures += 1
+            if proc is not None:
+                proc.kill()
+            raise
+        self._proc, self._replies = proc, replies
+        self.starts += 1
+        self.start_failures = 0
+
+    @staticmethod
+    def _read_replies(proc, replies):
+        for line in proc.stdout:
+            try:
+                replies.put(json.loads(line))
+            except ValueError:
+                continue  # stray output from the voice engine
+        replies.put(None)
+
+    def _kill(self):
+        proc, self._proc = self._proc, None
+        if proc is not None:
+            try:
+                proc.kill()
+                proc.wait(timeout=2)
+            except Exception:
+                pass
+
+    def speak(self, text, voice=None, path=None):
+        """Speak `text` (or write it as a WAV to `path`) and block until the child is done."""
+        with self._lock:
+            start = time.perf_counter()
+            for attempt in (1, 2):
+                try:
+                    self._ensure_started()
+                    self._next_id += 1
+                    request = {'id': self._next_id, 'text': str(text), 'voice': voice, 'path': path}
+                    self._proc.stdin.write(json.dumps(request) + "\n")
+                    self._proc.stdin.flush()
+                    while True:
+                        reply = self._replies.get(timeout=self.timeout)
+                        if reply is None:
+                            raise RuntimeError("synthesizer host exited")
+                        if reply.get('id') == self._next_id:
+                            break
+                    break
+                except Exception:
+                    # crashed, hung or never started: restart once for this utterance
+                    self._kill()
+                    if attempt == 2 or not self.available:
+                        self.failures += 1
+                        raise
+            elapsed = time.perf_counter() - start
+            self.requests += 1
+            self.total_time += elapsed
+            self.max_time = max(self.max_time, elapsed)
+            if not reply.get('ok'):
+                self.failures += 1
+                raise RuntimeError(reply.get('error') or "synthesis failed")
+
+    def close(self):
+        with self._lock:
+            proc = self._proc
+            if proc is not None and proc.poll() is None:
+                try:
+                    proc.stdin.close()
+                    proc.wait(timeout=2)
+                except Exception:
+                    pass
+            self._kill()
+
+    def stats(self):
+        n = self.requests or 1
+        return {
+            'starts': self.starts,
+            'requests': self.requests,
+            'failures': self.failures,
+            'avg_ms': 1000.0 * self.total_time / n,
+            'max_ms': 1000.0 * self.max_time,
+        }
+
+def split_speech(text, max_chars=120, min_chars=24):
+    """Split a reply into sentences (clauses for long ones) so each can be synthesized and played in turn.
+
+    Pieces shorter than `min_chars` are joined to the next one to avoid choppy output.
+    """
+    chunks = []
+    for sentence in re.split(r'(?<=[.!?])\s+', text.strip()):
+        parts = re.split(r'(?<=[,;:—])\s+', sentence) if len(sentence) > max_chars else [sentence]
+        for part in parts:
+            if not part:
+                continue
+            if chunks and len(chunks[-1]) < min_chars:
+                chunks[-1] += ' ' + part
+            else:
+                chunks.append(part)
+    return chunks
+
+class SpeechCache:
+    """LRU cache of rendered speech keyed by (text, voice, rate, volume).
+
+    Recent renders stay in memory up to `max_bytes`. Each render is also written to
+    `cache_dir` as a WAV named by a hash of its key, so fixed phrases survive a
+    restart; the `max_files` most recently used files are kept. With no `cache_dir`
+    the cache is memory only.
+    """
+
+    def __init__(self, cache_dir=TTS_CACHE_DIR, max_bytes=32 * 1024 * 1024, max_files=500):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.bytes = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def _path(self, key):
+        digest = hashlib.sha1(json.dumps(key).encode('utf-8')).hexdigest()
+        return os.path.join(self.cache_dir, digest + '.wav')
+
+    def get(self, key, count=True):
+        """Return (int16 PCM, rate) for `key` from memory or disk, or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                if count:
+                    self.hits += 1
+                return entry
+        if self.cache_dir is None:
+            if count:
+                self.misses += 1
+            return None
+        path = self._path(key)
+        try:
+            with wave.open(path, 'rb') as wf:
+                entry = (np.frombuffer(wf.readframes(wf.getnframes()), dtype=np.int16), wf.getframerate())
+            os.utime(path)
+        except (OSError, EOFError, wave.Error):
+            if count:
+                self.misses += 1
+            return None
+        self._remember(key, entry)
+        if count:
+            self.hits += 1
+            self.disk_hits += 1
+        return entry
+
+    def put(self, key, pcm, rate):
+        self._remember(key, (pcm, rate))
+        if self.cache_dir is None:
+            return
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with wave.open(self._path(key), 'wb') as wf:
+                wf.setnchannels(1)
+                wf.setsampwidth(2)
+                wf.setframerate(rate)
+                wf.writeframes(pcm.tobytes())
+            self._prune_disk()
+        except OSError:
+            pass  # read-only or full disk: memory cache still works
+
+    def _remember(self, key, entry):
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.bytes -= old[0].nbytes
+            self._entries[key] = entry
+            self.bytes += entry[0].nbytes
+            while self.bytes > self.max_bytes and len(self._entries) > 1:
+                _, (pcm, _) = self._entries.popitem(last=False)
+                self.bytes -= pcm.nbytes
+                self.evictions += 1
+
+    def _prune_disk(self):
+        files = [os.path.join(self.cache_dir, f) for f in os.listdir(self.cache_dir) if f.endswith('.wav')]
+        if len(files) <= self.max_files:
+            return
+        files.sort(key=os.path.getmtime)
+        for path in files[:len(files) - self.max_files]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'bytes': self.bytes,
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+            }
+
+# ---------- Echo gating ----------
+class EchoGate:
+    """Tells the assistant's own voice apart from the user's on the capture timeline.
+
+    Speech that is played is registered as a reference at the ring position where
+    its echo should reach the microphone. A frame that is covered by the reference
+    only counts as speech if it is clearly louder than the loudest echo the reference
+    could produce there, so the user can talk over a long answer.
+
+    The echo delay and the speaker-to-microphone coupling are learned from the last
+    `history_seconds` of frames in the middle of played speech: the delay as the shift
+    whose reference envelope follows the mic best, the coupling as the median
+    mic/reference ratio at that shift, never below `min_coupling`. Until half a second
+    of frames agrees on a ratio to within `max_spread` (median absolute deviation of
+    its log), `coupling` is used, by default 1.0. Once the delay is known only the
+    reference within `delay_tolerance_ms` of it is taken to echo.
+    """
+
+    def __init__(self, sample_rate, frame_len, margin=1.8, tolerance_ms=160, coupling=None,
+                 min_coupling=0.05, max_spread=0.5, delay_tolerance_ms=40, history_seconds=3.0,
+                 keep_seconds=30):
+        self.sample_rate = sample_rate
+        self.frame_len = frame_len
+        self.margin = margin
+        step = max(1, frame_len // 2)
+        reach = int(sample_rate * tolerance_ms / 1000)
+        # the echo path delay is only roughly known, so look around the expected position
+        self.shifts = tuple(range(-reach, reach + 1, step))
+        self.delay_tolerance = int(sample_rate * delay_tolerance_ms / 1000)
+        self.initial_coupling = 1.0 if coupling is None else coupling
+        self.coupling = coupling
+        self.min_coupling = min_coupling
+        self.max_spread = max_spread
+        self.delay = None  # learned shift from the expected echo position, in samples
+        self.keep = int(sample_rate * keep_seconds)
+        self.segments = []  # [start, end, cumulative energy] on the capture timeline
+        self.echo_frames = 0
+        self._history = collections.deque(maxlen=max(1, int(sample_rate * history_seconds / frame_len)))
+        self._min_history = max(1, int(sample_rate * 0.5 / frame_len))
+        self._lock = threading.Lock()
+
+    def add_reference(self, start_pos, pcm):
+        """Register int16 PCM (at the capture rate) expected to echo from `start_pos` on."""
+        x = pcm.astype(np.float64) * (1.0 / 32768.0)
+        cumulative = np.concatenate(([0.0], np.cumsum(x * x)))
+        with self._lock:
+            self.segments = [s for s in self.segments if s[1] > start_pos - self.keep]
+            self.segments.append([start_pos, start_pos + len(pcm), cumulative])
+
+    def truncate(self, pos):
+        """Playback stopped early: nothing after `pos` will echo."""
+        with self._lock:
+            for seg in self.segments:
+                seg[1] = min(seg[1], max(seg[0], pos))
+
+    def active(self, pos):
+        with self._lock:
+            return any(seg[0] <= pos + self.shifts[-1] and pos + self.shifts[0] < seg[1]
+                       for seg in self.segments)
+
+    def overlaps(self, start_pos, end_pos):
+        """True if the assistant's speech could be heard anywhere in [start_pos, end_pos)."""
+        with self._lock:
+            return any(seg[0] < end_pos + self.shifts[-1] and start_pos + self.shifts[0] < seg[1]
+                       for seg in self.segments)
+
+    def shifted_energy(self, first_pos, n_frames):
+        """Per-frame RMS of the reference at each shift, and whether every shift of a frame is inside it.
+
+        Returns two (len(shifts), n_frames) arrays; frames near the start or end of the
+        played speech are the ones not covered at every shift.
+        """
+        out = np.zeros((len(self.shifts), n_frames))
+        covered = np.zeros((len(self.shifts), n_frames), dtype=bool)
+        with self._lock:
+            segments = list(self.segments)
+        starts = first_pos + np.arange(n_frames) * self.frame_len
+        for seg_start, seg_end, cumulative in segments:
+            length = seg_end - seg_start
+            if length <= 0 or starts[-1] + self.shifts[-1] + self.frame_len <= seg_start \
+                    or starts[0] + self.shifts[0] >= seg_end:
+                continue
+            for i, shift in enumerate(self.shifts):
+                a = np.clip(starts + shift - seg_start, 0, length)
+                b = np.clip(starts + shift + self.frame_len - seg_start, 0, length)
+                np.maximum(out[i], (cumulative[b] - cumulative[a]) / self.frame_len, out=out[i])
+                covered[i] |= (starts + shift >= seg_start) & (starts + shift + self.frame_len <= seg_end)
+        return np.sqrt(out), covered.all(axis=0)
+
+    def reference_energy(self, first_pos, n_frames):
+        """Per-frame RMS of the reference around each frame's expected echo position (max over shifts)."""
+        return self.shifted_energy(first_pos, n_frames)[0].max(axis=0)
+
+    def echo_mask(self, energy, first_pos):
+        """Boolean mask of frames whose energy is explained by the assistant's own speech."""
+        if not self.segments or energy.size == 0:
+            return np.zeros(energy.size, dtype=bool)
+        shifted, inside = self.shifted_energy(first_pos, energy.size)
+        if self.delay is None:
+            ref = shifted.max(axis=0)
+        else:
+            # once the delay is known only the reference close to it can echo
+            near = np.abs(np.array(self.shifts) - self.delay) <= self.delay_tolerance
+            ref = shifted[near].max(axis=0)
+        playing = ref > 1e-4
+        if not playing.any():
+            return np.zeros(energy.size, dtype=bool)
+        coupling = self.initial_coupling if self.coupling is None else self.coupling
+        echo = playing & (energy <= ref * coupling * self.margin)
+        self.echo_frames += int(np.count_nonzero(echo))
+        self._learn(energy, shifted, inside)
+        return echo
+
+    def _learn(self, energy, shifted, inside):
+        # the delay is the shift whose reference envelope follows the mic best; the coupling
+        # is the median mic/reference ratio there over frames where that reference is loud,
+        # so pauses between words don't count and a user talking over the assistant stays
+        # a minority of the history that barely moves it
+        for i in np.flatnonzero(inside):
+            self._history.append(np.concatenate(([energy[i]], shifted[:, i])))
+        if len(self._history) < self._min_history:
+            return
+        history = np.array(self._history)
+        mic = history[:, 0] - history[:, 0].mean()
+        ref = history[:, 1:] - history[:, 1:].mean(axis=0)
+        fit = (mic @ ref) / (np.linalg.norm(mic) * np.linalg.norm(ref, axis=0) + 1e-12)
+        best = int(np.argmax(fit))
+        loud = (history[:, 1 + best] > 1e-2) & (history[:, 0] > 0)
+        if np.count_nonzero(loud) < self._min_history:
+            return
+        ratios = np.log(history[loud, 0]) - np.log(history[loud, 1 + best])
+        median = float(np.median(ratios))
+        if float(np.median(np.abs(ratios - median))) > self.max_spread:
+            return  # no steady coupling yet (or the user talked most of the time)
+        self.delay = self.shifts[best]
+        self.coupling = max(self.min_coupling, math.exp(median))
+
+class SpeechPlayer:
+    """Plays rendered speech through an output stream that can be stopped mid-sentence.
+
+    `on_start(pcm, rate, delay)` runs as each chunk is queued, `delay` seconds before
+    it will be heard, so the waveform can be registered with the EchoGate; `on_stop()`
+    runs if playback was cut short.
+    """
+
+    def __init__(self, on_start=None, on_stop=None):
+        self.on_start = on_start
+        self.on_stop = on_stop
+        self.interrupted = 0
+        self.plays = 0
+        self.underruns = 0
+        self.total_first_audio = 0.0
+        self.first_audio_at = None
+        self.max_first_audio = 0.0
+        self._stop = threading.Event()
+        self._playing = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def is_playing(self):
+        return self._playing.is_set()
+
+    def play(self, pcm, rate):
+        """Play int16 mono PCM and block until it ends; returns False if stopped early."""
+        return self.play_stream([(pcm, rate)])
+
+    def play_stream(self, chunks, started=None):
+        """Play (int16 PCM, rate) chunks back to back through one output stream.
+
+        Chunks after the first are pulled on a feeder thread while earlier ones play,
+        so a generator can synthesize sentence N+1 during sentence N; one that is not
+        ready in time leaves a short silence. Time to first audio is measured from
+        `started` (default: now). Returns False if stopped early.
+        """
+        started = started or time.perf_counter()
+        with self._lock:
+            self._stop.clear()
+            chunks = iter(chunks)
+            try:
+                pcm, rate = next(chunks)
+            except StopIteration:
+                return True
+            pending = collections.deque([pcm])
+            state = {'queued': len(pcm), 'fed': False, 'first': None, 'starved': False, 'last_callback': time.perf_counter()}
+            guard = threading.Lock()
+            finished = threading.Event()
+
+            def callback(outdata, frames, time_info, status):
+                state['last_callback'] = time.perf_counter()
+                if self._stop.is_set():
+                    outdata.fill(0)
+                    raise sd.CallbackStop
+                out = outdata[:, 0]
+                filled = 0
+                with guard:
+                    while filled < frames and pending:
+                        head = pending[0]
+                        take = min(frames - filled, len(head))
+                        out[filled:filled + take] = head[:take]
+                        if take == len(head):
+                            pending.popleft()
+                        else:
+                            pending[0] = head[take:]
+                        filled += take
+                    state['queued'] -= filled
+                    done = state['fed'] and not pending
+                out[filled:] = 0
+                if filled and state['first'] is None:
+                    state['first'] = time.perf_counter()
+                if done:
+                    raise sd.CallbackStop
+                # count each gap once, not every silent block while the next sentence renders
+                if filled < frames and not state['starved']:
+                    self.underruns += 1
+                state['starved'] = filled < frames
+
+            def feed(latency):
+                try:
+                    for chunk, chunk_rate in chunks:
+                        if chunk_rate != rate:
+                            chunk = PolyphaseResampler(chunk_rate, rate).process(chunk)
+                        if self._stop.is_set() or finished.is_set():
+                            break
+                        with guard:
+                            ahead = state['queued']
+                            pending.append(chunk)
+                            state['queued'] += len(chunk)
+                        if self.on_start:
+                            self.on_start(chunk, rate, latency + ahead / rate)
+                finally:
+                    with guard:
+                        state['fed'] = True
+
+            stream = sd.OutputStream(samplerate=rate, channels=1, dtype='int16', callback=callback,
+                                     finished_callback=finished.set)
+            try:
+                latency = float(stream.latency or 0.0)
+                if self.on_start:
+                    self.on_start(pcm, rate, latency)
+                self._playing.set()
+                threading.Thread(target=feed, args=(latency,), name="loki-tts-feed", daemon=True).start()
+                stream.start()
+                # a device that stops calling back would otherwise hang the voice forever
+                while not finished.wait(0.5):
+                    if time.perf_counter() - state['last_callback'] > 2.0:
+                        break
+            finally:
+                finished.set()
+                self._playing.clear()
+                stream.close()
+            stopped = self._stop.is_set()
+            if state['first'] is not None:
+                delay = state['first'] - started
+                if self.first_audio_at is None:
+                    self.first_audio_at = state['first']
+                self.plays += 1
+                self.total_first_audio += delay
+                self.max_first_audio = max(self.max_first_audio, delay)
+        if stopped:
+            self.interrupted += 1
+            if self.on_stop:
+                self.on_stop()
+        return not stopped
+
+    def stop(self):
+        if self.is_playing:
+            self._stop.set()
+
+    def stats(self):
+        n = self.plays or 1
+        return {
+            'plays': self.plays,
+            'interrupted': self.interrupted,
+            'underruns': self.underruns,
+            'avg_first_audio_ms': 1000.0 * self.total_first_audio / n,
+            'max_first_audio_ms': 1000.0 * self.max_first_audio,
+        }
+
+# ---------- Pipeline ----------
+class AsyncStage:
+    """One stage of the capture -> recognize -> dispatch pipeline, run as an asyncio task.
+
+    Takes items from `inbox` (a source stage with no inbox produces its own), runs the
+    blocking `work` on them in `executor` and puts non-empty results on `outbox`. The
+    queues are bounded, so a slow stage holds back the one before it instead of piling
+    up audio. Work that overruns `timeout` is abandoned (its thread finishes in the
+    background) and `on_timeout` is called, so one slow call can't stall the loop.
+    """
+
+    def __init__(self, name, work, inbox, outbox, executor, timeout=None, on_timeout=None):
+        self.stage_name = name
+        self.work = work
+        self.inbox = inbox
+        self.outbox = outbox
+        self.executor = executor
+        self.timeout = timeout
+        self.on_timeout = on_timeout
+        self.processed = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self.last_latency = 0.0
+        self.total_wait = 0.0
+        self._lock = threading.Lock()
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            args = ()
+            if self.inbox is not None:
+                queued_at, item = await self.inbox.get()
+                args = (item,)
+                waited = time.perf_counter() - queued_at
+            else:
+                waited = 0.0
+            start = time.perf_counter()
+            future = loop.run_in_executor(self.executor, self.work, *args)
+            try:
+                # asyncio.wait rather than wait_for, which can swallow a cancellation
+                # that arrives just as the work finishes
+                done, _ = await asyncio.wait((future,), timeout=self.timeout)
+            finally:
+                if not future.done():
+                    future.cancel()
+            if not done:
+                self.timeouts += 1
+                print(f"{self.stage_name} stage timed out after {self.timeout:g}s")
+                if self.on_timeout:
+                    self.on_timeout(*args)
+                result = None
+            else:
+                try:
+                    result = future.result()
+                except Exception as e:
+                    self.errors += 1
+                    print(f"{self.stage_name} stage error: {e}")
+                    result = None
+            if args or result:
+                self._record(time.perf_counter() - start, waited)
+            if result and self.outbox is not None:
+                await self.outbox.put((time.perf_counter(), result))
+
+    def _record(self, latency, waited):
+        with self._lock:
+            self.processed += 1
+            self.total_latency += latency
+            self.total_wait += waited
+            self.last_latency = latency
+            self.max_latency = max(self.max_latency, latency)
+
+    def stats(self):
+        with self._lock:
+            n = self.processed or 1
+            return {
+                'depth': self.inbox.qsize() if self.inbox is not None else 0,
+                'processed': self.processed,
+                'errors': self.errors,
+                'timeouts': self.timeouts,
+                'avg_ms': 1000.0 * self.total_latency / n,
+                'max_ms': 1000.0 * self.max_latency,
+                'last_ms': 1000.0 * self.last_latency,
+                'avg_wait_ms': 1000.0 * self.total_wait / n,
+            }
+
+# ---------- Spoken arithmetic ----------
+NUMBER_WORDS = {
+    'zero': 0, 'one': 1, 'two': 2, 'three': 3, 'four': 4, 'five': 5, 'six': 6, 'seven': 7,
+    'eight': 8, 'nine': 9, 'ten': 10, 'eleven': 11, 'twelve': 12, 'thirteen': 13, 'fourteen': 14,
+    'fifteen': 15, 'sixteen': 16, 'seventeen': 17, 'eighteen': 18, 'nineteen': 19, 'twenty': 20,
+    'thirty': 30, 'forty': 40, 'fifty': 50, 'sixty': 60, 'seventy': 70, 'eighty': 80, 'ninety': 90,
+}
+SCALE_WORDS = {'thousand': 1e3, 'million': 1e6, 'billion': 1e9}
+# spoken operators, longest phrase first; anything not listed (what, is, the...) is filler
+ARITHMETIC_PHRASES = sorted({
+    ('plus',): '+', ('add',): '+', ('minus',): '-', ('negative',): 'neg',
+    ('times',): '*', ('x',): '*', ('multiplied', 'by'): '*', ('divided', 'by'): '/', ('over',): '/',
+    ('mod',): 'mod', ('modulo',): 'mod',
+    ('to', 'the', 'power', 'of'): '^', ('to', 'the', 'power'): '^', ('power', 'of'): '^',
+    ('raised', 'to'): '^', ('squared',): 'squared', ('cubed',): 'cubed',
+    ('percent',): '%', ('per', 'cent'): '%', ('percent', 'of'): '%of',
+    ('open', 'bracket'): '(', ('close', 'bracket'): ')', ('open', 'brackets'): '(', ('close', 'brackets'): ')',
+    ('open', 'parenthesis'): '(', ('close', 'parenthesis'): ')',
+}.items(), key=lambda item: -len(item[0]))
+ARITHMETIC_SYMBOLS = {'+': '+', '-': '-', '*': '*', '×': '*', '/': '/', '÷': '/', '^': '^', '**': '^',
+                      '%': '%', '(': '(', ')': ')'}
+# a word with a letter in it stays one token, hyphens and digits included: "covid-19", "mp3"
+ARITHMETIC_TOKEN_RE = re.compile(r"(?=[a-z0-9-]*[a-z])[a-z0-9]+(?:-[a-z0-9]+)*|\d+(?:,\d{3})*(?:\.\d+)?|\.\d+"
+                                 r"|\*\*|[-+*/^%()×÷]")
+# words that may sit in or after an expression ("what's 2 plus 2 equal to"); any other word
+# there means the numbers aren't arithmetic ("a 4 x 4 truck")
+ARITHMETIC_FILLERS = frozenset((
+    'what', 's', 'is', 'the', 'a', 'an', 'and', 'of', 'it', 'calculate', 'compute', 'solve', 'equals', 'equal',
+    'to', 'answer', 'result', 'how', 'much', 'please', 'tell', 'me', 'can', 'you', 'give', 'does', 'do', 'make',
+))
+MAX_EXPONENT = 1000
+
+def _spoken_number(words):
+    """Value of a run of number words and digits: ['twelve', 'hundred'] -> 1200."""
+    total, current, decimals = 0.0, 0.0, None
+    for word in words:
+        if decimals is not None and (word == 'hundred' or word in SCALE_WORDS):
+            # "2 point 5 million": the fraction is part of what the scale multiplies
+            current += float('0.' + decimals) if decimals else 0.0
+            decimals = None
+        if decimals is not None:
+            decimals += str(NUMBER_WORDS[word]) if word in NUMBER_WORDS else word
+        elif word == 'point':
+            decimals = ''
+        elif word == 'hundred':
+            current = (current or 1) * 100
+        elif word in SCALE_WORDS:
+            total += (current or 1) * SCALE_WORDS[word]
+            current = 0.0
+        elif word == 'a':
+            current += 1
+        elif word in NUMBER_WORDS:
+            current += NUMBER_WORDS[word]
+        else:
+            current += float(word.replace(',', ''))
+    value = total + current
+    if decimals:
+        value += float('0.' + decimals.replace('.', ''))
+    return value
+
+def tokenize_arithmetic(text):
+    """Spoken arithmetic as (kind, value) tokens: ('num', 1200.0), ('op', '/'), ('(', None)...
+
+    Number words and digits are folded into numbers, operator phrases into operators and
+    fillers dropped; any other word is kept as ('word', word).
+    """
+    words = []
+    for word in ARITHMETIC_TOKEN_RE.findall(text.lower()):
+        parts = word.split('-')
+        # "twenty-five" is a number; "covid-19" stays a word
+        words += parts if len(parts) > 1 and all(part in NUMBER_WORDS for part in parts) else [word]
+    tokens = []
+    run = []
+
+    def flush():
+        if run:
+            tokens.append(('num', _spoken_number(run)))
+            del run[:]
+
+    def in_decimals():
+        # digits after "point" are said one by one: "3 point 0 5", "three point one four"
+        return 'point' in run and not any(w == 'hundred' or w in SCALE_WORDS for w in run[run.index('point'):])
+
+    i = 0
+    while i < len(words):
+        word = words[i]
+        following = words[i + 1] if i + 1 < len(words) else None
+        if word[0].isdigit() or word[0] == '.':
+            # "5 6" is two numbers, "2 million" and "3 point 0 5" are one
+            if run and run[-1] not in SCALE_WORDS and run[-1] not in ('hundred', 'point') \
+                    and not (word.isdigit() and in_decimals()):
+                flush()
+            run.append(word)
+        elif word in NUMBER_WORDS:
+            if run and run[-1][0].isdigit() and not in_decimals():
+                flush()
+            run.append(word)
+        elif word == 'hundred' or word in SCALE_WORDS:
+            run.append(word)
+        elif word == 'point' and run and following is not None and (following in NUMBER_WORDS or following.isdigit()):
+            run.append(word)
+        elif word == 'a' and (following == 'hundred' or following in SCALE_WORDS):
+            flush()
+            run.append(word)
+        elif word == 'and' and run and (run[-1] == 'hundred' or run[-1] in SCALE_WORDS) and following in NUMBER_WORDS:
+            pass  # "one hundred and five"
+        else:
+            for phrase, op in ARITHMETIC_PHRASES:
+                if tuple(words[i:i + len(phrase)]) == phrase:
+                    break
+            else:
+                phrase, op = (word,), ARITHMETIC_SYMBOLS.get(word)
+            flush()
+            if op == 'squared' or op == 'cubed':
+                tokens += [('op', '^'), ('num', 2.0 if op == 'squared' else 3.0)]
+            elif op == '%of':
+                tokens += [('%', None), ('op', '*')]
+            elif op == 'neg':
+                tokens.append(('op', '-'))
+            elif op in ('(', ')', '%'):
+                tokens.append((op, None))
+            elif op is not None:
+                tokens.append(('op', op))
+            elif word not in ARITHMETIC_FILLERS:
+                tokens.append(('word', word))
+            i += len(phrase)
+            continue
+        i += 1
+    flush()
+    return tokens
+
+def _parse_expression(tokens, pos):
+    left, pos = _parse_term(tokens, pos)
+    while pos < len(tokens) and tokens[pos] in (('op', '+'), ('op', '-')):
+        right, next_pos = _parse_term(tokens, pos + 1)
+        left, pos = (tokens[pos][1], left, right), next_pos
+    return left, pos
+
+def _parse_term(tokens, pos):
+    left, pos = _parse_unary(tokens, pos)
+    while pos < len(tokens) and tokens[pos][0] == 'op' and tokens[pos][1] in ('*', '/', 'mod'):
+        right, next_pos = _parse_unary(tokens, pos + 1)
+        left, pos = (tokens[pos][1], left, right), next_pos
+    return left, pos
+
+def _parse_unary(tokens, pos):
+    if pos < len(tokens) and tokens[pos] == ('op', '-'):
+        operand, pos = _parse_unary(tokens, pos + 1)
+        return ('neg', operand), pos
+    return _parse_power(tokens, pos)
+
+def _parse_power(tokens, pos):
+    base, pos = _parse_atom(tokens, pos)
+    while pos < len(tokens) and tokens[pos][0] == '%':
+        base, pos = ('%', base), pos + 1
+    if pos < len(tokens) and tokens[pos] == ('op', '^'):
+        # right-associative, and binds tighter than a leading minus: -2^2 is -4
+        exponent, pos = _parse_unary(tokens, pos + 1)
+        return ('^', base, exponent), pos
+    return base, pos
+
+def _parse_atom(tokens, pos):
+    if pos >= len(tokens):
+        raise ValueError("expression ends too early")
+    kind, value = tokens[pos]
+    if kind == 'num':
+        return ('num', value), pos + 1
+    if kind == '(':
+        inner, pos = _parse_expression(tokens, pos + 1)
+        if pos < len(tokens) and tokens[pos][0] == ')':
+            pos += 1
+        elif pos < len(tokens):
+            raise ValueError("unbalanced bracket")
+        # a bracket left open at the end is closed for the speaker
+        return inner, pos
+    raise ValueError(f"unexpected {value or kind!r}")
+
+@functools.lru_cache(maxsize=256)
+def parse_arithmetic(text):
+    """AST of spoken arithmetic: nested tuples like ('+', ('num', 2.0), ('num', 2.0)).
+
+    Standard precedence (brackets, powers, times/divide/mod, plus/minus), left to right
+    otherwise. Raises ValueError if `text` holds no well-formed expression. Cached, so a
+    repeated question is parsed once.
+    """
+    tokens = tokenize_arithmetic(text)
+    # words ahead of the first number or operator are the question ("search for ..."); past
+    # it, a word between or after the operands means this isn't arithmetic
+    first = next((i for i, (kind, _) in enumerate(tokens) if kind != 'word'), len(tokens))
+    tokens = tokens[first:]
+    if any(kind == 'word' for kind, _ in tokens):
+        raise ValueError("words among the numbers")
+    if not any(kind == 'op' or kind == '%' for kind, _ in tokens):
+        raise ValueError("no arithmetic in this")
+    tree, pos = _parse_expression(tokens, 0)
+    if pos != len(tokens):
+        raise ValueError(f"unexpected {tokens[pos][1] or tokens[pos][0]!r}")
+    return tree
+
+def evaluate_arithmetic(tree):
+    """Value of a parse_arithmetic() tree. Raises ArithmeticError (division by zero,
+    huge powers) or ValueError (a complex result)."""
+    kind = tree[0]
+    if kind == 'num':
+        return tree[1]
+    if kind == 'neg':
+        return -evaluate_arithmetic(tree[1])
+    if kind == '%':
+        return evaluate_arithmetic(tree[1]) / 100.0
+    a, b = evaluate_arithmetic(tree[1]), evaluate_arithmetic(tree[2])
+    if kind == '+':
+        return a + b
+    if kind == '-':
+        return a - b
+    if kind == '*':
+        return a * b
+    if kind == '/':
+        return a / b
+    if kind == 'mod':
+        return a % b
+    if abs(b) > MAX_EXPONENT or (abs(a) > 1 and b * math.log10(abs(a)) > 300):
+        raise OverflowError("power too large")
+    result = a ** b
+    if isinstance(result, complex):
+        raise ValueError("complex result")
+    return result
+
+def solve_arithmetic(text):
+    """Answer to spoken arithmetic in `text` (int when whole), or None if there isn't any."""
+    try:
+        result = evaluate_arithmetic(parse_arithmetic(text))
+    except (ValueError, ArithmeticError):
+        return None
+    if float(result).is_integer():
+        return int(result)
+    return round(result, 6)
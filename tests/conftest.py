@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the assistants are scripts next to this directory, not an installed package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
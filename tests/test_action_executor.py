@@ -0,0 +1,112 @@
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from loki_assistant2 import ActionExecutor
+
+SLEEPER = [sys.executable, '-c', 'import time; time.sleep(30)']
+
+
+@pytest.fixture
+def pool():
+    pool = ThreadPoolExecutor(max_workers=4)
+    yield pool
+    pool.shutdown(wait=True)
+
+
+def child(seconds, spans=None):
+    """An action that runs a short-lived child process and notes when it was alive."""
+    def work():
+        started = time.perf_counter()
+        subprocess.run([sys.executable, '-c', f'import time; time.sleep({seconds})'], check=True)
+        if spans is not None:
+            spans.append((started, time.perf_counter()))
+        return seconds
+    return work
+
+
+def overlapping(spans):
+    spans = sorted(spans)
+    return any(later[0] < earlier[1] for earlier, later in zip(spans, spans[1:]))
+
+
+def test_timeout_kills_the_child_and_frees_the_resource(pool):
+    children = {}
+    done = []
+
+    def work():
+        children['sleeper'] = proc = subprocess.Popen(SLEEPER)
+        return proc.wait()
+
+    executor = ActionExecutor(pool, limits={'processes': 1}, timeout=0.3,
+                              on_timeout=lambda name: children[name].kill(),
+                              on_done=lambda name, result, error: done.append((name, result, error)))
+    started = time.perf_counter()
+    assert executor.submit('sleeper', work, resource='processes')
+    assert executor.submit('after', child(0.05), resource='processes')
+    assert executor.wait_idle(timeout=10)
+    assert time.perf_counter() - started < 10
+    assert done[0][0] == 'sleeper' and done[0][1] != 0  # killed, not finished
+    assert done[1] == ('after', 0.05, None)
+    stats = executor.stats()
+    assert (stats['timeouts'], stats['completed'], stats['pending']) == (1, 2, 0)
+
+
+def test_resource_limit_serializes_children(pool):
+    spans = []
+    executor = ActionExecutor(pool, limits={'screen': 1})
+    for _ in range(3):
+        assert executor.submit('screenshot', child(0.2, spans), resource='screen')
+    assert executor.wait_idle(timeout=10)
+    assert len(spans) == 3 and not overlapping(spans)
+
+
+def test_resource_limit_allows_that_many_at_once(pool):
+    spans = []
+    held = threading.Barrier(2, timeout=5)
+
+    def work():
+        held.wait()  # both must be running at once to get past here
+        return child(0.05, spans)()
+
+    executor = ActionExecutor(pool, limits={'processes': 2})
+    assert executor.submit('close one', work, resource='processes')
+    assert executor.submit('close two', work, resource='processes')
+    assert executor.wait_idle(timeout=10)
+    assert executor.stats()['failed'] == 0 and overlapping(spans)
+
+
+def test_too_many_pending_are_rejected(pool):
+    executor = ActionExecutor(pool, limits={'screen': 1}, max_pending=2)
+    assert executor.submit('one', child(0.1), resource='screen')
+    assert executor.submit('two', child(0.1), resource='screen')
+    assert not executor.submit('three', child(0.1), resource='screen')
+    assert executor.wait_idle(timeout=10)
+    assert executor.stats()['rejected'] == 1
+
+
+def test_shut_down_pool_drops_the_action_and_its_queue():
+    pool = ThreadPoolExecutor(max_workers=1)
+    release = threading.Event()
+    done = []
+    executor = ActionExecutor(pool, limits={'screen': 1},
+                              on_done=lambda name, result, error: done.append(name))
+    assert executor.submit('first', release.wait, resource='screen')
+    assert executor.submit('second', child(0.05), resource='screen')
+    assert executor.submit('third', child(0.05), resource='screen')
+    pool.shutdown(wait=False)
+    release.set()
+    assert executor.wait_idle(timeout=10)
+    pool.shutdown(wait=True)
+    assert done == ['first']
+    assert executor.stats()['pending'] == 0
+    # the slot was given back, so a fresh pool can run the resource again
+    with ThreadPoolExecutor(max_workers=1) as fresh:
+        executor.executor = fresh
+        assert executor.submit('fourth', child(0.05), resource='screen')
+        assert executor.wait_idle(timeout=10)
+    assert done == ['first', 'fourth']
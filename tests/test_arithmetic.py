@@ -0,0 +1,29 @@
+import pytest
+
+import loki_assistant2 as loki
+from loki_core import solve_arithmetic
+
+
+@pytest.mark.parametrize('text, expected', loki.MATH_BENCH_CASES)
+def test_spoken_arithmetic(text, expected):
+    assert solve_arithmetic(text) == expected
+
+
+@pytest.fixture(scope='module')
+def registry():
+    return loki.IntentRegistry(cache_size=0).load(loki.LokiAssistant)
+
+
+@pytest.mark.parametrize('text', [
+    "what is 12 plus 7", "calculate 9 x 8", "what is six times seven",
+    "open bracket two plus three close bracket times four", "what is 20 percent of 50",
+])
+def test_arithmetic_routes_to_math(registry, text):
+    assert registry.route(text).intent == 'math'
+
+
+@pytest.mark.parametrize('text, intent', [
+    ("search for covid-19", 'search'), ("close chrome", 'close_app'),
+])
+def test_other_commands_with_numbers_or_close_stay_put(registry, text, intent):
+    assert registry.route(text).intent == intent
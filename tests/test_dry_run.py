@@ -0,0 +1,41 @@
+import io
+import json
+import os
+import time
+
+import pytest
+
+import loki_assistant2 as loki
+import loki_core
+
+CORPUS = ["open chrome", "open chrome", "what time is it", "what time is it", "", "", "open chrome"]
+
+
+def dry_run(lines, **kwargs):
+    out = io.StringIO()
+    summary = loki.dry_run_commands(lines, out, **kwargs)
+    return [json.loads(row) for row in out.getvalue().splitlines()], summary
+
+
+def test_duplicates_are_judged_on_the_line_clock():
+    rows, summary = dry_run(CORPUS)
+    assert [row['duplicate'] for row in rows] == [False, True, False, False, False]
+    assert summary['duplicates'] == 1
+    # a second pass, however fast, routes the corpus the same way
+    assert [row['duplicate'] for row in dry_run(CORPUS)[0]] == [row['duplicate'] for row in rows]
+
+
+def test_repeats_further_apart_than_the_window_run():
+    rows, _ = dry_run(CORPUS, line_seconds=10.0)
+    assert not any(row['duplicate'] for row in rows)
+
+
+def test_stand_ins_are_removed_on_error():
+    def lines():
+        yield "open chrome"
+        raise RuntimeError("corpus went away")
+
+    with pytest.raises(RuntimeError):
+        dry_run(lines())
+    assert loki.os is os and loki.time is time
+    assert loki_core.os is os and loki_core.time is time
@@ -0,0 +1,53 @@
+import pytest
+
+import loki_assistant2 as loki
+
+
+@pytest.fixture
+def assistant():
+    with loki._stand_ins(loki._desktop_stand_ins([])):
+        assistant = loki.LokiAssistant()
+        assistant.duplicate_action_window = 5
+        yield assistant
+        assistant.shutdown()
+
+
+def said(assistant, text, at):
+    route = assistant.intents.route(text)
+    return assistant._is_duplicate(route, assistant.intents.spec(route.intent), now=at)
+
+
+def test_side_effecting_repeat_inside_the_window_is_dropped(assistant):
+    assert not said(assistant, "open chrome", at=100.0)
+    assert said(assistant, "open chrome", at=104.0)
+    assert assistant.duplicates_suppressed['open_chrome'] == 1
+
+
+def test_window_counts_from_the_last_run_not_the_last_repeat(assistant):
+    assert not said(assistant, "open chrome", at=100.0)
+    assert said(assistant, "open chrome", at=103.0)
+    assert not said(assistant, "open chrome", at=105.5)
+
+
+def test_read_only_repeat_is_not_dropped(assistant):
+    for at in (100.0, 100.5, 101.0):
+        assert not said(assistant, "what time is it", at=at)
+    assert not assistant.duplicates_suppressed
+
+
+def test_repeat_after_the_window_is_not_dropped(assistant):
+    assert not said(assistant, "open chrome", at=100.0)
+    assert not said(assistant, "open chrome", at=105.0)
+    assert not said(assistant, "open chrome", at=111.0)
+
+
+def test_another_command_in_between_breaks_the_repeat(assistant):
+    assert not said(assistant, "open chrome", at=100.0)
+    assert not said(assistant, "open camera", at=101.0)
+    assert not said(assistant, "open chrome", at=102.0)
+
+
+def test_different_slots_are_different_commands(assistant):
+    assert not said(assistant, "search for python", at=100.0)
+    assert not said(assistant, "search for numpy", at=101.0)
+    assert said(assistant, "search for numpy", at=102.0)
@@ -0,0 +1,85 @@
+import numpy as np
+import pytest
+
+from loki_core import EchoGate, UtteranceEndpointer, VoiceActivityDetector
+
+RATE = 16000
+LEAD = RATE // 2  # silence before the reply, so the VAD has a noise floor
+
+
+def speech_like(seconds, seed, rms):
+    """Noise shaped into syllables with pauses between them."""
+    rng = np.random.default_rng(seed)
+    n = int(seconds * RATE)
+    t = np.arange(n) / RATE
+    x = np.convolve(rng.standard_normal(n), np.ones(4) / 4, mode='same')
+    x *= np.clip(np.sin(2 * np.pi * 3.3 * t + rng.uniform(0, 6)), 0, None) ** 0.7
+    return x * (rms / np.sqrt(np.mean(x * x)))
+
+
+def listen_over_reply(gain, delay_ms, block_frames, user=None, seed=1):
+    """Play a 4 s reply that echoes back at `gain`, late by `delay_ms`; return utterances heard (s)."""
+    reply = np.clip(speech_like(4.0, seed, 0.2) * 32767, -32768, 32767).astype(np.int16)
+    total = LEAD + len(reply) + RATE
+    mic = np.random.default_rng(seed + 100).standard_normal(total) * 1e-3
+    delay = int(RATE * delay_ms / 1000)
+    mic[LEAD + delay:LEAD + delay + len(reply)] += gain * reply / 32768.0
+    if user is not None:
+        start, rms = user
+        voice = speech_like(0.8, seed + 7, rms)
+        mic[LEAD + int(start * RATE):LEAD + int(start * RATE) + len(voice)] += voice
+    pcm = np.clip(mic * 32767, -32768, 32767).astype(np.int16)
+
+    vad = VoiceActivityDetector(RATE)
+    gate = EchoGate(RATE, vad.frame_len)
+    endpointer = UtteranceEndpointer(vad, echo_gate=gate)
+    gate.add_reference(LEAD, reply)
+    step = block_frames * vad.frame_len
+    heard = []
+    for pos in range(0, total - step + 1, step):
+        bounds = endpointer.feed(pcm[pos:pos + step].reshape(block_frames, vad.frame_len), pos)
+        if bounds:
+            heard.append(((bounds[0] - LEAD) / RATE, (bounds[1] - LEAD) / RATE))
+            endpointer.reset()
+    return heard, gate
+
+
+@pytest.mark.parametrize('gain', (0.05, 0.2, 0.5))
+@pytest.mark.parametrize('delay_ms', (0, 60, 120))
+@pytest.mark.parametrize('block_frames', (2, 5, 10))
+def test_own_reply_is_not_heard(gain, delay_ms, block_frames):
+    heard, gate = listen_over_reply(gain, delay_ms, block_frames)
+    assert heard == []
+    assert gate.coupling == pytest.approx(gain, rel=0.2)
+    assert abs(gate.delay + RATE * delay_ms / 1000) <= gate.frame_len
+
+
+@pytest.mark.parametrize('gain', (0.05, 0.2, 0.5))
+@pytest.mark.parametrize('delay_ms', (0, 120))
+@pytest.mark.parametrize('block_frames', (2, 10))
+def test_user_talking_over_reply_is_heard(gain, delay_ms, block_frames):
+    heard, gate = listen_over_reply(gain, delay_ms, block_frames, user=(1.5, 0.3))
+    assert len(heard) == 1
+    start, end = heard[0]
+    assert 1.3 < start < 1.6 and end > 2.2
+    # talking over the reply doesn't teach the gate to ignore the user
+    assert gate.coupling == pytest.approx(gain, rel=0.2)
+
+
+def test_coupling_is_not_learned_from_the_first_words():
+    vad = VoiceActivityDetector(RATE)
+    gate = EchoGate(RATE, vad.frame_len)
+    reply = np.clip(speech_like(1.0, 3, 0.2) * 32767, -32768, 32767).astype(np.int16)
+    gate.add_reference(0, reply)
+    energy = vad.features((reply[:4 * vad.frame_len] // 10).reshape(4, vad.frame_len))[0]
+    assert gate.echo_mask(energy, 0).all()
+    assert gate.coupling is None and gate.delay is None
+
+
+def test_overlaps_and_truncate():
+    gate = EchoGate(RATE, 320)
+    gate.add_reference(RATE, np.full(RATE, 1000, dtype=np.int16))
+    assert gate.overlaps(RATE + 100, RATE + 200)
+    assert not gate.overlaps(4 * RATE, 5 * RATE)
+    gate.truncate(RATE + RATE // 4)
+    assert not gate.overlaps(RATE + RATE // 2, 2 * RATE)
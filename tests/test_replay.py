@@ -0,0 +1,57 @@
+import os
+import wave
+
+import numpy as np
+
+import loki_assistant2 as loki
+
+RATE = loki.RECOGNIZER_SAMPLE_RATE
+
+# each fixture gets its own loudness rhythm so the fixture recognizer tells them apart
+FIXTURES = {
+    'screenshot': ("take a screenshot", 2),
+    'camera': ("open camera", 4),
+    'edge': ("open edge", 7),
+}
+
+
+def write_fixture(directory, name, text, bursts):
+    t = np.arange(int(1.2 * RATE)) / RATE
+    envelope = 0.3 + 0.7 * np.abs(np.sin(np.pi * bursts * t / 1.2))
+    noise = np.random.default_rng(bursts).standard_normal(t.size)
+    pcm = np.concatenate((np.zeros(RATE // 4), noise * envelope * 0.2, np.zeros(RATE // 4)))
+    with wave.open(os.path.join(directory, name + '.wav'), 'wb') as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(RATE)
+        wf.writeframes((pcm * 32767).astype(np.int16).tobytes())
+    with open(os.path.join(directory, name + '.txt'), 'w', encoding='utf-8') as f:
+        f.write(text)
+
+
+def tree(root):
+    return sorted(os.path.relpath(os.path.join(path, name), root)
+                  for path, dirs, files in os.walk(root) for name in dirs + files
+                  if '__pycache__' not in path and '.pytest_cache' not in path and '.git' not in path)
+
+
+def test_replay_leaves_filesystem_untouched(tmp_path, monkeypatch):
+    fixtures = tmp_path / 'fixtures'
+    fixtures.mkdir()
+    for name, (text, bursts) in FIXTURES.items():
+        write_fixture(str(fixtures), name, text, bursts)
+    work = tmp_path / 'cwd'
+    work.mkdir()
+    monkeypatch.chdir(work)
+    repo = os.path.dirname(os.path.abspath(loki.__file__))
+    before = tree(repo)
+
+    report = loki.replay_fixtures(str(fixtures), speed=4.0, gap=0.1, timeout=10.0)
+
+    assert tree(repo) == before
+    assert list(work.iterdir()) == []
+    heard = {row['expected']: row for row in report['utterances']}
+    assert all(row['heard'] == text for text, row in heard.items())
+    actions = [call for row in report['utterances'] for call in row['actions']]
+    assert 'os.makedirs' in actions
+    assert 'os.system' in actions
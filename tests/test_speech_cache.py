@@ -0,0 +1,119 @@
+import os
+import threading
+
+import numpy as np
+import pytest
+
+import loki_assistant2 as loki
+from loki_core import SpeechCache
+
+RATE = 22050
+
+
+def pcm(n, value=1):
+    return np.full(n, value, dtype=np.int16)
+
+
+def key(text, voice='engine:david', rate=175):
+    return (text, voice, rate, 1.0)
+
+
+def test_least_recently_used_is_evicted_first():
+    cache = SpeechCache(cache_dir=None, max_bytes=3 * 200)
+    for text in ("one", "two", "three"):
+        cache.put(key(text), pcm(100), RATE)
+    assert cache.get(key("one")) is not None  # now the most recent
+    cache.put(key("four"), pcm(100), RATE)
+    assert cache.get(key("two")) is None
+    assert [cache.get(key(text)) is not None for text in ("one", "three", "four")] == [True, True, True]
+    stats = cache.stats()
+    assert (stats['entries'], stats['bytes'], stats['evictions']) == (3, 600, 1)
+
+
+def test_an_oversized_render_pushes_out_everything_else_but_stays():
+    cache = SpeechCache(cache_dir=None, max_bytes=400)
+    cache.put(key("short"), pcm(100), RATE)
+    cache.put(key("a long answer"), pcm(1000), RATE)
+    assert cache.get(key("short")) is None
+    assert cache.get(key("a long answer")) is not None
+    assert cache.stats()['evictions'] == 1
+
+
+def test_voice_and_rate_are_part_of_the_key():
+    cache = SpeechCache(cache_dir=None)
+    cache.put(key("Opening Chrome"), pcm(100), RATE)
+    assert cache.get(key("Opening Chrome", voice='engine:zira')) is None
+    assert cache.get(key("Opening Chrome", rate=200)) is None
+    assert cache.get(key("Opening Chrome")) is not None
+    assert (cache.hits, cache.misses) == (1, 2)
+
+
+def test_disk_entries_survive_a_restart(tmp_path):
+    SpeechCache(cache_dir=str(tmp_path)).put(key("Paused."), pcm(50, 7), RATE)
+    cache = SpeechCache(cache_dir=str(tmp_path))
+    samples, rate = cache.get(key("Paused."))
+    assert rate == RATE and samples.tolist() == [7] * 50
+    assert cache.get(key("Paused.", rate=200)) is None
+    assert (cache.disk_hits, cache.misses) == (1, 1)
+
+
+@pytest.mark.parametrize('damage', [b'', b'not a wav file', b'RIFF\x24\x00\x00\x00WAVEfmt '])
+def test_corrupted_disk_entry_is_a_miss_and_gets_rewritten(tmp_path, damage):
+    cache = SpeechCache(cache_dir=str(tmp_path))
+    with open(cache._path(key("Taking a screenshot")), 'wb') as f:
+        f.write(damage)
+    assert cache.get(key("Taking a screenshot")) is None
+    assert cache.stats()['misses'] == 1
+    cache.put(key("Taking a screenshot"), pcm(80, 3), RATE)
+    samples, _ = SpeechCache(cache_dir=str(tmp_path)).get(key("Taking a screenshot"))
+    assert samples.tolist() == [3] * 80
+
+
+def test_only_the_most_recent_files_are_kept(tmp_path):
+    cache = SpeechCache(cache_dir=str(tmp_path), max_files=2)
+    for i, text in enumerate(("one", "two", "three")):
+        cache.put(key(text), pcm(10), RATE)
+        os.utime(cache._path(key(text)), (1000 + i, 1000 + i))
+    cache.put(key("four"), pcm(10), RATE)
+    assert sorted(os.listdir(tmp_path)) == sorted(os.path.basename(cache._path(key(text)))
+                                                  for text in ("three", "four"))
+
+
+class FakeEngine:
+    def __init__(self):
+        self.properties = {'voice': 'david', 'rate': 175, 'volume': 1.0}
+
+    def getProperty(self, name):
+        return self.properties[name]
+
+
+@pytest.fixture
+def assistant():
+    with loki._stand_ins(loki._desktop_stand_ins([])):
+        assistant = loki.LokiAssistant()
+        assistant.speech_cache = SpeechCache(cache_dir=None)
+        assistant.engine = FakeEngine()
+        assistant.engine_lock = threading.Lock()
+        yield assistant
+        assistant.engine = None
+        assistant.shutdown()
+
+
+def test_changing_voice_or_rate_renders_again(assistant):
+    renders = []
+
+    def render(text):
+        renders.append((text, dict(assistant.engine.properties)))
+        return pcm(100, len(renders)), RATE
+
+    assistant._render = render
+    first = assistant.render_speech("Opening Chrome")
+    assert assistant.render_speech("Opening Chrome")[0] is first[0]
+    assistant.engine.properties['rate'] = 200
+    faster = assistant.render_speech("Opening Chrome")
+    assistant.engine.properties['voice'] = 'zira'
+    other_voice = assistant.render_speech("Opening Chrome")
+    assert len(renders) == 3
+    assert [first[0][0], faster[0][0], other_voice[0][0]] == [1, 2, 3]
+    assistant.engine.properties.update(voice='david', rate=175)
+    assert assistant.render_speech("Opening Chrome")[0] is first[0]
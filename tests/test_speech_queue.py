@@ -0,0 +1,97 @@
+import threading
+
+import pytest
+
+from loki_assistant2 import SpeechQueue
+
+
+def drain(queue):
+    queue.close()
+    spoken = []
+    while True:
+        text = queue.get(timeout=1)
+        if text is None:
+            return spoken
+        spoken.append(text)
+        queue.task_done()
+
+
+def test_coalesce_folds_a_reply_already_waiting():
+    queue = SpeechQueue(maxsize=8, policy='coalesce')
+    for text in ("Opening Chrome", "Paused.", "Opening Chrome"):
+        assert queue.put(text)
+    assert drain(queue) == ["Opening Chrome", "Paused."]
+    assert queue.stats()['coalesced'] == 1
+
+
+def test_without_coalesce_repeats_are_spoken():
+    queue = SpeechQueue(maxsize=8, policy='drop-oldest')
+    queue.put("Paused.")
+    queue.put("Paused.")
+    assert drain(queue) == ["Paused.", "Paused."]
+
+
+def test_replace_keeps_the_latest_of_a_category_in_its_place():
+    queue = SpeechQueue(maxsize=8, policy='replace')
+    queue.put("3", category='countdown')
+    queue.put("Taking a screenshot")
+    queue.put("2", category='countdown')
+    queue.put("1", category='countdown')
+    assert drain(queue) == ["1", "Taking a screenshot"]
+    assert queue.stats()['replaced'] == 2
+
+
+def test_drop_oldest_makes_room_for_the_new_reply():
+    queue = SpeechQueue(maxsize=3, policy='drop-oldest')
+    assert all(queue.put(f"reply {i}") for i in range(5))
+    assert drain(queue) == ["reply 2", "reply 3", "reply 4"]
+    stats = queue.stats()
+    assert (stats['dropped'], stats['max_depth']) == (2, 3)
+
+
+def test_drop_newest_turns_the_new_reply_away():
+    queue = SpeechQueue(maxsize=3, policy='drop-newest')
+    results = [queue.put(f"reply {i}") for i in range(5)]
+    assert results == [True, True, True, False, False]
+    assert drain(queue) == ["reply 0", "reply 1", "reply 2"]
+    assert queue.stats()['dropped'] == 2
+
+
+def test_default_policy_folds_before_it_overflows():
+    queue = SpeechQueue(maxsize=2, policy='coalesce,replace,drop-oldest')
+    queue.put("5", category='countdown')
+    queue.put("4", category='countdown')
+    queue.put("Opening Chrome")
+    queue.put("Opening Chrome")
+    queue.put("Paused.")
+    assert drain(queue) == ["Opening Chrome", "Paused."]
+    stats = queue.stats()
+    assert (stats['replaced'], stats['coalesced'], stats['dropped']) == (1, 1, 1)
+
+
+def test_unknown_policy_is_rejected():
+    with pytest.raises(ValueError):
+        SpeechQueue(policy='coalesce,drop-random')
+
+
+def test_get_blocks_until_a_reply_arrives():
+    queue = SpeechQueue(maxsize=2, policy='')
+    got = []
+    worker = threading.Thread(target=lambda: got.append(queue.get(timeout=5)))
+    worker.start()
+    queue.put("hello")
+    worker.join(5)
+    assert got == ["hello"]
+    assert queue.unfinished_tasks == 1
+    queue.task_done()
+    assert queue.unfinished_tasks == 0
+
+
+def test_clear_and_close():
+    queue = SpeechQueue(maxsize=4, policy='')
+    queue.put("one")
+    queue.put("two")
+    assert queue.clear() == 2
+    queue.close()
+    assert not queue.put("three")
+    assert queue.get(timeout=1) is None
@@ -0,0 +1,113 @@
+import threading
+
+import pytest
+
+import loki_assistant as loki
+from loki_assistant import SPEECH_CHAT, SPEECH_NORMAL, SPEECH_URGENT
+
+
+class FakeVoice:
+    """speak_fn/interrupt_fn pair: talks until released (or `seconds` pass) unless interrupted."""
+
+    def __init__(self, seconds=5.0):
+        self.seconds = seconds
+        self.spoken = []
+        self.talking = threading.Event()
+        self._release = threading.Event()
+
+    def speak(self, text):
+        if text == 'boom':
+            raise RuntimeError("voice engine broke")
+        self.spoken.append(text)
+        self._release.clear()
+        self.talking.set()
+        self._release.wait(self.seconds)
+        self.talking.clear()
+
+    def interrupt(self):
+        self._release.set()
+
+    release = interrupt
+
+
+@pytest.fixture
+def voice():
+    return FakeVoice()
+
+
+@pytest.fixture
+def scheduler(voice):
+    scheduler = loki.SpeechScheduler(voice.speak, voice.interrupt)
+    yield scheduler
+    scheduler.cancel_all()
+    scheduler.close(timeout=2.0)
+
+
+def speak_through(voice, handles):
+    """Let each utterance finish as soon as it starts, until all of `handles` are done."""
+    while not all(handle.done for handle in handles):
+        if voice.talking.wait(0.05):
+            voice.release()
+
+
+def test_lower_priority_numbers_go_first_and_ties_keep_order(scheduler, voice):
+    first = scheduler.submit("busy", SPEECH_NORMAL)
+    assert voice.talking.wait(2)
+    handles = [scheduler.submit("chat", SPEECH_CHAT), scheduler.submit("reply one", SPEECH_NORMAL),
+               scheduler.submit("error", SPEECH_URGENT), scheduler.submit("reply two", SPEECH_NORMAL)]
+    assert scheduler.depth == 4
+    speak_through(voice, [first] + handles)
+    assert voice.spoken == ["busy", "error", "reply one", "reply two", "chat"]
+    assert all(handle.state == 'done' for handle in handles)
+    assert scheduler.stats()['spoken'] == 5
+
+
+def test_preempt_cuts_off_lower_priority_speech(scheduler, voice):
+    chat = scheduler.submit("a long story", SPEECH_CHAT)
+    assert voice.talking.wait(2)
+    urgent = scheduler.submit("countdown", SPEECH_URGENT, preempt=True)
+    assert chat.wait(2) and chat.state == 'cancelled'
+    speak_through(voice, [urgent])
+    assert urgent.state == 'done'
+    assert voice.spoken == ["a long story", "countdown"]
+    assert scheduler.stats()['preempted'] == 1
+
+
+def test_preempt_leaves_equal_or_more_urgent_speech_alone(scheduler, voice):
+    current = scheduler.submit("an answer", SPEECH_NORMAL)
+    assert voice.talking.wait(2)
+    later = scheduler.submit("more", SPEECH_NORMAL, preempt=True)
+    assert not current.wait(0.2)
+    speak_through(voice, [current, later])
+    assert (current.state, later.state) == ('done', 'done')
+    assert scheduler.stats()['preempted'] == 0
+
+
+def test_handle_wait_and_cancel(scheduler, voice):
+    current = scheduler.submit("speaking now", SPEECH_NORMAL)
+    assert voice.talking.wait(2)
+    queued = scheduler.submit("never said", SPEECH_NORMAL)
+    assert queued.wait(0.05) is False and queued.state == 'queued'
+    queued.cancel()
+    assert queued.wait(0) and queued.state == 'cancelled'
+    current.cancel()  # cuts it off mid-sentence
+    assert current.wait(2) and current.state == 'cancelled'
+    assert voice.spoken == ["speaking now"]
+    assert scheduler.stats()['cancelled'] == 2
+
+
+def test_failed_speech_is_reported_and_the_next_goes_on(scheduler, voice):
+    broken = scheduler.submit("boom")
+    after = scheduler.submit("fine")
+    speak_through(voice, [broken, after])
+    assert (broken.state, after.state) == ('failed', 'done')
+    assert scheduler.stats()['failed'] == 1
+
+
+def test_close_finishes_the_queue_then_refuses_more():
+    voice = FakeVoice(seconds=0.01)
+    scheduler = loki.SpeechScheduler(voice.speak, voice.interrupt)
+    handles = [scheduler.submit(f"line {i}") for i in range(3)]
+    scheduler.close(timeout=2.0)
+    assert all(handle.state == 'done' for handle in handles)
+    assert scheduler.submit("too late").state == 'cancelled'
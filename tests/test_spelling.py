@@ -0,0 +1,45 @@
+import os
+
+import pytest
+
+import loki_assistant2 as loki
+
+
+@pytest.fixture(scope='module')
+def registry():
+    # routing shouldn't depend on whether this machine has a word list
+    saved = loki.SPELLING_WORD_LIST
+    loki.SPELLING_WORD_LIST = os.devnull
+    try:
+        yield loki.IntentRegistry(cache_size=0).load(loki.LokiAssistant)
+    finally:
+        loki.SPELLING_WORD_LIST = saved
+
+
+@pytest.mark.parametrize('text, intent', loki.SPELLING_BENCH_CASES)
+def test_spelling_sample_routes(registry, text, intent):
+    route = registry.route(text)
+    assert (route.intent if route else None) == intent
+
+
+@pytest.mark.parametrize('token', ['cameras', 'codes', 'edges', 'timer', 'opened', 'closing'])
+def test_inflections_of_vocabulary_are_left_alone(registry, token):
+    registry.route('open chrome')
+    assert registry._speller.lookup(token) == token
+
+
+def test_word_list_words_are_left_alone():
+    speller = loki.SpellingIndex(['close', 'chrome'], dictionary=frozenset(['closet']))
+    assert speller.lookup('closet') == 'closet'
+    assert speller.lookup('chorme') == 'chrome'
+
+
+def test_slots_come_from_the_words_as_heard(registry):
+    route = registry.route('search for the second world war')
+    assert route.slots['query'].endswith('second world war')
+
+
+def test_correction_only_when_nothing_else_matches(registry):
+    route = registry.route('search for closet ideas')
+    assert route.intent == 'search'
+    assert route.command == 'search for closet ideas'
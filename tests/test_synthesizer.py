@@ -0,0 +1,83 @@
+import sys
+import wave
+
+import pytest
+
+from loki_core import PersistentSynthesizer, synth_host_command
+
+# answers like the fake host, but with engine chatter and a stale reply before each real one
+NOISY_HOST = r"""
+import json, sys
+print(json.dumps({"id": 0, "ok": True, "ready": "noisy"}), flush=True)
+for line in sys.stdin:
+    req = json.loads(line)
+    print("espeak: warming up", flush=True)
+    print(json.dumps({"id": req["id"] - 1, "ok": False, "error": "stale"}), flush=True)
+    print(json.dumps({"id": req["id"], "ok": True, "text": req["text"]}), flush=True)
+"""
+
+
+@pytest.fixture
+def synth():
+    synthesizer = PersistentSynthesizer(synth_host_command('fake'), timeout=10.0)
+    yield synthesizer
+    synthesizer.close()
+
+
+def test_one_child_serves_every_utterance(synth):
+    for text in ("hello", 'quotes " and \\ backslashes', "two\nlines", "naïve café ✓"):
+        synth.speak(text)
+    assert synth.running
+    stats = synth.stats()
+    assert (stats['starts'], stats['requests'], stats['failures']) == (1, 4, 0)
+    assert stats['max_ms'] >= stats['avg_ms'] > 0
+
+
+def test_renders_to_wav(synth, tmp_path):
+    path = str(tmp_path / 'out.wav')
+    synth.speak("render me", path=path)
+    with wave.open(path, 'rb') as wf:
+        assert wf.getframerate() == 16000
+        assert wf.getnframes() == 16 * len("render me")
+
+
+def test_replies_are_matched_by_id_and_chatter_is_skipped():
+    synth = PersistentSynthesizer([sys.executable, '-c', NOISY_HOST], timeout=10.0)
+    try:
+        synth.speak("first")
+        synth.speak("second")
+        assert synth.stats()['failures'] == 0
+    finally:
+        synth.close()
+
+
+def test_restarts_after_a_crash(synth):
+    synth.speak("before")
+    with pytest.raises(RuntimeError):
+        synth.speak("__crash__")  # crashes the first child and the restarted one
+    assert not synth.running
+    synth.speak("after")
+    assert synth.running
+    stats = synth.stats()
+    assert stats['starts'] == 3
+    assert stats['requests'] == 2
+    assert stats['failures'] == 1
+
+
+def test_error_reply_is_raised_and_counted(synth, tmp_path):
+    with pytest.raises(RuntimeError):
+        synth.speak("nowhere", path=str(tmp_path / 'missing' / 'out.wav'))
+    assert synth.running  # the child answered; it doesn't need a restart
+    assert synth.stats()['failures'] == 1
+
+
+def test_gives_up_on_a_host_that_never_starts():
+    synth = PersistentSynthesizer([sys.executable, '-c', 'import sys; sys.exit(1)'], start_timeout=5.0,
+                                  max_start_failures=2)
+    for _ in range(2):
+        with pytest.raises(RuntimeError):
+            synth.start()
+    assert not synth.available
+    with pytest.raises(RuntimeError, match="keeps failing"):
+        synth.speak("hello")
+    assert synth.stats()['starts'] == 0
@@ -0,0 +1,63 @@
+import gc
+import math
+import weakref
+
+import pytest
+
+import loki_assistant2 as loki
+
+
+def convert(text):
+    query = loki.UNITS.parse(text)
+    if query is None:
+        return None
+    try:
+        return loki.UNITS.convert(*query)
+    except ValueError:
+        return None
+
+
+@pytest.mark.parametrize('text, expected', loki.UNIT_BENCH_CASES)
+def test_unit_conversion(text, expected):
+    result = convert(text)
+    if expected is None:
+        assert result is None
+    else:
+        assert result is not None and math.isclose(result, expected, rel_tol=1e-6, abs_tol=1e-6)
+
+
+def test_temperatures_are_affine():
+    assert loki.UNITS.convert(-40, 'celsius', 'fahrenheit') == pytest.approx(-40)
+    assert loki.UNITS.convert(0, 'celsius', 'kelvin') == pytest.approx(273.15)
+    assert loki.UNITS.convert(212, 'fahrenheit', 'celsius') == pytest.approx(100)
+
+
+def test_conversion_across_dimensions_is_refused():
+    with pytest.raises(ValueError):
+        loki.UNITS.convert(1, 'kilogram', 'mile')
+    assert loki.UNITS.answer(5, 'kilogram', 'mile') == "Sorry, I can't convert kilograms to miles."
+
+
+def test_each_graph_keeps_its_own_caches():
+    metric = loki.UnitGraph([d for d in loki.UNIT_DEFINITIONS if d[0] in ('meter', 'kilometer')])
+    assert metric.parse("how many meters in 2 kilometers") == (2, 'kilometer', 'meter')
+    assert metric.parse("how many feet in 2 kilometers") is None  # no feet in this graph
+    assert loki.UNITS.parse("how many feet in 2 kilometers") == (2, 'kilometer', 'foot')
+    assert metric.transform.cache_info().currsize == 0
+    assert metric.parse.cache_info().currsize == 2
+
+
+def test_a_dropped_graph_is_freed_with_its_caches():
+    graph = loki.UnitGraph()
+    graph.convert(*graph.parse("how many feet in a mile"))
+    ref = weakref.ref(graph)
+    del graph
+    gc.collect()
+    assert ref() is None
+
+
+@pytest.mark.parametrize('text', ["how many feet in 3.5 kilometers", "how many cm in 5 inches",
+                                  "convert 100 fahrenheit to celsius"])
+def test_conversions_route_to_convert(text):
+    registry = loki.IntentRegistry(cache_size=0).load(loki.LokiAssistant)
+    assert registry.route(text).intent == 'convert'